@@ -1,24 +1,26 @@
 from datetime import datetime
-import calendar
+import math
 import os
-import openai
+import time
 from dotenv import load_dotenv
 from flask import Flask, request, Response, render_template, url_for, abort, send_file
-import feedparser
-import xml.etree.ElementTree as ET
-from flask_frozen import Freezer
 import re
-from flask import Flask
 from markupsafe import Markup
+from werkzeug.exceptions import HTTPException
 import shutil
-import nltk
 
 from src.logger import setup_logger
+from src.sentences import sent_tokenize
+from src.manifest import load_manifest, is_combined
+from src.combined_store import COMBINED_FOLDER, resolve_xml_path
+from src.threads import canonical_subject, combined_filenames
+from src.feed_pages import FeedPageCache, read_feed
+from src.archive_store import get_archive_store
+from src.aggregates import update_aggregates, top_authors, author_activity, top_threads, author_slugs
 
 logger = setup_logger()
 
 load_dotenv()
-openai.api_key = os.environ.get("OPENAI_API_KEY")
 
 app = Flask(__name__, static_url_path='', static_folder='css')
 
@@ -31,7 +33,7 @@ def linkify(text):
 
 def remove_unfinished_sentences(text):
     try:
-        sentences = nltk.sent_tokenize(text)
+        sentences = sent_tokenize(text)
         if not sentences[-1].endswith(('.', '!', '?')):
             sentences = sentences[:-1]
         text = ' '.join(sentences)
@@ -44,33 +46,40 @@ def remove_unfinished_sentences(text):
 # app.jinja_env.filters['linkify'] = linkify
 app.jinja_env.filters['remove_unfinished'] = remove_unfinished_sentences
 app.config['FREEZER_DEFAULT_URL_GENERATOR'] = 'flask_frozen.url_generators.default_url_generator_with_html'
-freezer = Freezer(app)
 
 
-@freezer.register_generator
 def url_generator():
     build_path = os.path.join(app.root_path, "build")
     yield from generate_url_list(build_path)
 
 
+def aggregates_url_generator():
+    store = get_aggregates_store()
+    for dev_name in get_dev_names():
+        yield url_for("contributors", dev_name=dev_name)
+        yield url_for("top_threads_page", dev_name=dev_name)
+        for slug in author_slugs(dev_name, store=store):
+            yield url_for("contributor", dev_name=dev_name, slug=slug)
+
+
+def create_freezer():
+    # Frozen-Flask is only needed for the static build, not to serve the app
+    from flask_frozen import Freezer
+
+    freezer = Freezer(app)
+    freezer.register_generator(url_generator)
+    freezer.register_generator(aggregates_url_generator)
+    return freezer
+
+
 def save_static_html(endpoint, dev_name, year_month, type_by, build_path):
     with app.app_context():
-        folder = f'static/{dev_name}/{year_month}'
-        posts, min_date, max_date = parse_xml_files(folder)
-
-        if type_by == "thread":
-            posts = sorted(posts, key=lambda p: p['author'])
-        elif type_by == "subject":
-            posts = sorted(posts, key=lambda p: p['title'])
-        elif type_by == "date":
-            posts = sorted(posts, key=lambda p: p['date'])
-        elif type_by == "author":
-            posts = sorted(posts, key=lambda p: p['author'])
-        else:
+        if type_by not in MonthThreads.VIEWS:
             raise ValueError(f"Invalid type_by: {type_by}")
+        month = get_month_threads(f'static/{dev_name}/{year_month}')
 
-        html = render_template('thread.html', posts=posts, year_month=year_month, min_date=min_date, max_date=max_date,
-                               type_by=type_by)
+        html = render_template('thread.html', posts=month.views[type_by], dev_name=dev_name, year_month=year_month,
+                               min_date=month.min_date, max_date=month.max_date, type_by=type_by)
 
         html_folder_path = os.path.join(build_path, endpoint)
         os.makedirs(html_folder_path, exist_ok=True)
@@ -81,7 +90,7 @@ def save_static_html(endpoint, dev_name, year_month, type_by, build_path):
 
 
 def save_static_xml(dev_name, year_month, filename, build_path):
-    original_file_path = os.path.join(app.root_path, f"static/{dev_name}/{year_month}/{filename}")
+    original_file_path = resolve_xml_path(os.path.join(app.root_path, f"static/{dev_name}/{year_month}"), filename)
     xml_folder_path = os.path.join(build_path, dev_name, year_month)
     os.makedirs(xml_folder_path, exist_ok=True)
     xml_file_path = os.path.join(xml_folder_path, filename)
@@ -92,6 +101,7 @@ def save_static_xml(dev_name, year_month, filename, build_path):
 def generate_url_list(build_path=None):
     url_list = []
     data = get_year_month_data()
+    archive_store = get_archive_store()
 
     for row in data:
         year_month = row["month"].replace(" ", "_")
@@ -107,135 +117,270 @@ def generate_url_list(build_path=None):
             url_list.append(url_for("author", dev_name=row["dev_name"], year_month=year_month))
             url_list.append(url_for("date", dev_name=row["dev_name"], year_month=year_month))
 
-            posts, _, _ = parse_xml_files(folder)
-            for post in posts:
-                save_static_xml(row["dev_name"], year_month, post["filename"], build_path)
+            for record in archive_store.find(dev_name=row["dev_name"], year_month=year_month):
+                save_static_xml(row["dev_name"], year_month, record["filename"], build_path)
                 url_list.append(
-                    url_for("display_feed", dev_name=row["dev_name"], year_month=year_month, filename=post["filename"]))
+                    url_for("display_feed", dev_name=row["dev_name"], year_month=year_month,
+                            filename=record["filename"]))
 
     return url_list
 
 
 def parse_xml_files(folder):
-    files = os.listdir(os.path.join(app.root_path, folder))
-    posts = []
-    namespace = {'atom': 'http://www.w3.org/2005/Atom'}
-
-    for file in files:
-        if file.endswith('.xml'):
-            tree = ET.parse(os.path.join(folder, file))
-            root = tree.getroot()
+    month = get_month_threads(folder)
+    return month.posts, month.min_date, month.max_date
+
+
+def thread_keys(post):
+    # combined_BIP-21.xml holds the thread of "BIP-21", "Re: BIP-21", "[bitcoin-dev] Fwd: BIP-21", ...; older
+    # combined summaries are named after the raw subject of the message instead
+    if is_combined(post['filename']):
+        return [post['filename'].lower()]
+    return [name.lower() for name in combined_filenames(canonical_subject(post['title']), [post['title']])]
+
+
+class MonthThreads:
+    """
+    Posts of a month folder grouped by thread: every combined summary with its member messages, ordered by
+    date. Built once per month from the manifest, along with the post lists of the four views.
+    """
+    VIEWS = ("thread", "author", "subject", "date")
+
+    def __init__(self, posts):
+        self.posts = posts
+        self.posts_by_filename = {post['filename']: post for post in posts}
+        self.filenames = set(self.posts_by_filename)
+        combined_names = {post['filename'].lower() for post in posts if is_combined(post['filename'])}
+        # a message belongs to the combined summary present in the folder under any of its names
+        self.thread_keys = {}
+        for post in posts:
+            keys = thread_keys(post)
+            self.thread_keys[post['filename']] = next((key for key in keys if key in combined_names), keys[0])
+        self.threads = {}
+        for post in posts:
+            thread = self.threads.setdefault(self.thread_keys[post['filename']], {'combined': None, 'messages': []})
+            if is_combined(post['filename']):
+                thread['combined'] = post
+            else:
+                thread['messages'].append(post)
+        for thread in self.threads.values():
+            thread['messages'].sort(key=lambda p: p['date'])
+
+        # a month folder may hold no summary (yet)
+        self.min_date = datetime.fromisoformat(min(post['date'] for post in posts)) if posts else None
+        self.max_date = datetime.fromisoformat(max(post['date'] for post in posts)) if posts else None
+
+        by_title = sorted(posts, key=lambda p: p['title'])
+        self.views = {
+            # a thread with a combined summary is listed once, by its combined summary
+            "thread": [post for post in by_title if is_combined(post['filename'])
+                       or not self.threads[self.thread_keys[post['filename']]]['combined']],
+            "author": sorted(posts, key=lambda p: p['author']),
+            "subject": by_title,
+            "date": sorted(posts, key=lambda p: p['date']),
+        }
+
+    def combined_filename(self, filename):
+        post = self.posts_by_filename.get(filename)
+        # a message missing from the folder (e.g. an old link) goes to the combined summary of the same name
+        key = self.thread_keys[filename] if post else f"combined_{filename.split('_', 1)[-1]}".lower()
+        combined = self.threads.get(key, {}).get('combined')
+        return combined['filename'] if combined else None
+
+
+_month_cache = {}
+
+
+def get_month_threads(folder):
+    """
+    Cached thread model of a month folder (e.g. `static/bitcoin-dev/Dec_2022`). The folder mtime changes whenever
+    an XML (or the manifest) is added or replaced. The combined XMLs the pointers of the month lead to are replaced
+    in the `_combined` folder of the list instead, so its mtime is part of the signature too: two stats tell
+    whether the cached model is still valid.
+    """
+    folder_path = os.path.join(app.root_path, folder)
+    mtime = os.stat(folder_path).st_mtime_ns
+    try:
+        combined_mtime = os.stat(os.path.join(os.path.dirname(folder_path), COMBINED_FOLDER)).st_mtime_ns
+    except FileNotFoundError:
+        combined_mtime = None
+    signature = (mtime, combined_mtime)
+    cached = _month_cache.get(folder_path)
+    if cached is None or cached[0] != signature:
+        # metadata comes from the month manifest, no XML is parsed unless it is new or changed; the app does not
+        # write the manifests, the jobs writing the XMLs do
+        posts = []
+        for file, entry in load_manifest(folder_path, write=False).items():
+            author = entry['authors'][0] if entry['authors'] else None
+            posts.append({'title': entry['title'], 'author': author, 'date': entry['published'], 'filename': file})
+        cached = (signature, MonthThreads(posts))
+        _month_cache[folder_path] = cached
+    return cached[1]
+
+
+def get_month_threads_or_404(dev_name, year_month):
+    try:
+        return get_month_threads(f'static/{dev_name}/{year_month}')
+    except FileNotFoundError:
+        abort(404)
+
+
+MONTH_ORDER = {
+    'Jan': 1,
+    'Feb': 2,
+    'March': 3,
+    'April': 4,
+    'May': 5,
+    'June': 6,
+    'July': 7,
+    'Aug': 8,
+    'Sept': 9,
+    'Oct': 10,
+    'Nov': 11,
+    'Dec': 12
+}
+
+_year_month_cache = {"signature": None, "data": [], "table": []}
+
+
+def static_folders_signature():
+    """mtime of `static/` and of every list folder, it changes whenever a month folder is added or removed."""
+    static_path = os.path.join(app.root_path, 'static')
+    signature = [(static_path, os.stat(static_path).st_mtime_ns)]
+    for dev_folder in sorted(os.listdir(static_path)):
+        dev_path = os.path.join(static_path, dev_folder)
+        if os.path.isdir(dev_path):
+            signature.append((dev_path, os.stat(dev_path).st_mtime_ns))
+    return tuple(signature)
+
+
+def load_year_month_data():
+    signature = static_folders_signature()
+    if _year_month_cache["signature"] == signature:
+        return _year_month_cache
 
-            title = root.find('atom:title', namespace).text
-            author = root.find('atom:author/atom:name', namespace).text
-            date = root.find('atom:entry/atom:published', namespace).text
-            # summary = root.find('atom:entry/atom:summary', namespace).text
-            posts.append({'title': title, 'author': author, 'date': date, 'filename': file})
+    data = []
+    for dev_path, _ in signature[1:]:
+        dev_folder = os.path.basename(dev_path)
+        for f in os.listdir(dev_path):
+            month = f.split("_")[0]
+            year = f.split("_")[-1]
+            if month not in MONTH_ORDER or not year.isdigit():
+                continue
+            data.append({"month": f"{month} {year}", "dev_name": str(dev_folder)})
+    data_sorted = sorted(data, key=lambda x: (int(x['month'].split()[1]),
+                                              (MONTH_ORDER[x['month'].split()[0]])), reverse=True)
 
-    min_date = min(posts, key=lambda x: x['date'])['date']
-    max_date = max(posts, key=lambda x: x['date'])['date']
-    min_date_dt = datetime.fromisoformat(min_date)
-    max_date_dt = datetime.fromisoformat(max_date)
+    # one row per month with the lists having a folder for it, built in a single pass over the sorted data
+    table = []
+    for row in data_sorted:
+        if not table or table[-1]["month"] != row["month"]:
+            month, year = row["month"].split()
+            table.append({"month": row["month"], "year_month": f"{month}_{year}", "label": f"{month[:3]} {year}",
+                          "dev_names": set()})
+        table[-1]["dev_names"].add(row["dev_name"])
 
-    return posts, min_date_dt, max_date_dt
+    _year_month_cache.update(signature=signature, data=data_sorted, table=table)
+    return _year_month_cache
 
 
 def get_year_month_data():
-    month_order = {
-        'Jan': 1,
-        'Feb': 2,
-        'March': 3,
-        'April': 4,
-        'May': 5,
-        'June': 6,
-        'July': 7,
-        'Aug': 8,
-        'Sept': 9,
-        'Oct': 10,
-        'Nov': 11,
-        'Dec': 12
-    }
-
-    folders = os.listdir(os.path.join(app.root_path, 'static'))
-    data = []
-    for dev_folder in folders:
-        if os.path.isdir(os.path.join(app.root_path, f'static/{dev_folder}')):
-            for f in os.listdir(os.path.join(app.root_path, f'static/{dev_folder}')):
-                month = f.split("_")[0]
-                year = f.split("_")[-1]
-                data.append({"month": f"{month} {year}", "dev_name": str(dev_folder)})
-    data_sorted = sorted(data, key=lambda x: (int(x['month'].split()[1]),
-                                              (month_order[x['month'].split()[0]])), reverse=True)
+    return load_year_month_data()["data"]
 
-    return data_sorted
+
+def get_month_table():
+    return load_year_month_data()["table"]
 
 
 @app.route("/")
 def archive():
-    data = get_year_month_data()
-    return render_template('index.html', data=data)
+    return render_template('index.html', months=get_month_table())
+
+
+SEARCH_PAGE_SIZE = 20
 
 
-def sort_grouping(posts):
-    '''
-    diff between filename and title
+@app.route('/search')
+def search():
+    query = request.args.get('q', '').strip()
+    dev_name = request.args.get('dev_name') or None
+    year_month = request.args.get('year_month') or None
+    page = max(request.args.get('page', 1, type=int), 1)
 
-    for combined file
-    # filename = combined_BIP-20-Rejected-process-for-BIP-21N.xml
-    # title = Combined summary - BIP-20-Rejected-process-for-BIP-21N
+    start = time.perf_counter()
+    total, results = get_archive_store().search(query, dev_name=dev_name, year_month=year_month, page=page,
+                                                per_page=SEARCH_PAGE_SIZE)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    return render_template('search.html', query=query, dev_name=dev_name, year_month=year_month, page=page,
+                           pages=math.ceil(total / SEARCH_PAGE_SIZE), total=total, results=results,
+                           elapsed_ms=elapsed_ms)
 
-    for simple file
-    # filename = 001234_BIP-20-Rejected-process-for-BIP-21N.xml
-    # title = BIP-20-Rejected-process-for-BIP-21N
 
-    '''
+ARCHIVE_REFRESH_SECONDS = 60
+_archive_state = {"refreshed_at": None}
 
-    combined = {}
-    threads = []
-    for post in posts:
-        if "combined_" in post['filename']:
-            ckey = '_'.join(post['filename'].split("_")[1:])
-            combined[ckey] = post
-        else:
-            threads.append(post)
 
-    sorted_threads = sorted(threads, key=lambda x: x['title'])
-    for i, thread in enumerate(sorted_threads):
-        ckey = '_'.join(thread['filename'].split("_")[1:])
-        if ckey in combined:
-            sorted_threads.insert(i, combined[ckey])
-            combined.pop(ckey)
+def refresh_archive_store():
+    """
+    Sync the archive store with the XML tree (only the files changed since the last sync are read, e.g. after a
+    git pull) and bring the aggregates up to date. Run by the job scheduler at startup and then every
+    `ARCHIVE_REFRESH_SECONDS`, outside of the requests.
+    """
+    store = get_archive_store()
+    store.sync(write_manifests=False)
+    update_aggregates(store)
+    _archive_state["refreshed_at"] = time.monotonic()
+    return store
 
-    return sorted_threads
 
+def get_aggregates_store():
+    """Archive store with the aggregates up to date, refreshed by the request itself when no job keeps it fresh."""
+    refreshed_at = _archive_state["refreshed_at"]
+    if refreshed_at is None or time.monotonic() - refreshed_at > 2 * ARCHIVE_REFRESH_SECONDS:
+        return refresh_archive_store()
+    return get_archive_store()
 
-def sort_and_grouping(posts):
-    combined = {}
-    for post in posts:
-        if "combined_" in post['filename']:
-            ckey = '_'.join(post['filename'].split("_")[1:])
-            combined[ckey] = post
-    sorted_threads = sorted(posts, key=lambda x: x['title'])
-    new_threads = []
-    for thread in sorted_threads:
-        if "combined_" not in thread['filename']:
-            ckey = '_'.join(thread['filename'].split("_")[1:])
-            if ckey not in combined:
-                new_threads.append(thread)
-        else:
-            new_threads.append(thread)
 
-    return new_threads
+def get_dev_names():
+    return sorted({row["dev_name"] for row in get_year_month_data()})
+
+
+@app.route('/contributors/<dev_name>.html')
+def contributors(dev_name):
+    if dev_name not in get_dev_names():
+        abort(404)
+    authors = top_authors(dev_name, limit=200, store=get_aggregates_store())
+    return render_template('contributors.html', dev_name=dev_name, authors=authors)
+
+
+@app.route('/contributors/<dev_name>/<slug>.html')
+def contributor(dev_name, slug):
+    authors = author_activity(dev_name, slug, store=get_aggregates_store()) if dev_name in get_dev_names() else []
+    if not authors:
+        abort(404)
+    return render_template('contributor.html', dev_name=dev_name, authors=authors)
+
+
+@app.route('/threads/<dev_name>.html')
+def top_threads_page(dev_name):
+    if dev_name not in get_dev_names():
+        abort(404)
+    threads = top_threads(dev_name, limit=100, store=get_aggregates_store())
+    return render_template('top_threads.html', dev_name=dev_name, threads=threads)
+
+
+def render_month(dev_name, year_month, type_by):
+    month = get_month_threads_or_404(dev_name, year_month)
+    return render_template('thread.html', posts=month.views[type_by], dev_name=dev_name, year_month=year_month,
+                           min_date=month.min_date, max_date=month.max_date, type_by=type_by)
 
 
 @app.route('/thread/<dev_name>/<year_month>.html')
 def thread(dev_name, year_month):
     try:
-        folder = f'static/{dev_name}/{year_month}'
-        posts, min_date, max_date = parse_xml_files(folder)
-        posts = sort_and_grouping(posts)
-        return render_template('thread.html', posts=posts, dev_name=dev_name, year_month=year_month, min_date=min_date,
-                               max_date=max_date, type_by="thread")
+        return render_month(dev_name, year_month, "thread")
+    except HTTPException:
+        raise
     except Exception as e:
         logger.exception(e)
         abort(500)
@@ -243,55 +388,56 @@ def thread(dev_name, year_month):
 
 @app.route('/author/<dev_name>/<year_month>.html')
 def author(dev_name, year_month):
-    folder = f'static/{dev_name}/{year_month}'
-    posts, min_date, max_date = parse_xml_files(folder)
-    posts = sorted(posts, key=lambda p: p['author'])
-    return render_template('thread.html', posts=posts, dev_name=dev_name, year_month=year_month, min_date=min_date,
-                           max_date=max_date, type_by="author")
+    return render_month(dev_name, year_month, "author")
 
 
 @app.route('/subject/<dev_name>/<year_month>.html')
 def subject(dev_name, year_month):
-    folder = f'static/{dev_name}/{year_month}'
-    posts, min_date, max_date = parse_xml_files(folder)
-    posts = sorted(posts, key=lambda p: p['title'])
-    return render_template('thread.html', posts=posts, dev_name=dev_name, year_month=year_month, min_date=min_date,
-                           max_date=max_date, type_by="subject")
+    return render_month(dev_name, year_month, "subject")
 
 
 @app.route('/date/<dev_name>/<year_month>.html')
 def date(dev_name, year_month):
-    folder = f'static/{dev_name}/{year_month}'
-    posts, min_date, max_date = parse_xml_files(folder)
-    posts = sorted(posts, key=lambda p: p['date'])
-    return render_template('thread.html', posts=posts, dev_name=dev_name, year_month=year_month, min_date=min_date,
-                           max_date=max_date, type_by="date")
+    return render_month(dev_name, year_month, "date")
+
+
+feed_pages = FeedPageCache()
+
+
+def send_page(page):
+    """Serve a pre-rendered page in the best encoding accepted by the client, with ETag/If-None-Match support."""
+    encoding = request.accept_encodings.best_match(page.encodings, default='identity')
+    response = Response(page.variants[encoding], mimetype='text/html')
+    if encoding != 'identity':
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    response.set_etag(page.etag(encoding))
+    return response.make_conditional(request)
 
 
 @app.route('/<dev_name>/<year_month>/<filename>.html')
 def display_feed(dev_name, year_month, filename):
     filename = filename + ".xml"
-    file_url = f"./static/{dev_name}/{year_month}/{filename}"
-    xml_feed = feedparser.parse(file_url)
-    combined_filename = "combined_" + "_".join(filename.split("_")[1:])
-    if combined_filename in os.listdir(os.path.join("./static", str(dev_name), str(year_month))):
-        return render_template('feed.html', feed=xml_feed, dev_name=dev_name, year_month=year_month,
-                               filename=combined_filename)
-    else:
-        return render_template('feed.html', feed=xml_feed, dev_name=dev_name, year_month=year_month,
-                               filename=filename)
+    month = get_month_threads_or_404(dev_name, year_month)
+    if filename not in month.filenames:
+        abort(404)
+    file_path = resolve_xml_path(os.path.join(app.root_path, "static", dev_name, year_month), filename)
+    page_filename = month.combined_filename(filename) or filename
+
+    def render(xml_bytes):
+        return render_template('feed.html', feed=read_feed(xml_bytes), dev_name=dev_name, year_month=year_month,
+                               filename=page_filename)
+
+    return send_page(feed_pages.get(file_path, (dev_name, year_month, page_filename), render))
 
 
 @app.route('/<dev_name>/<year_month>/<filename>')
 def display_xml(dev_name, year_month, filename):
-    original_file_path = f"./static/{dev_name}/{year_month}/{filename}"
-    combined_filename = "combined_" + "_".join(filename.split("_")[1:])
-    combined_file_path = f"./static/{dev_name}/{year_month}/{combined_filename}"
-
-    if os.path.exists(original_file_path):
-        file_path = original_file_path
-    elif os.path.exists(combined_file_path):
-        file_path = combined_file_path
+    month = get_month_threads_or_404(dev_name, year_month)
+    if filename in month.filenames:
+        file_path = resolve_xml_path(f"./static/{dev_name}/{year_month}", filename)
+    elif month.combined_filename(filename):
+        file_path = resolve_xml_path(f"./static/{dev_name}/{year_month}", month.combined_filename(filename))
     else:
         return f"Error: {filename} not found in {year_month}", 404
 
@@ -300,13 +446,24 @@ def display_xml(dev_name, year_month, filename):
 
 if __name__ == '__main__':
     import sys
-    nltk.download('punkt')
 
     if len(sys.argv) > 1 and sys.argv[1] == "build":
-        freezer.freeze()
+        create_freezer().freeze()
     else:
-        os.popen('python scheduler.py > scheduler_logs.txt 2>&1 &')
+        from scheduler import create_scheduler
+
+        # in debug mode the server runs in a child process of the reloader, the jobs are only scheduled there
+        job_scheduler = None
+        if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+            job_scheduler = create_scheduler()
+            # the archive store is built before the first requests, then kept in sync by the scheduler
+            job_scheduler.add_job("archive-store", refresh_archive_store, every=ARCHIVE_REFRESH_SECONDS)
+            job_scheduler.submit("archive-store")
+            job_scheduler.start()
         try:
             app.run(debug=True)
         except Exception as e:
             logger.exception(e)
+        finally:
+            if job_scheduler is not None:
+                job_scheduler.stop(wait=False)
@@ -0,0 +1,127 @@
+"""
+Files per second of the XML output of `GenerateXML.generate_xml`.
+
+* render: feedgen (previous serializer) against `render_feed`, on the feeds of the XMLs of a month folder, after
+  checking both produce the same documents apart from the `<updated>` timestamps
+* write: `--files` files spread over `--months` folders, with a plain write (previous behaviour, a crash can leave
+  a truncated XML), atomic writes synced one by one, and atomic writes whose fsyncs are batched per folder
+
+Usage: python benchmarks/bench_atom_writer.py [--folder static/bitcoin-dev/Dec_2022] [--files 2000] [--months 4]
+"""
+import argparse
+import os
+import re
+import sys
+import tempfile
+import time
+import xml.etree.ElementTree as ET
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from feedgen.feed import FeedGenerator  # noqa: E402
+
+from src.atom_writer import BatchedWriter, render_feed, write_atomic  # noqa: E402
+
+ATOM = "{http://www.w3.org/2005/Atom}"
+UPDATED = re.compile(rb"<updated>[^<]*</updated>")
+
+
+def read_feed_data(path):
+    root = ET.parse(path).getroot()
+    entry = root.find(f"{ATOM}entry")
+    return {
+        'id': root.findtext(f"{ATOM}id"),
+        'title': root.findtext(f"{ATOM}title"),
+        'authors': [author.findtext(f"{ATOM}name") for author in root.findall(f"{ATOM}author")],
+        'url': entry.find(f"{ATOM}link").get("href"),
+        'links': [link.get("href") for link in root.findall(f"{ATOM}link")],
+        'created_at': entry.findtext(f"{ATOM}published"),
+        'summary': entry.findtext(f"{ATOM}summary"),
+    }
+
+
+def feedgen_render(feed_data):
+    # the previous `GenerateXML.generate_xml`
+    fg = FeedGenerator()
+    fg.id(feed_data['id'])
+    fg.title(feed_data['title'])
+    for author in feed_data['authors']:
+        fg.author({'name': author})
+    for link in feed_data['links']:
+        fg.link(href=link, rel='alternate')
+    fe = fg.add_entry()
+    fe.id(feed_data['id'])
+    fe.title(feed_data['title'])
+    fe.link(href=feed_data['url'], rel='alternate')
+    fe.published(feed_data['created_at'])
+    fe.summary(feed_data['summary'])
+    return fg.atom_str(pretty=True)
+
+
+def render_all(render, feeds, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for feed_data in feeds:
+            render(feed_data)
+    return repeat * len(feeds) / (time.perf_counter() - start)
+
+
+def write_plain(jobs):
+    for path, data in jobs:
+        with open(path, 'wb') as f:
+            f.write(data)
+
+
+def write_atomic_each(jobs):
+    for path, data in jobs:
+        write_atomic(path, data)
+
+
+def write_batched(jobs):
+    with BatchedWriter() as writer:
+        for path, data in jobs:
+            writer.write(path, data)
+
+
+def bench_write(write, data, months):
+    with tempfile.TemporaryDirectory(dir=".") as root:
+        folders = [os.path.join(root, f"month_{i}") for i in range(months)]
+        for folder in folders:
+            os.makedirs(folder)
+        jobs = [(os.path.join(folders[i % months], f"{i}.xml"), file_data) for i, file_data in enumerate(data)]
+        start = time.perf_counter()
+        write(jobs)
+        return len(jobs) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--folder", default="static/bitcoin-dev/Dec_2022")
+    parser.add_argument("--files", type=int, default=2000)
+    parser.add_argument("--months", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    feeds = [read_feed_data(os.path.join(args.folder, name))
+             for name in sorted(os.listdir(args.folder)) if name.endswith(".xml")]
+    for feed_data in feeds:
+        if UPDATED.sub(b"", feedgen_render(feed_data)) != UPDATED.sub(b"", render_feed(feed_data)):
+            sys.exit(f"Output differs from feedgen: {feed_data['title']}")
+    print(f"{len(feeds)} feeds of {args.folder}: output identical to feedgen")
+
+    print("render")
+    baseline = render_all(feedgen_render, feeds, args.repeat)
+    fast = render_all(render_feed, feeds, args.repeat)
+    print(f"  {'feedgen':<36} {baseline:>10.0f} files/s")
+    print(f"  {'render_feed':<36} {fast:>10.0f} files/s ({fast / baseline:.1f}x)")
+
+    print(f"write of {args.files} files in {args.months} folders")
+    data = [render_feed(feeds[i % len(feeds)]) for i in range(args.files)]
+    for name, write in [("open/write (not atomic, no fsync)", write_plain),
+                        ("write_atomic, fsync of every file", write_atomic_each),
+                        ("BatchedWriter, fsyncs per folder", write_batched)]:
+        print(f"  {name:<36} {bench_write(write, data, args.months):>10.0f} files/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Import time of the entry points, measured with `python -X importtime` in a fresh interpreter.
+
+Heavy modules (tiktoken, nltk, openai, flask_frozen) are imported on first use, so importing an entry point
+(e.g. `app` for the web server) must stay within its budget. The heaviest modules imported by each entry point
+are listed to find what to make lazy when a budget is exceeded. Exits with status 1 if a budget is exceeded.
+
+Usage: python benchmarks/bench_import_time.py [--top N]
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# milliseconds, cumulative import time of the module
+BUDGETS = {
+    "app": 250,
+    "push_summary_to_es": 500,
+    "push_combined_summary_to_es": 500,
+    "generate_homepage_xml": 800,
+    "xmls_generator_production": 800,
+    "generate_xmls": 800,
+}
+
+
+def import_times(module):
+    """
+    Cumulative import time (in microseconds) of every module imported by `import module`.
+    :return: list of (depth, name, cumulative time) in import order
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            cwd=ROOT, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr.strip().splitlines()[-1]}")
+    times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        times.append((depth, name.strip(), int(cumulative)))
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--top", type=int, default=5, help="number of heaviest imports listed per entry point")
+    args = parser.parse_args()
+
+    over_budget = []
+    for module, budget in BUDGETS.items():
+        try:
+            times = import_times(module)
+        except RuntimeError as e:
+            print(f"{module:<30} skipped: {e}")
+            continue
+        total = next(cumulative for depth, name, cumulative in times if name == module) / 1000
+        status = "ok" if total <= budget else "OVER BUDGET"
+        print(f"{module:<30} {total:8.1f} ms (budget {budget} ms) {status}")
+        # the direct imports of the entry point, heaviest first
+        direct = [(cumulative, name) for depth, name, cumulative in times if depth == 1]
+        for cumulative, name in sorted(direct, reverse=True)[:args.top]:
+            print(f"    {name:<40} {cumulative / 1000:8.1f} ms")
+        if total > budget:
+            over_budget.append(module)
+
+    if over_budget:
+        print(f"Import time budget exceeded: {', '.join(over_budget)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""
+Render cost of the archive homepage (`/`) as the number of month folders grows.
+
+The month table is built in a single pass and the template renders one row per month, so the time per
+month should stay flat when the archive grows.
+
+Usage: python benchmarks/bench_index_render.py
+"""
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as archive_app  # noqa: E402
+
+MONTHS = ["Jan", "Feb", "March", "April", "May", "June", "July", "Aug", "Sept", "Oct", "Nov", "Dec"]
+
+
+def create_static_tree(root, n_months):
+    for i in range(n_months):
+        year_month = f"{MONTHS[i % 12]}_{2000 + i // 12}"
+        for dev_name in ["bitcoin-dev", "lightning-dev"]:
+            if dev_name == "lightning-dev" and i % 3 == 0:
+                continue
+            os.makedirs(os.path.join(root, "static", dev_name, year_month))
+
+
+def bench(n_months, repeat=20):
+    with tempfile.TemporaryDirectory() as root:
+        create_static_tree(root, n_months)
+        flask_app = archive_app.app
+        flask_app.jinja_loader  # the template loader keeps the original root path
+        original_root = flask_app.root_path
+        flask_app.root_path = root
+        try:
+            client = flask_app.test_client()
+            start = time.perf_counter()
+            client.get("/")
+            cold = time.perf_counter() - start
+
+            start = time.perf_counter()
+            for _ in range(repeat):
+                client.get("/")
+            warm = (time.perf_counter() - start) / repeat
+        finally:
+            flask_app.root_path = original_root
+    return cold, warm
+
+
+if __name__ == "__main__":
+    print(f"{'months':>8} {'cold (ms)':>10} {'warm (ms)':>10} {'warm us/month':>14}")
+    for n_months in [250, 1000, 4000]:
+        cold, warm = bench(n_months)
+        print(f"{n_months:>8} {cold * 1000:>10.2f} {warm * 1000:>10.2f} {warm * 1e6 / n_months:>14.2f}")
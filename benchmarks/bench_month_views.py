@@ -0,0 +1,107 @@
+"""
+Request latency of the month views (thread/author/subject/date) and of the feed page.
+
+The thread model of a month is built once from the manifest and cached until the folder changes, so warm
+requests only stat the month folder. The baseline re-parses every XML of the folder on each request, as the
+views used to do.
+
+Usage: python benchmarks/bench_month_views.py
+"""
+import os
+import sys
+import tempfile
+import time
+import xml.etree.ElementTree as ET
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as archive_app  # noqa: E402
+
+YEAR_MONTH = "Dec_2022"
+XML_TEMPLATE = """<?xml version='1.0' encoding='UTF-8'?>
+<feed xmlns="http://www.w3.org/2005/Atom" xml:lang="en">
+  <id>{id}</id>
+  <title>{title}</title>
+  <updated>2023-01-01T00:00:00.000000+00:00</updated>
+  <author>
+    <name>{author}</name>
+  </author>
+  <generator uri="https://lkiesow.github.io/python-feedgen" version="0.9.0">python-feedgen</generator>
+  <entry>
+    <id>{id}</id>
+    <title>{title}</title>
+    <updated>2023-01-01T00:00:00.000000+00:00</updated>
+    <link href="https://lists.linuxfoundation.org/pipermail/bitcoin-dev/2022-December/{number}.html" rel="alternate"/>
+    <summary>{summary}</summary>
+    <published>2022-12-{day:02d}T10:00:00+00:00</published>
+  </entry>
+</feed>
+"""
+
+
+def create_month(root, n_threads, messages_per_thread=3):
+    folder = os.path.join(root, "static", "bitcoin-dev", YEAR_MONTH)
+    os.makedirs(folder)
+    summary = "Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 40
+    number = 0
+    for i in range(n_threads):
+        name = f"Thread-{i}"
+        for j in range(messages_per_thread):
+            number += 1
+            with open(os.path.join(folder, f"{number:06d}_{name}.xml"), "w") as f:
+                f.write(XML_TEMPLATE.format(id="1", title=f"Thread {i}", author=f"Author {j}", number=number,
+                                            summary=summary, day=1 + j))
+        with open(os.path.join(folder, f"combined_{name}.xml"), "w") as f:
+            f.write(XML_TEMPLATE.format(id="2", title=f"Combined summary - Thread {i}", author="Author 0",
+                                        number=number, summary=summary, day=1))
+    return f"{number:06d}_Thread-{n_threads - 1}"
+
+
+def baseline_views(folder):
+    # what every request used to do: list the folder and parse all of its XMLs
+    namespace = {'atom': 'http://www.w3.org/2005/Atom'}
+    posts = []
+    for file in os.listdir(folder):
+        if file.endswith('.xml'):
+            root = ET.parse(os.path.join(folder, file)).getroot()
+            posts.append({'title': root.find('atom:title', namespace).text,
+                          'author': root.find('atom:author/atom:name', namespace).text,
+                          'date': root.find('atom:entry/atom:published', namespace).text, 'filename': file})
+    return sorted(posts, key=lambda p: p['title'])
+
+
+def timed(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat
+
+
+def bench(n_threads, repeat=20):
+    with tempfile.TemporaryDirectory() as root:
+        feed_name = create_month(root, n_threads)
+        flask_app = archive_app.app
+        flask_app.jinja_loader  # the template loader keeps the original root path
+        original_root, original_cwd = flask_app.root_path, os.getcwd()
+        flask_app.root_path = root
+        os.chdir(root)  # the feed page reads the XML relative to the working directory
+        try:
+            client = flask_app.test_client()
+            results = {"baseline": timed(lambda: baseline_views(os.path.join(root, "static", "bitcoin-dev",
+                                                                             YEAR_MONTH)), 3)}
+            results["cold"] = timed(lambda: client.get(f"/thread/bitcoin-dev/{YEAR_MONTH}.html"), 1)
+            for view in archive_app.MonthThreads.VIEWS:
+                results[view] = timed(lambda: client.get(f"/{view}/bitcoin-dev/{YEAR_MONTH}.html"), repeat)
+            results["feed"] = timed(lambda: client.get(f"/bitcoin-dev/{YEAR_MONTH}/{feed_name}.html"), repeat)
+        finally:
+            flask_app.root_path = original_root
+            os.chdir(original_cwd)
+    return results
+
+
+if __name__ == "__main__":
+    columns = ["baseline", "cold", *archive_app.MonthThreads.VIEWS, "feed"]
+    print(f"{'posts':>6} " + " ".join(f"{column + ' (ms)':>15}" for column in columns))
+    for n_threads in [25, 100, 400]:
+        results = bench(n_threads)
+        print(f"{n_threads * 4:>6} " + " ".join(f"{results[column] * 1000:>15.2f}" for column in columns))
@@ -0,0 +1,69 @@
+"""
+Metadata extraction over all the summary XMLs of `static/`: full element tree (`ET.parse`, as the manifest used
+to) against `read_xml_meta`, with all the manifest fields and with the header fields only (title, authors, links).
+
+Usage: python benchmarks/bench_xml_meta.py [--static static]
+"""
+import argparse
+import os
+import sys
+import time
+import xml.etree.ElementTree as ET
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.xml_meta import FIELDS, read_xml_meta  # noqa: E402
+
+NAMESPACE = {'atom': 'http://www.w3.org/2005/Atom'}
+
+
+def read_full_tree(xml_path):
+    root = ET.parse(xml_path).getroot()
+    link = root.find('atom:entry/atom:link', NAMESPACE)
+    return {
+        "title": root.find('atom:title', NAMESPACE).text,
+        "authors": [a.text for a in root.findall('atom:author/atom:name', NAMESPACE)],
+        "published": root.find('atom:entry/atom:published', NAMESPACE).text,
+        "url": link.get('href') if link is not None else None,
+        "links": [a.get('href') for a in root.findall('atom:link', NAMESPACE)],
+    }
+
+
+def read_all_fields(xml_path):
+    return read_xml_meta(xml_path)
+
+
+def read_header_fields(xml_path):
+    return read_xml_meta(xml_path, ("title", "authors", "links"))
+
+
+def bench(read, paths):
+    start = time.perf_counter()
+    for path in paths:
+        read(path)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--static", default="static")
+    args = parser.parse_args()
+
+    paths = [os.path.join(folder, filename) for folder, _, filenames in os.walk(args.static)
+             for filename in filenames if filename.endswith(".xml")]
+    for path in paths:
+        expected, meta = read_full_tree(path), read_xml_meta(path)
+        if any(expected[field] != getattr(meta, field) for field in FIELDS):
+            sys.exit(f"Metadata differs from the element tree: {path}")
+    print(f"{len(paths)} XMLs of {args.static}: same metadata as the element tree")
+
+    baseline = bench(read_full_tree, paths)
+    print(f"{'ET.parse (full tree)':<32} {baseline:>8.2f} s {len(paths) / baseline:>10.0f} files/s")
+    for name, read in [("read_xml_meta (all fields)", read_all_fields),
+                       ("read_xml_meta (header fields)", read_header_fields)]:
+        elapsed = bench(read, paths)
+        print(f"{name:<32} {elapsed:>8.2f} s {len(paths) / elapsed:>10.0f} files/s ({baseline / elapsed:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Replace the copies of the combined summaries in the month folders by pointers to a single stored XML
+(see src/combined_store.py).
+
+Every `combined_<title>.xml` file of a month folder is replaced by a `combined_<title>.xml.ref` pointer to
+`static/<list>/_combined/combined_<title>.xml`. When that XML is not stored yet, the most recent copy (latest
+`<updated>`) is stored; the other copies are stale versions of it. The month manifests are updated accordingly.
+
+Usage: python dedupe_combined_xmls.py [--dry-run]
+"""
+import argparse
+import os
+import re
+
+from loguru import logger
+
+from src.atom_writer import BatchedWriter
+from src.combined_store import REF_SUFFIX, combined_path, ref_data
+from src.config import MAILING_LISTS
+from src.list_runner import get_dev_name
+from src.manifest import is_combined, iter_month_folders, load_manifest
+
+UPDATED = re.compile(rb"<updated>([^<]*)</updated>")
+
+
+def updated_at(xml_path):
+    with open(xml_path, "rb") as f:
+        match = UPDATED.search(f.read())
+    return match.group(1).decode() if match else ""
+
+
+def dedupe_combined_xmls(dev_folder, dry_run=False):
+    """
+    :return: tuple, (number of combined XMLs, number of copies replaced by a pointer, bytes freed)
+    """
+    copies = {}
+    for month_folder in iter_month_folders(dev_folder):
+        for filename in os.listdir(month_folder):
+            if is_combined(filename) and filename.endswith(".xml"):
+                copies.setdefault(filename, []).append(os.path.join(month_folder, filename))
+
+    replaced, freed = 0, 0
+    touched_folders = set()
+    writer = BatchedWriter()
+    for filename, paths in copies.items():
+        combined_file = combined_path(dev_folder, filename)
+        latest = None if os.path.exists(combined_file) else max(paths, key=updated_at)
+        freed += sum(os.path.getsize(path) for path in paths) - (os.path.getsize(latest) if latest else 0)
+        replaced += len(paths)
+        if dry_run:
+            continue
+        if latest:
+            os.makedirs(os.path.dirname(combined_file), exist_ok=True)
+            writer.copy(latest, combined_file)
+        for path in paths:
+            month_folder = os.path.dirname(path)
+            # the pointer is written first, a reader sees the copy until it is removed
+            writer.write(path + REF_SUFFIX, ref_data(month_folder, combined_file))
+            os.remove(path)
+            touched_folders.add(month_folder)
+    writer.flush()
+
+    for month_folder in touched_folders:
+        load_manifest(month_folder)
+    return len(copies), replaced, freed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dry-run", action="store_true", help="only report what would be replaced")
+    args = parser.parse_args()
+
+    for dev_url in MAILING_LISTS:
+        dev_folder = os.path.join("static", get_dev_name(dev_url))
+        if not os.path.isdir(dev_folder):
+            continue
+        combined, replaced, freed = dedupe_combined_xmls(dev_folder, dry_run=args.dry_run)
+        logger.info(f"{dev_folder}: {combined} combined XMLs, {replaced} copies replaced by a pointer, "
+                    f"{freed / 1e6:.1f} MB freed")
@@ -6,7 +6,6 @@ import traceback
 import openai
 from datetime import datetime, timedelta
 from loguru import logger
-import xml.etree.ElementTree as ET
 import os
 from dotenv import load_dotenv
 import sys
@@ -14,29 +13,32 @@ import warnings
 import pytz
 import json
 
-import nltk
-nltk.download('punkt')
-from nltk.tokenize import sent_tokenize
-
+from src.sentences import sent_tokenize
 from src.utils import preprocess_email
-from src.gpt_utils import generate_chatgpt_summary, consolidate_chatgpt_summary
-from src.config import TOKENIZER, ES_CLOUD_ID, ES_USERNAME, ES_PASSWORD, ES_INDEX, ES_DATA_FETCH_SIZE
+from src.gpt_utils import generate_chatgpt_summary, consolidate_chatgpt_summary, generate_bullets, \
+    generate_header_summary
+from src.summary_planner import plan_summary, execute_plan
+from src.archive_store import get_archive_store
+from src.combined_store import resolve_xml_path
+from src.list_runner import get_dev_name, run_per_list
+from src.threads import canonical_subject, combined_filenames, thread_key
+from src.watermarks import WatermarkStore, changed_since_query
+from src import config
+from src.config import ES_CLOUD_ID, ES_USERNAME, ES_PASSWORD, ES_INDEX, ES_DATA_FETCH_SIZE
 
 import numpy as np
 
 warnings.filterwarnings("ignore")
 load_dotenv()
 
-# if set to True, it will use chatgpt model ("gpt-4-1106-preview") for all the completions
-CHATGPT = True
-
-# COMPLETION_MODEL - only applicable if CHATGPT is set to False
 OPENAI_ORG_KEY = os.getenv("OPENAI_ORG_KEY")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
 openai.organization = OPENAI_ORG_KEY
 openai.api_key = OPENAI_API_KEY
 
+HOMEPAGE_PATH = "static/homepage.json"
+
 
 class ElasticSearchClient:
     def __init__(self, es_cloud_id, es_username, es_password, es_data_fetch_size=ES_DATA_FETCH_SIZE) -> None:
@@ -105,6 +107,20 @@ class ElasticSearchClient:
             logger.info('Could not connect to Elasticsearch')
             return None
 
+    def count_changed_since(self, es_index, url, since):
+        """:return: int, number of documents of a mailing list indexed at or after `since`"""
+        query = {
+            "query": {
+                "bool": {
+                    "must": [
+                        {"prefix": {"domain.keyword": str(url)}},
+                        changed_since_query(since)
+                    ]
+                }
+            }
+        }
+        return self._es_client.count(index=es_index, body=query)["count"]
+
     def filter_top_recent_posts(self, es_results, top_n):
         es_results_sorted = sorted(
             es_results,
@@ -117,9 +133,9 @@ class ElasticSearchClient:
         for result in es_results_sorted:
             title = result['_source']['title']
             # Only add the result if we haven't already seen the title
-            if title not in seen_titles:
+            if thread_key(title) not in seen_titles:
                 unique_results.append(result)
-                seen_titles.add(title)
+                seen_titles.add(thread_key(title))
 
             # Break after we've gotten top_n unique results
             if len(unique_results) >= top_n:
@@ -136,26 +152,26 @@ class ElasticSearchClient:
         # Add this loop to create dictionary with title as key and thread count as value
         for result in es_results:
             title = result['_source']['title']
-            if title not in seen_titles:
+            if thread_key(title) not in seen_titles:
                 counts, contributors = self.fetch_contributors_and_threads(title=title,
                                                                            domain=result['_source']['domain'],
                                                                            df=all_data_df)
-                thread_dict[title] = counts
+                thread_dict[thread_key(title)] = counts
                 result['_source']['n_threads'] = counts  # add thread count to source
-                seen_titles.add(title)
+                seen_titles.add(thread_key(title))
 
         # Use the dictionary created above, to sort the results
         es_results_sorted = sorted(
             es_results,
-            key=lambda x: thread_dict[x['_source']['title']], reverse=True
+            key=lambda x: thread_dict[thread_key(x['_source']['title'])], reverse=True
         )
 
         seen_titles = set()
         for result in es_results_sorted:
             title = result['_source']['title']
-            if title not in seen_titles:
+            if thread_key(title) not in seen_titles:
                 unique_results.append(result)
-                seen_titles.add(title)
+                seen_titles.add(thread_key(title))
 
             # Break after we've gotten top_n unique results
             if len(unique_results) >= top_n:
@@ -209,7 +225,7 @@ class ElasticSearchClient:
             return None
 
     def fetch_contributors_and_threads(self, title, domain, df):
-        df_filtered = df.loc[(df['title'] == title) & (df['domain'] == domain)]
+        df_filtered = df.loc[(self.thread_keys(df) == thread_key(title)) & (df['domain'] == domain)]
         # df_filtered = df_filtered.drop_duplicates()  # id
         counts = len(df_filtered)
         df_filtered['authors'] = df_filtered['authors'].apply(tuple)
@@ -218,6 +234,12 @@ class ElasticSearchClient:
         contributors = list(np.unique(contributors))
         return counts, contributors
 
+    def thread_keys(self, df):
+        # computed once per dataframe, the posts of a thread are matched by thread key instead of exact title
+        if 'thread_key' not in df:
+            df['thread_key'] = df['title'].apply(thread_key)
+        return df['thread_key']
+
 
 class GenerateJSON:
     def __init__(self) -> None:
@@ -225,79 +247,30 @@ class GenerateJSON:
             1: "Jan", 2: "Feb", 3: "March", 4: "April", 5: "May", 6: "June",
             7: "July", 8: "Aug", 9: "Sept", 10: "Oct", 11: "Nov", 12: "Dec"
         }
+        self.archive_store = get_archive_store()
 
-    def split_prompt_into_chunks(self, prompt, chunk_size):
-        tokens = TOKENIZER.encode(prompt)
-        chunks = []
-
-        while len(tokens) > 0:
-            current_chunk = TOKENIZER.decode(tokens[:chunk_size]).strip()
-
-            if current_chunk:
-                chunks.append(current_chunk)
-
-            tokens = tokens[chunk_size:]
-
-        return chunks
-
-    def get_summary_chunks(self, body, tokens_per_sub_body):
-        chunks = self.split_prompt_into_chunks(body, tokens_per_sub_body)
-        summaries = []
-
-        logger.info(f"Total chunks: {len(chunks)}")
-
-        for chunk in chunks:
-            count = 0
-            while True:
-                try:
-                    time.sleep(2)
-                    summary = generate_chatgpt_summary(chunk)
-                    summaries.append(summary)
-                    break
-                except Exception as ex:
-                    count += 1
-                    if count > 5:
-                        sys.exit(f"Chunk summary ran into error: {traceback.format_exc()}")
-        return summaries
-
-    def recursive_summary(self, body, tokens_per_sub_body, max_length):
-        summaries = self.get_summary_chunks(body, tokens_per_sub_body)
-
-        summary_length = sum([len(TOKENIZER.encode(s)) for s in summaries])
-
-        logger.info(f"Summary length: {summary_length}")
-        logger.info(f"Max length: {max_length}")
-
-        if summary_length > max_length:
-            logger.info("entering in recursion")
-            return self.recursive_summary("".join(summaries), tokens_per_sub_body, max_length)
-        else:
-            return summaries
+    def call_with_retry(self, gpt_function, prompt):
+        count = 0
+        while True:
+            try:
+                time.sleep(2)
+                return gpt_function(prompt)
+            except Exception as ex:
+                count += 1
+                if count > 5:
+                    sys.exit(f"Chunk summary ran into error: {traceback.format_exc()}")
 
     def gpt_api(self, body):
-        body_length_limit = 2800
-        tokens_per_sub_body = 2700
-        summaries = self.recursive_summary(body, tokens_per_sub_body, body_length_limit)
-
-        if len(summaries) > 1:
+        plan = plan_summary(len(config.TOKENIZER.encode(body)))
+        if plan.total_calls > 1:
             logger.info("generating consolidate summary...")
-            summary_str = "\n".join(summaries)
-            count = 0
-            while True:
-                try:
-                    time.sleep(2)
-                    consolidated_summaries = consolidate_chatgpt_summary(summary_str)
-                    break
-                except Exception as ex:
-                    count += 1
-                    if count > 5:
-                        sys.exit(f"Chunk summary ran into error: {traceback.format_exc()}")
-
-            return consolidated_summaries
-
         else:
             logger.info("generating individual summary...")
-            return "\n".join(summaries)
+        return execute_plan(
+            plan, body,
+            summarize_fn=lambda chunk: self.call_with_retry(generate_chatgpt_summary, chunk),
+            consolidate_fn=lambda summaries: self.call_with_retry(consolidate_chatgpt_summary, summaries)
+        )
 
     def create_summary(self, body):
         summ = self.gpt_api(body)
@@ -314,32 +287,7 @@ class GenerateJSON:
         return str(id).split("-")[-1]
 
     def create_n_bullets(self, body_summary, n=3):
-        bullets_prompt = f"""Summarize the following email into {n} distinct sentences based on the guidelines 
-        mentioned below. 
-            1. Each sentence you write should not exceed fifteen words. 
-            2. Each sentence should begin on a new line and should start with a hyphen (-) and you must add space after hyphen (-).
-                E.g., - This is a first sentence. - This is a second sentence. - This is a third sentence.
-                E.g., Incorrect: "-This is a sentence.-This is another sentence."
-                    Correct: "- This is a sentence. - This is another sentence."
-            3. Please adhere to all English grammatical rules while writing the sentences, 
-                maintaining formal tone and employing proper spacing. 
-            4. While summarizing, avoid using phrases referring to the context. Instead, directly present the information or points covered. 
-                Do not introduce sentences with phrases like: "The context discusses...", "In this context..." or "The context covers..."
-        CONTEXT:\n\n{body_summary}"""
-
-        response = openai.ChatCompletion.create(
-            model="gpt-4-1106-preview",
-            messages=[
-                {"role": "system", "content": "You are an intelligent assistant."},
-                {"role": "user", "content": f"{bullets_prompt}"},
-            ],
-            temperature=1,
-            max_tokens=300,
-        )
-        response_str = response['choices'][0]['message']['content'].replace("\n", "").strip()
-        response_str = response_str.replace('.- ', '.\n- ')
-        response_str = response_str.replace('. - ', '.\n- ')
-        return response_str
+        return generate_bullets(body_summary, n=n)
 
     def get_xml_summary(self, data):
         number = self.get_id(data["_source"]["id"])
@@ -355,14 +303,10 @@ class GenerateJSON:
         file_path = f"static/{dev_name}/{str_month_year}/{number}_{xml_name}.xml"
         full_path = os.path.join(current_directory, file_path)
 
-        if os.path.exists(full_path):
-            namespaces = {'atom': 'http://www.w3.org/2005/Atom'}
-            tree = ET.parse(full_path)
-            root = tree.getroot()
-            summ_list = root.findall(".//atom:entry/atom:summary", namespaces)
-            summ = "\n".join([summ.text for summ in summ_list])
-            author_list = root.findall(".//atom:author", namespaces)
-            author_ = "\n".join([a.find('atom:name', namespaces).text for a in author_list])
+        record = self.archive_store.get(dev_name, str_month_year, f"{number}_{xml_name}.xml")
+        if record:
+            summ = record["summary"] or ""
+            author_ = "\n".join(record["authors"])
             author_ = " ".join(author_.split(" ")[:-2])
             return f"{author_}:{summ}\n"
         else:
@@ -388,31 +332,7 @@ class GenerateJSON:
                 recent_post_data += summ
         recent_post_data = self.create_summary(recent_post_data)
 
-        summ_prompt = f"""You are required to produce a concise header summary from a compilation of condensed recent discussions. Transform the following extracted text from mailing lists into a brief summary composed of only three or four significant sentences, adhering to these important criteria:
-    Guidelines:
-        1. While synthesizing, refrain from or reword phrases like "The context discusses...", "The email discusses...", "In this context...", "The context covers...", "The context questions...", "In this email...", "The email covers..." and similar phrases.
-        2. The summarization must have a formal tone and be high in informational content.
-        3. Ensure that punctuation is followed by a space and that all syntax rules are adhered to.
-        4. Any links given within the text should be retained and appropriately incorporated.
-        5. Rather than being a simple rewording of the original content, the summary should restructure and simplify the main points.
-        6. Mention full names (both the first name and last name) of the authors if applicable. 
-        7. Break down the summary into concise, meaningful paragraphs ensuring each paragraph captures a unique aspect or perspective from the original text, provided it should be no longer than three or four sentences.
-        8. Please ensure that the summary does not start with labels like "Email 1:", "Email 2:" and so on.
-        \n CONTEXT:\n\n{recent_post_data}"""
-        
-        response = openai.ChatCompletion.create(
-            model="gpt-4-1106-preview",
-            messages=[
-                {"role": "system", "content": "You are an intelligent agent with an exceptional skills in writing."},
-                {"role": "user", "content": f"{summ_prompt}"},
-            ],
-            temperature=0.7,
-            max_tokens=500
-        )
-        response_str = response['choices'][0]['message']['content'].strip()
-        if response_str.startswith("Summary:"):
-            response_str = response_str[8:].strip()
-        return response_str
+        return generate_header_summary(recent_post_data)
 
     def create_single_entry(self, data, is_active=False):
         number = self.get_id(data["_source"]["id"])
@@ -428,8 +348,14 @@ class GenerateJSON:
         month_name = self.month_dict[int(published_at.month)]
         str_month_year = f"{month_name}_{int(published_at.year)}"
         if is_active:
-            if os.path.exists(f"./static/{local_dev_name}/{str_month_year}/combined_{xml_name}.xml"):
-                file_path = f"static/{local_dev_name}/{str_month_year}/combined_{xml_name}.xml"
+            # the combined summary is named after the thread subject, without the "Re:"/"Fwd:"/list tag variants,
+            # or after the raw subject for the summaries written before
+            combined_xml = next((name for name in combined_filenames(canonical_subject(title), [title])
+                                 if self.archive_store.get(local_dev_name, str_month_year, name)), None)
+            if combined_xml:
+                # the month folder may only hold a pointer to the XML stored in the `_combined` folder
+                file_path = resolve_xml_path(f"static/{local_dev_name}/{str_month_year}", combined_xml)
+                file_path = file_path.replace("\\", "/")
             else:
                 file_path = f"static/{local_dev_name}/{str_month_year}/{number}_{xml_name}.xml"
         else:
@@ -512,15 +438,117 @@ class GenerateJSON:
         return len(body_token) > sent_threshold
 
 
+def homepage_unchanged(watermarks, elastic_search, start_date_str, file_path=HOMEPAGE_PATH):
+    """
+    The homepage is up to date when it was built for the same window of dates and no document of the mailing lists
+    was indexed since: the expensive fetch of all the posts is skipped.
+    """
+    window = watermarks.get("homepage", "window")
+    if window is None or window.strftime("%Y-%m-%d") != start_date_str or not os.path.exists(file_path):
+        return False
+    for dev_url in config.MAILING_LISTS:
+        watermark = watermarks.get("homepage", get_dev_name(dev_url))
+        if watermark is None:
+            return False
+        # no overlap here, only the documents after the latest one seen by the last run
+        changed = elastic_search.count_changed_since(ES_INDEX, dev_url, watermark + timedelta(milliseconds=1))
+        if changed:
+            logger.info(f"{changed} doc(s) of {get_dev_name(dev_url)} indexed since {watermark.isoformat()}")
+            return False
+    return True
+
+
+def collect_dev_posts(dev_url, gen, elastic_search, start_date_str, current_date_str):
+    """
+    Top active and top recent posts of a mailing list.
+    :return: tuple, (recent posts, active posts, all the posts of the list)
+    """
+    recent_data_list = []
+    active_data_list = []
+    all_data_df, all_data_list = elastic_search.fetch_all_data_for_url(ES_INDEX, url=dev_url)
+    data_list = elastic_search.extract_data_from_es(ES_INDEX, dev_url, start_date_str, current_date_str)
+    dev_name = dev_url.split("/")[-2]
+    logger.info(f"Total threads received for {dev_name}: {len(data_list)}")
+
+    seen_titles = set()
+
+    # top active posts
+    active_posts_data = elastic_search.filter_top_active_posts(es_results=data_list, top_n=10,
+                                                               all_data_df=all_data_df)
+
+    active_posts_data_counter = 0
+    for data in active_posts_data:
+        if active_posts_data_counter >= 3:
+            break
+
+        title = data['_source']['title']
+        if thread_key(title) in seen_titles:
+            continue
+        seen_titles.add(thread_key(title))
+
+        counts, contributors = elastic_search.fetch_contributors_and_threads(title=title, domain=dev_url,
+                                                                             df=all_data_df)
+        # get the first post's info of this title
+        df_title = all_data_df.loc[(elastic_search.thread_keys(all_data_df) == thread_key(title)) &
+                                   (all_data_df['domain'] == dev_url)]
+        df_title.sort_values(by='created_at', inplace=True)
+        original_post = df_title.iloc[0].to_dict()
+
+        for i in all_data_list:
+            if i['_source']['title'] == original_post['title'] and i['_source']['domain'] == original_post[
+                'domain'] and i['_source']['authors'] == original_post['authors'] and i['_source']['created_at'] == \
+                    original_post['created_at'] and i['_source']['url'] == original_post['url']:
+                for author in i['_source']['authors']:
+                    contributors.remove(author)
+                i['_source']['n_threads'] = counts
+                i['_source']['contributors'] = contributors
+                i['_source']['dev_name'] = dev_name
+                active_data_list.append(i)
+                active_posts_data_counter += 1
+                break
+
+    logger.info(f"Number of active posts collected: {len(active_data_list)}")
+
+    # top recent posts
+    recent_data_post_counter = 0
+    recent_posts_data = elastic_search.filter_top_recent_posts(es_results=data_list, top_n=20)
+    # if len(recent_posts_data) >= 3:
+    #     recent_posts_data = recent_posts_data[:3]
+
+    for data in recent_posts_data:
+
+        # if preprocess body text not longer than token_threshold, skip that post
+        if not gen.is_body_text_long(data=data, sent_threshold=2):
+            logger.info(f"skipping: {data['_source']['title']} - {data['_source']['url']}")
+            continue
+
+        title = data['_source']['title']
+        if thread_key(title) in seen_titles:
+            continue
+        seen_titles.add(thread_key(title))
+        if recent_data_post_counter >= 3:
+            break
+        counts, contributors = elastic_search.fetch_contributors_and_threads(title=title, domain=dev_url,
+                                                                             df=all_data_df)
+        authors = data['_source']['authors']
+        for author in authors:
+            contributors.remove(author)
+        data['_source']['n_threads'] = counts
+        data['_source']['contributors'] = contributors
+        data['_source']['dev_name'] = dev_name
+        recent_data_list.append(data)
+        recent_data_post_counter += 1
+
+    logger.info(f"Number of recent posts collected: {len(recent_data_list)}")
+
+    return recent_data_list, active_data_list, all_data_list
+
+
 if __name__ == "__main__":
 
     gen = GenerateJSON()
     elastic_search = ElasticSearchClient(es_cloud_id=ES_CLOUD_ID, es_username=ES_USERNAME,
                                          es_password=ES_PASSWORD)
-    dev_urls = [
-        "https://lists.linuxfoundation.org/pipermail/bitcoin-dev/",
-        "https://lists.linuxfoundation.org/pipermail/lightning-dev/"
-    ]
     current_date_str = None
     if not current_date_str:
         current_date_str = datetime.now().strftime("%Y-%m-%d")
@@ -530,85 +558,22 @@ if __name__ == "__main__":
     logger.info(f"start_date: {start_date_str}")
     logger.info(f"current_date_str: {current_date_str}")
 
+    watermarks = WatermarkStore()
+    if homepage_unchanged(watermarks, elastic_search, start_date_str):
+        logger.success("No doc indexed since the last run, no need to update homepage.json file")
+        sys.exit(0)
+
+    # the posts are collected for all the lists at the same time, then kept in the order of the lists
     recent_data_list = []
     active_data_list = []
-    for dev_url in dev_urls:
-        all_data_df, all_data_list = elastic_search.fetch_all_data_for_url(ES_INDEX, url=dev_url)
-        data_list = elastic_search.extract_data_from_es(ES_INDEX, dev_url, start_date_str, current_date_str)
-        dev_name = dev_url.split("/")[-2]
-        logger.info(f"Total threads received for {dev_name}: {len(data_list)}")
-
-        seen_titles = set()
-
-        # top active posts
-        active_posts_data = elastic_search.filter_top_active_posts(es_results=data_list, top_n=10,
-                                                                   all_data_df=all_data_df)
-
-        active_posts_data_counter = 0
-        for data in active_posts_data:
-            if active_posts_data_counter >= 3:
-                break
-
-            title = data['_source']['title']
-            if title in seen_titles:
-                continue
-            seen_titles.add(title)
-
-            counts, contributors = elastic_search.fetch_contributors_and_threads(title=title, domain=dev_url,
-                                                                                 df=all_data_df)
-            # get the first post's info of this title
-            df_title = all_data_df.loc[(all_data_df['title'] == title) & (all_data_df['domain'] == dev_url)]
-            df_title.sort_values(by='created_at', inplace=True)
-            original_post = df_title.iloc[0].to_dict()
-
-            for i in all_data_list:
-                if i['_source']['title'] == original_post['title'] and i['_source']['domain'] == original_post[
-                    'domain'] and i['_source']['authors'] == original_post['authors'] and i['_source']['created_at'] == \
-                        original_post['created_at'] and i['_source']['url'] == original_post['url']:
-                    for author in i['_source']['authors']:
-                        contributors.remove(author)
-                    i['_source']['n_threads'] = counts
-                    i['_source']['contributors'] = contributors
-                    i['_source']['dev_name'] = dev_name
-                    active_data_list.append(i)
-                    active_posts_data_counter += 1
-                    break
-
-        logger.info(f"Number of active posts collected: {len(active_data_list)}")
-
-        # top recent posts
-        recent_data_post_counter = 0
-        recent_posts_data = elastic_search.filter_top_recent_posts(es_results=data_list, top_n=20)
-        # if len(recent_posts_data) >= 3:
-        #     recent_posts_data = recent_posts_data[:3]
-
-        for data in recent_posts_data:
-
-            # if preprocess body text not longer than token_threshold, skip that post
-            if not gen.is_body_text_long(data=data, sent_threshold=2):
-                logger.info(f"skipping: {data['_source']['title']} - {data['_source']['url']}")
-                continue
-
-            title = data['_source']['title']
-            if title in seen_titles:
-                continue
-            seen_titles.add(title)
-            if recent_data_post_counter >= 3:
-                break
-            counts, contributors = elastic_search.fetch_contributors_and_threads(title=title, domain=dev_url,
-                                                                                 df=all_data_df)
-            authors = data['_source']['authors']
-            for author in authors:
-                contributors.remove(author)
-            data['_source']['n_threads'] = counts
-            data['_source']['contributors'] = contributors
-            data['_source']['dev_name'] = dev_name
-            recent_data_list.append(data)
-            recent_data_post_counter += 1
-
-        logger.info(f"Number of recent posts collected: {len(recent_data_list)}")
-
-    xml_ids = gen.get_existing_json_ids(file_path=r"static/homepage.json")
+    all_posts = {}
+    for dev_url, (recent_posts, active_posts, dev_posts) in zip(config.MAILING_LISTS, run_per_list(
+            lambda dev_url: collect_dev_posts(dev_url, gen, elastic_search, start_date_str, current_date_str))):
+        recent_data_list.extend(recent_posts)
+        active_data_list.extend(active_posts)
+        all_posts[get_dev_name(dev_url)] = dev_posts
+
+    xml_ids = gen.get_existing_json_ids(file_path=HOMEPAGE_PATH)
     recent_post_ids = [gen.get_id(data['_source']['title']) for data in recent_data_list]
     active_post_ids = [gen.get_id(data['_source']['title']) for data in active_data_list]
 
@@ -634,3 +599,8 @@ if __name__ == "__main__":
                     sys.exit(ex)
     else:
         logger.success("No change in recent posts, no need to update homepage.json file")
+
+    # the homepage is up to date with the posts fetched, until the window moves or a post is indexed
+    for dev_name, dev_posts in all_posts.items():
+        watermarks.advance("homepage", dev_name, dev_posts)
+    watermarks.set("homepage", "window", datetime.strptime(start_date_str, "%Y-%m-%d"))
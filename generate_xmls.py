@@ -14,7 +14,9 @@ from datetime import datetime
 import xml.etree.ElementTree as ET
 from src.utils import preprocess_email
 from src.gpt_utils import generate_chatgpt_summary, consolidate_chatgpt_summary
-from src.config import TOKENIZER, ES_CLOUD_ID, ES_USERNAME, ES_PASSWORD, ES_INDEX, ES_DATA_FETCH_SIZE
+from src.summary_planner import plan_summary, execute_plan
+from src import config
+from src.config import ES_CLOUD_ID, ES_USERNAME, ES_PASSWORD, ES_INDEX, ES_DATA_FETCH_SIZE
 from loguru import logger
 import warnings
 warnings.filterwarnings("ignore")
@@ -79,80 +81,30 @@ class GenerateXML:
             7: "July", 8: "Aug", 9: "Sept", 10: "Oct", 11: "Nov", 12: "Dec"
         }
 
-    def split_prompt_into_chunks(self, prompt, chunk_size):
-        tokens = TOKENIZER.encode(prompt)
-        chunks = []
-
-        while len(tokens) > 0:
-            current_chunk = TOKENIZER.decode(tokens[:chunk_size]).strip()
-
-            if current_chunk:
-                chunks.append(current_chunk)
-
-            tokens = tokens[chunk_size:]
-
-        return chunks
-
-    def get_summary_chunks(self, body, tokens_per_sub_body):
-        chunks = self.split_prompt_into_chunks(body, tokens_per_sub_body)
-        summaries = []
-
-        print(f"Total chunks: {len(chunks)}")
-
-        for chunk in chunks:
-            count = 0
-            while True:
-                try:
-                    time.sleep(2)
-                    summary = generate_chatgpt_summary(chunk)
-                    summaries.append(summary)
-                    break
-                except Exception as ex:
-                    count += 1
-                    if count > 5:
-                        break
-                    print(f"Chunk summary ran into error: {traceback.format_exc()}")
-
-        return summaries
-
-    def recursive_summary(self, body, tokens_per_sub_body, max_length):
-        summaries = self.get_summary_chunks(body, tokens_per_sub_body)
-
-        summary_length = sum([len(TOKENIZER.encode(s)) for s in summaries])
-
-        print(f"Summary length: {summary_length}")
-        print(f"Max length: {max_length}")
-
-        if summary_length > max_length:
-            print("entering in recursion")
-            return self.recursive_summary("".join(summaries), tokens_per_sub_body, max_length)
-        else:
-            return summaries
+    def call_with_retry(self, gpt_function, prompt):
+        count = 0
+        while True:
+            try:
+                time.sleep(2)
+                return gpt_function(prompt)
+            except Exception as ex:
+                count += 1
+                print(f"Summary ran into error: {traceback.format_exc()}")
+                if count > 5:
+                    # the plan cannot go on without this summary, the API error is raised instead of a None result
+                    raise
 
     def gpt_api(self, body):
-        body_length_limit = 2800
-        tokens_per_sub_body = 2700
-        summaries = self.recursive_summary(body, tokens_per_sub_body, body_length_limit)
-
-        if len(summaries) > 1:
+        plan = plan_summary(len(config.TOKENIZER.encode(body)))
+        if plan.total_calls > 1:
             print("Consolidate summary generating")
-            summary_str = "\n".join(summaries)
-            count = 0
-            while True:
-                try:
-                    time.sleep(2)
-                    consolidated_summaries = consolidate_chatgpt_summary(summary_str)
-                    break
-                except Exception as ex:
-                    count += 1
-                    if count > 5:
-                        break
-                    print(f"Consolidate summary ran into error {traceback.format_exc()}.")
-            return consolidated_summaries
-
         else:
             print("Individual summary generating")
-            return "\n".join(summaries)
+        return execute_plan(
+            plan, body,
+            summarize_fn=lambda chunk: self.call_with_retry(generate_chatgpt_summary, chunk),
+            consolidate_fn=lambda summaries: self.call_with_retry(consolidate_chatgpt_summary, summaries)
+        )
 
     def create_summary(self, body):
         summ = self.gpt_api(body)
@@ -4,12 +4,12 @@ from elasticsearch import Elasticsearch
 import traceback
 from datetime import datetime, timezone
 from loguru import logger
-import xml.etree.ElementTree as ET
 from dotenv import load_dotenv
 import warnings
-import glob
 import os
-from src.config import ES_CLOUD_ID, ES_USERNAME, ES_PASSWORD, ES_INDEX, ES_DATA_FETCH_SIZE
+from src.archive_store import get_archive_store
+from src.list_runner import get_dev_name
+from src.config import ES_CLOUD_ID, ES_USERNAME, ES_PASSWORD, ES_INDEX, ES_DATA_FETCH_SIZE, MAILING_LISTS
 
 warnings.filterwarnings("ignore")
 load_dotenv()
@@ -40,18 +40,14 @@ class XMLReader:
             xml_name = xml_name.replace(sc, "-")
         return xml_name
 
-    def read_xml_file(self, full_path):
-        namespaces = {'atom': 'http://www.w3.org/2005/Atom'}
-        tree = ET.parse(full_path)
-        root = tree.getroot()
-        title = root.findall(".//atom:entry/atom:title", namespaces)[0].text
+    def read_xml_file(self, record):
+        title = record["title"]
         title_for_id = title.replace('Combined summary - ', '')
         id = 'combined_' + self.clean_title(title_for_id)
-        summary = root.findall(".//atom:entry/atom:summary", namespaces)[0].text
-        published = root.findall(".//atom:entry/atom:published", namespaces)[0].text
-        link = root.findall(".//atom:entry/atom:link", namespaces)[0].get('href')
-        authors = root.findall('atom:author/atom:name', namespaces)
-        author_list = [author.text for author in authors]
+        summary = record["summary"]
+        published = record["published"]
+        link = record["url"]
+        author_list = record["authors"]
         domain = '/'.join(str(link).split("/")[:-2])
         indexed_at = ((datetime.now(timezone.utc)).replace(microsecond=0)).isoformat()
         return {
@@ -74,23 +70,22 @@ if __name__ == "__main__":
     elastic_search = ElasticSearchClient(es_cloud_id=ES_CLOUD_ID, es_username=ES_USERNAME,
                                          es_password=ES_PASSWORD)
 
+    archive_store = get_archive_store()
     total_combined_files = []
-    static_dirs = ['bitcoin-dev', 'lightning-dev']
-    pattern = "combined*.xml"
+    static_dirs = [get_dev_name(dev_url) for dev_url in MAILING_LISTS]
     for static_dir in static_dirs:
-        combined_files = glob.glob(f"static/{static_dir}/**/{pattern}")
-        total_combined_files.extend(combined_files)
+        total_combined_files.extend(archive_store.find(dev_name=static_dir, combined=True))
     logger.info(f"Total combined files: {(len(total_combined_files))}")
 
-    # get unique combined file paths
-    total_combined_files_dict = {os.path.splitext(os.path.basename(i))[0]: i for i in total_combined_files}
+    # get unique combined files
+    total_combined_files_dict = {os.path.splitext(i["filename"])[0]: i for i in total_combined_files}
 
     logger.info(f"Total unique combined files: {len(total_combined_files_dict)}")
 
-    for file_name, full_path in tqdm.tqdm(total_combined_files_dict.items()):
+    for file_name, record in tqdm.tqdm(total_combined_files_dict.items()):
         try:
             # get data from xml file
-            xml_file_data = xml_reader.read_xml_file(full_path)
+            xml_file_data = xml_reader.read_xml_file(record)
 
             # check if doc exist in ES index
             doc_exists = elastic_search.es_client.exists(index=ES_INDEX, id=file_name)
@@ -3,13 +3,15 @@ from elasticsearch import Elasticsearch
 import time
 from datetime import datetime, timedelta
 from loguru import logger
-import xml.etree.ElementTree as ET
 import os
 from dotenv import load_dotenv
 import warnings
 import pytz
 import tqdm
 
+from src.archive_store import get_archive_store
+from src.list_runner import run_per_list
+from src.watermarks import WatermarkStore, changed_since_query
 from src.config import ES_CLOUD_ID, ES_USERNAME, ES_PASSWORD, ES_INDEX, ES_DATA_FETCH_SIZE
 
 warnings.filterwarnings("ignore")
@@ -27,7 +29,9 @@ class ElasticSearchClient:
             http_auth=(self._es_username, self._es_password),
         )
 
-    def fetch_data_with_empty_summary(self, es_index, url=None, start_date_str=None, current_date_str=None):
+    def fetch_data_with_empty_summary(self, es_index, url=None, start_date_str=None, current_date_str=None,
+                                      since=None):
+        """:param since: datetime, only the documents indexed at or after it - see src/watermarks.py"""
         logger.info(f"connecting ElasticSearch to fetch the docs with summary ... ")
         output_list = []
         start_time = time.time()
@@ -120,6 +124,9 @@ class ElasticSearchClient:
                     }
                 }
 
+            if since:
+                query["query"]["bool"].setdefault("must", []).append(changed_since_query(since))
+
             # Initialize the scroll
             scroll_response = self._es_client.search(index=es_index, body=query, size=self._es_data_fetch_size,
                                                      scroll='1m')
@@ -157,6 +164,7 @@ class XMLReader:
             1: "Jan", 2: "Feb", 3: "March", 4: "April", 5: "May", 6: "June",
             7: "July", 8: "Aug", 9: "Sept", 10: "Oct", 11: "Nov", 12: "Dec"
         }
+        self.archive_store = get_archive_store()
 
     def get_id(self, id):
         return str(id).split("-")[-1]
@@ -177,17 +185,14 @@ class XMLReader:
         month_name = self.month_dict[int(published_at.month)]
         str_month_year = f"{month_name}_{int(published_at.year)}"
         current_directory = os.getcwd()
-        file_path = f"static/{dev_name}/{str_month_year}/{number}_{xml_name}.xml"
-        full_path = os.path.join(current_directory, file_path)
+        file_name = f"{number}_{xml_name}.xml"
+        full_path = os.path.join(current_directory, f"static/{dev_name}/{str_month_year}/{file_name}")
 
         try:
-            if os.path.exists(full_path):
-                namespaces = {'atom': 'http://www.w3.org/2005/Atom'}
-                tree = ET.parse(full_path)
-                root = tree.getroot()
-                summ_list = root.findall(".//atom:entry/atom:summary", namespaces)
-                if summ_list:
-                    summ = "\n".join([summ.text for summ in summ_list])
+            record = self.archive_store.get(dev_name, str_month_year, file_name)
+            if record:
+                summ = record["summary"]
+                if summ:
                     return summ, f"Summary text found: {full_path}"
                 else:
                     return None, f"No summary found: {full_path}"
@@ -199,6 +204,65 @@ class XMLReader:
             return None, ex_message
 
 
+def push_dev_summaries(dev_url, xml_reader, elastic_search, apply_date_range=False, watermarks=None):
+    """
+    Set the summary of the docs of a mailing list that have none, from their XML.
+    :param watermarks: WatermarkStore, to only fetch the docs indexed since the last run; the docs without an XML
+        yet are fetched again by the next runs
+    """
+    if apply_date_range:
+        current_date_str = None
+        if not current_date_str:
+            current_date_str = datetime.now().strftime("%Y-%m-%d")
+        start_date = datetime.now() - timedelta(days=15)
+        start_date_str = start_date.strftime("%Y-%m-%d")
+        logger.info(f"start_date: {start_date_str}")
+        logger.info(f"current_date_str: {current_date_str}")
+    else:
+        start_date_str = None
+        current_date_str = None
+
+    dev_name = dev_url.split("/")[-2]
+    # without a watermark yet, the usual window (`apply_date_range`) is used
+    since = watermarks.since("push_summary_to_es", dev_name) if watermarks else None
+    docs_list = elastic_search.fetch_data_with_empty_summary(ES_INDEX, dev_url, start_date_str, current_date_str,
+                                                             since=since)
+    logger.success(f"Total threads received for {dev_name}: {len(docs_list)}")
+
+    pending = []
+    for doc in tqdm.tqdm(docs_list):
+        res = None
+        try:
+            doc_id = doc['_id']
+            doc_index = doc['_index']
+            if not doc['_source'].get('summary'):
+                xml_summary, res = xml_reader.get_xml_summary(doc, dev_name)
+
+                if xml_summary:
+                    elastic_search.es_client.update(
+                        index=doc_index,
+                        id=doc_id,
+                        body={
+                            'doc': {
+                                "summary": xml_summary
+                            }
+                        }
+                    )
+                else:
+                    pending.append(doc)
+        except Exception as ex:
+            pending.append(doc)
+            error_message = f"Error occurred: {ex}"
+            if res:
+                error_message += f", Response: {res}"
+            logger.error(error_message)
+
+    if watermarks:
+        watermark = watermarks.advance("push_summary_to_es", dev_name, docs_list, pending=pending)
+        logger.info(f"Watermark of {dev_name}: {watermark.isoformat() if watermark else None}, "
+                    f"{len(pending)} doc(s) without summary kept in the window")
+
+
 if __name__ == "__main__":
 
     APPLY_DATE_RANGE = False
@@ -206,53 +270,9 @@ if __name__ == "__main__":
     xml_reader = XMLReader()
     elastic_search = ElasticSearchClient(es_cloud_id=ES_CLOUD_ID, es_username=ES_USERNAME,
                                          es_password=ES_PASSWORD)
+    watermarks = WatermarkStore()
 
-    dev_urls = [
-        "https://lists.linuxfoundation.org/pipermail/bitcoin-dev/",
-        "https://lists.linuxfoundation.org/pipermail/lightning-dev/"
-    ]
-
-    for dev_url in dev_urls:
-
-        if APPLY_DATE_RANGE:
-            current_date_str = None
-            if not current_date_str:
-                current_date_str = datetime.now().strftime("%Y-%m-%d")
-            start_date = datetime.now() - timedelta(days=15)
-            start_date_str = start_date.strftime("%Y-%m-%d")
-            logger.info(f"start_date: {start_date_str}")
-            logger.info(f"current_date_str: {current_date_str}")
-        else:
-            start_date_str = None
-            current_date_str = None
-
-        docs_list = elastic_search.fetch_data_with_empty_summary(ES_INDEX, dev_url, start_date_str, current_date_str)
-
-        dev_name = dev_url.split("/")[-2]
-        logger.success(f"Total threads received for {dev_name}: {len(docs_list)}")
-
-        for doc in tqdm.tqdm(docs_list):
-            res = None
-            try:
-                doc_id = doc['_id']
-                doc_index = doc['_index']
-                if not doc['_source'].get('summary'):
-                    xml_summary, res = xml_reader.get_xml_summary(doc, dev_name)
-
-                    if xml_summary:
-                        elastic_search.es_client.update(
-                            index=doc_index,
-                            id=doc_id,
-                            body={
-                                'doc': {
-                                    "summary": xml_summary
-                                }
-                            }
-                        )
-            except Exception as ex:
-                error_message = f"Error occurred: {ex}"
-                if res:
-                    error_message += f", Response: {res}"
-                logger.error(error_message)
+    run_per_list(lambda dev_url: push_dev_summaries(dev_url, xml_reader, elastic_search, APPLY_DATE_RANGE,
+                                                    watermarks))
 
     logger.success(f"Process complete.")
@@ -1,22 +1,41 @@
-import schedule
+"""
+Daily XML generation of each mailing list, run by the in-process job scheduler (see src/job_scheduler.py).
+
+The web app starts it next to the server; `python scheduler.py` runs it on its own.
+"""
 import time
-from generate_xmls import GenerateXML, ElasticSearchClient
-from src.config import ES_CLOUD_ID, ES_USERNAME, ES_PASSWORD, ES_INDEX
+
+from src.config import MAILING_LISTS
+from src.job_scheduler import JobScheduler
+from src.list_runner import get_dev_name, run_list
+
+# mailing list url: time of the daily run, the other lists of `MAILING_LISTS` run at DEFAULT_RUN_TIME
+RUN_TIMES = {
+    "https://lists.linuxfoundation.org/pipermail/bitcoin-dev/": "23:00",
+    "https://lists.linuxfoundation.org/pipermail/lightning-dev/": "02:00",
+}
+DEFAULT_RUN_TIME = "23:00"
 
 
 def generate_xml(url):
-    gen = GenerateXML()
-    # scrap data and save json and then pass it to xml
-    elastic_search = ElasticSearchClient(es_cloud_id=ES_CLOUD_ID, es_username=ES_USERNAME,
-                                         es_password=ES_PASSWORD)
-    data_list = elastic_search.extract_data_from_es(ES_INDEX, url)
-    gen.start(data_list, url)
+    # the generator (pandas, elasticsearch, openai) is only imported when a job runs
+    from xmls_generator_production import generate_dev_xmls
+
+    run_list(generate_dev_xmls, url)
 
 
-schedule.every().day.at("23:00").do(generate_xml(url="https://lists.linuxfoundation.org/pipermail/bitcoin-dev/"))
-schedule.every().day.at("02:00").do(generate_xml(url="https://lists.linuxfoundation.org/pipermail/lightning-dev/"))
+def create_scheduler():
+    # one more worker for the jobs added next to the XML generation (e.g. the archive store sync of the web app)
+    job_scheduler = JobScheduler(max_workers=len(MAILING_LISTS) + 1)
+    for url in MAILING_LISTS:
+        job_scheduler.add_job(get_dev_name(url), generate_xml, at=RUN_TIMES.get(url, DEFAULT_RUN_TIME), url=url)
+    return job_scheduler
 
 
-while True:
-    schedule.run_pending()
-    time.sleep(1)
+if __name__ == "__main__":
+    job_scheduler = create_scheduler().start()
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        job_scheduler.stop()
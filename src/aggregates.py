@@ -0,0 +1,252 @@
+"""
+Contributor and thread aggregates of the archive, materialized in the archive store database.
+
+Per month tables are computed from the summaries of that month only and are recomputed when the month changes
+(new, removed or rewritten XMLs), so an update only reads the new months. The archive wide tables are then
+rebuilt from the (much smaller) per month tables:
+
+* `agg_author_month`: messages and threads of an author in a month, with the first/last activity of the month
+* `agg_thread_month`: messages, authors and first/last activity of a thread in a month, and the XML it links to
+* `agg_authors`: totals of an author over the whole archive, with the first and last activity
+* `agg_threads`: totals of a thread over the whole archive, ranked by replies
+
+Combined summaries are not messages: they are only used to link a thread to its combined summary.
+
+Run `python -m src.aggregates` to update the tables.
+"""
+import json
+import re
+
+from loguru import logger
+
+from src.archive_store import get_archive_store
+from src.threads import thread_key
+
+COMBINED_TITLE_PREFIX = "Combined summary - "
+AGGREGATES_VERSION = 2  # bump when the rows computed from a month change (e.g. the thread keys)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS agg_months (
+    dev_name TEXT NOT NULL,
+    year_month TEXT NOT NULL,
+    signature TEXT NOT NULL,
+    PRIMARY KEY (dev_name, year_month)
+);
+CREATE TABLE IF NOT EXISTS agg_author_month (
+    dev_name TEXT NOT NULL,
+    year_month TEXT NOT NULL,
+    author TEXT NOT NULL,
+    messages INTEGER NOT NULL,
+    threads INTEGER NOT NULL,
+    first_published TEXT,
+    last_published TEXT,
+    PRIMARY KEY (dev_name, year_month, author)
+);
+CREATE INDEX IF NOT EXISTS agg_author_month_author ON agg_author_month (dev_name, author);
+CREATE TABLE IF NOT EXISTS agg_thread_month (
+    dev_name TEXT NOT NULL,
+    year_month TEXT NOT NULL,
+    thread_key TEXT NOT NULL,
+    title TEXT,
+    messages INTEGER NOT NULL,
+    authors TEXT NOT NULL,
+    first_published TEXT,
+    last_published TEXT,
+    filename TEXT,
+    PRIMARY KEY (dev_name, year_month, thread_key)
+);
+CREATE TABLE IF NOT EXISTS agg_authors (
+    dev_name TEXT NOT NULL,
+    author TEXT NOT NULL,
+    slug TEXT NOT NULL,
+    messages INTEGER NOT NULL,
+    threads INTEGER NOT NULL,
+    months_active INTEGER NOT NULL,
+    first_published TEXT,
+    last_published TEXT,
+    PRIMARY KEY (dev_name, author)
+);
+CREATE INDEX IF NOT EXISTS agg_authors_messages ON agg_authors (dev_name, messages DESC);
+CREATE INDEX IF NOT EXISTS agg_authors_slug ON agg_authors (dev_name, slug);
+CREATE TABLE IF NOT EXISTS agg_threads (
+    dev_name TEXT NOT NULL,
+    thread_key TEXT NOT NULL,
+    title TEXT,
+    messages INTEGER NOT NULL,
+    replies INTEGER NOT NULL,
+    participants INTEGER NOT NULL,
+    first_published TEXT,
+    last_published TEXT,
+    year_month TEXT,
+    filename TEXT,
+    PRIMARY KEY (dev_name, thread_key)
+);
+CREATE INDEX IF NOT EXISTS agg_threads_replies ON agg_threads (dev_name, replies DESC);
+"""
+
+
+def author_name(author):
+    # authors are stored as "<name> <date> <time>"
+    parts = author.split()
+    return " ".join(parts[:-2]) if len(parts) > 2 else author.strip()
+
+
+def author_slug(author):
+    return re.sub(r'[^A-Za-z0-9]+', '-', author).strip('-').lower() or "unknown"
+
+
+def month_signatures(connection):
+    """
+    (number of XMLs, total of mtimes) of every month, it changes when an XML is added, removed or rewritten.
+    `AGGREGATES_VERSION` is part of it, so that all the months are recomputed when the aggregation changes.
+    """
+    return {(dev_name, year_month): f"v{AGGREGATES_VERSION}:{count}:{mtimes}"
+            for dev_name, year_month, count, mtimes in connection.execute(
+                "SELECT dev_name, year_month, count(*), total(mtime_ns) FROM summaries GROUP BY dev_name, year_month")}
+
+
+def aggregate_month(records):
+    """
+    Per author and per thread rows of a month.
+    :param records: iterable of archive store records of a single month
+    """
+    authors, threads, combined = {}, {}, {}
+    for record in records:
+        if record["combined"]:
+            combined[thread_key(record["title"][len(COMBINED_TITLE_PREFIX):])] = record["filename"]
+            continue
+        name = author_name(record["authors"][0]) if record["authors"] else "Unknown"
+        key = thread_key(record["title"])
+        published = record["published"]
+
+        author = authors.setdefault(name, {"messages": 0, "threads": set(), "first": published, "last": published})
+        author["messages"] += 1
+        author["threads"].add(key)
+        author["first"], author["last"] = min(author["first"], published), max(author["last"], published)
+
+        thread = threads.setdefault(key, {"title": record["title"], "messages": 0, "authors": set(),
+                                          "first": published, "last": published, "filename": record["filename"]})
+        thread["messages"] += 1
+        thread["authors"].add(name)
+        if published < thread["first"]:
+            thread["first"], thread["filename"] = published, record["filename"]
+        thread["last"] = max(thread["last"], published)
+
+    # a thread links to its combined summary, or to its first message when it has none
+    author_rows = [(name, a["messages"], len(a["threads"]), a["first"], a["last"]) for name, a in authors.items()]
+    thread_rows = [(key, t["title"], t["messages"], json.dumps(sorted(t["authors"])), t["first"], t["last"],
+                    combined.get(key, t["filename"])) for key, t in threads.items()]
+    return author_rows, thread_rows
+
+
+def update_aggregates(store=None):
+    """
+    Recompute the per month tables of the months changed since the last update, then the archive wide tables.
+    :return: int, number of months recomputed
+    """
+    store = store or get_archive_store()
+    connection = store.connection
+    connection.executescript(SCHEMA)
+
+    signatures = month_signatures(connection)
+    aggregated = {(dev_name, year_month): signature for dev_name, year_month, signature in connection.execute(
+        "SELECT dev_name, year_month, signature FROM agg_months")}
+    changed = [month for month, signature in signatures.items() if aggregated.get(month) != signature]
+    removed = [month for month in aggregated if month not in signatures]
+    if not changed and not removed:
+        return 0
+
+    with connection:
+        for dev_name, year_month in changed + removed:
+            for table in ("agg_months", "agg_author_month", "agg_thread_month"):
+                connection.execute(f"DELETE FROM {table} WHERE dev_name = ? AND year_month = ?", (dev_name, year_month))
+        for dev_name, year_month in changed:
+            author_rows, thread_rows = aggregate_month(store.find(dev_name=dev_name, year_month=year_month))
+            connection.executemany("INSERT INTO agg_author_month VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                   [(dev_name, year_month, *row) for row in author_rows])
+            connection.executemany("INSERT INTO agg_thread_month VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                   [(dev_name, year_month, *row) for row in thread_rows])
+            connection.execute("INSERT INTO agg_months VALUES (?, ?, ?)",
+                               (dev_name, year_month, signatures[(dev_name, year_month)]))
+        rebuild_totals(connection)
+
+    logger.info(f"Aggregates updated: {len(changed)} month(s) recomputed, {len(removed)} removed")
+    return len(changed)
+
+
+def rebuild_totals(connection):
+    connection.execute("DELETE FROM agg_authors")
+    rows = connection.execute(
+        "SELECT dev_name, author, sum(messages), count(*), min(first_published), max(last_published) "
+        "FROM agg_author_month GROUP BY dev_name, author").fetchall()
+    # the thread count of an author is over distinct threads, a thread can span several months
+    author_threads = {}
+    thread_authors = {}
+    for dev_name, key, authors in connection.execute("SELECT dev_name, thread_key, authors FROM agg_thread_month"):
+        thread_authors.setdefault((dev_name, key), set()).update(json.loads(authors))
+    for (dev_name, key), authors in thread_authors.items():
+        for name in authors:
+            author_threads[(dev_name, name)] = author_threads.get((dev_name, name), 0) + 1
+    connection.executemany(
+        "INSERT INTO agg_authors VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        [(dev_name, name, author_slug(name), messages, author_threads.get((dev_name, name), 0), months, first, last)
+         for dev_name, name, messages, months, first, last in rows])
+
+    connection.execute("DELETE FROM agg_threads")
+    threads = {}
+    for dev_name, year_month, key, title, messages, first, last, filename in connection.execute(
+            "SELECT dev_name, year_month, thread_key, title, messages, first_published, last_published, filename "
+            "FROM agg_thread_month ORDER BY first_published"):
+        thread = threads.get((dev_name, key))
+        if thread is None:
+            # a thread spanning several months links to the XML of its first month
+            thread = threads[(dev_name, key)] = {"title": title, "messages": 0, "first": first, "last": last,
+                                                 "year_month": year_month, "filename": filename}
+        thread["messages"] += messages
+        thread["last"] = max(thread["last"], last)
+    connection.executemany(
+        "INSERT INTO agg_threads VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        [(dev_name, key, t["title"], t["messages"], t["messages"] - 1, len(thread_authors[(dev_name, key)]),
+          t["first"], t["last"], t["year_month"], t["filename"]) for (dev_name, key), t in threads.items()])
+
+
+def top_authors(dev_name, limit=100, store=None):
+    store = store or get_archive_store()
+    columns = ("author", "slug", "messages", "threads", "months_active", "first_published", "last_published")
+    return [dict(zip(columns, row)) for row in store.connection.execute(
+        f"SELECT {', '.join(columns)} FROM agg_authors WHERE dev_name = ? ORDER BY messages DESC, author LIMIT ?",
+        (dev_name, limit))]
+
+
+def author_activity(dev_name, slug, store=None):
+    """Totals and per month activity of the author(s) of `slug`."""
+    store = store or get_archive_store()
+    authors = []
+    for author, messages, threads, months_active, first, last in store.connection.execute(
+            "SELECT author, messages, threads, months_active, first_published, last_published FROM agg_authors "
+            "WHERE dev_name = ? AND slug = ?", (dev_name, slug)):
+        months = [dict(zip(("year_month", "messages", "threads"), row)) for row in store.connection.execute(
+            "SELECT year_month, messages, threads FROM agg_author_month WHERE dev_name = ? AND author = ? "
+            "ORDER BY first_published DESC", (dev_name, author))]
+        authors.append({"author": author, "messages": messages, "threads": threads, "months_active": months_active,
+                        "first_published": first, "last_published": last, "months": months})
+    return authors
+
+
+def top_threads(dev_name, limit=100, store=None):
+    store = store or get_archive_store()
+    columns = ("title", "messages", "replies", "participants", "first_published", "last_published", "year_month",
+               "filename")
+    return [dict(zip(columns, row)) for row in store.connection.execute(
+        f"SELECT {', '.join(columns)} FROM agg_threads WHERE dev_name = ? ORDER BY replies DESC, title LIMIT ?",
+        (dev_name, limit))]
+
+
+def author_slugs(dev_name, store=None):
+    store = store or get_archive_store()
+    return [row[0] for row in store.connection.execute(
+        "SELECT DISTINCT slug FROM agg_authors WHERE dev_name = ?", (dev_name,))]
+
+
+if __name__ == "__main__":
+    update_aggregates()
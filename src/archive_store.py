@@ -0,0 +1,235 @@
+"""
+SQLite store of all the summary records, next to the XML tree.
+
+The XMLs in `static/` stay the source of truth; the store holds one row per XML (metadata and summary text) so
+that batch jobs can scan or look up the whole archive without opening and parsing thousands of files. It is
+kept in sync by the XML writer and `sync()` brings it up to date with the tree incrementally (only files whose
+mtime/size changed are read), so it can be deleted and rebuilt at any time.
+
+Summaries are indexed for full-text search (SQLite FTS5) over title, authors and summary; triggers keep the
+index in sync with every write to the store.
+"""
+import html
+import json
+import os
+import sqlite3
+import threading
+
+from src import config
+from src.combined_store import resolve_xml_path
+from src.manifest import iter_month_folders, load_manifest, read_folder_entry, read_summary
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS summaries (
+    dev_name TEXT NOT NULL,
+    year_month TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    title TEXT,
+    authors TEXT,
+    published TEXT,
+    url TEXT,
+    links TEXT,
+    combined INTEGER NOT NULL,
+    summary TEXT,
+    mtime_ns INTEGER,
+    size INTEGER,
+    PRIMARY KEY (dev_name, year_month, filename)
+);
+CREATE INDEX IF NOT EXISTS summaries_published ON summaries (dev_name, published);
+CREATE INDEX IF NOT EXISTS summaries_title ON summaries (title);
+"""
+SEARCH_SCHEMA = """
+CREATE VIRTUAL TABLE summaries_fts USING fts5(
+    title, authors, summary, content='summaries', content_rowid='rowid', tokenize='porter unicode61'
+);
+CREATE TRIGGER summaries_ai AFTER INSERT ON summaries BEGIN
+    INSERT INTO summaries_fts (rowid, title, authors, summary) VALUES (new.rowid, new.title, new.authors, new.summary);
+END;
+CREATE TRIGGER summaries_ad AFTER DELETE ON summaries BEGIN
+    INSERT INTO summaries_fts (summaries_fts, rowid, title, authors, summary)
+    VALUES ('delete', old.rowid, old.title, old.authors, old.summary);
+END;
+CREATE TRIGGER summaries_au AFTER UPDATE ON summaries BEGIN
+    INSERT INTO summaries_fts (summaries_fts, rowid, title, authors, summary)
+    VALUES ('delete', old.rowid, old.title, old.authors, old.summary);
+    INSERT INTO summaries_fts (rowid, title, authors, summary) VALUES (new.rowid, new.title, new.authors, new.summary);
+END;
+-- index the rows stored before the search index existed
+INSERT INTO summaries_fts (summaries_fts) VALUES ('rebuild');
+"""
+# bm25 weights of the title, authors and summary columns
+SEARCH_WEIGHTS = (10.0, 5.0, 1.0)
+SNIPPET_START, SNIPPET_END = "\x02", "\x03"
+COLUMNS = ("dev_name", "year_month", "filename", "title", "authors", "published", "url", "links", "combined",
+           "summary", "mtime_ns", "size")
+
+
+def to_record(row):
+    record = dict(zip(COLUMNS, row))
+    record["authors"] = json.loads(record["authors"])
+    record["links"] = json.loads(record["links"])
+    record["combined"] = bool(record["combined"])
+    return record
+
+
+def match_expression(query):
+    """
+    FTS5 expression matching all the words of a user query. Every word is quoted so that the FTS5 syntax
+    characters (quotes, parentheses, `-`, `:`...) of the query are searched for instead of being interpreted.
+    """
+    terms = []
+    for word in query.split():
+        prefix = word.endswith("*")
+        word = word.rstrip("*").replace('"', '""')
+        if word:
+            terms.append(f'"{word}"*' if prefix else f'"{word}"')
+    return " ".join(terms)
+
+
+class ArchiveStore:
+    """One connection per thread; the database runs in WAL mode so readers are not blocked by the writer."""
+
+    def __init__(self, db_path=config.ARCHIVE_DB_PATH, static_dir="static"):
+        self.db_path = db_path
+        self.static_dir = static_dir
+        self._local = threading.local()
+
+    @property
+    def connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.db_path)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(SCHEMA)
+            if not connection.execute("SELECT 1 FROM sqlite_master WHERE name = 'summaries_fts'").fetchone():
+                connection.executescript(f"BEGIN; {SEARCH_SCHEMA} COMMIT;")
+            self._local.connection = connection
+        return connection
+
+    def _row(self, xml_path, entry=None):
+        month_folder, filename = os.path.split(xml_path)
+        dev_folder, year_month = os.path.split(month_folder)
+        entry = entry or read_folder_entry(month_folder, filename)
+        # a combined summary shared by several months is read (and stat'ed) through its pointer
+        stat = os.stat(resolve_xml_path(month_folder, filename))
+        return (os.path.basename(dev_folder), year_month, filename, entry["title"], json.dumps(entry["authors"]),
+                entry["published"], entry["url"], json.dumps(entry["links"]), int(entry["combined"]),
+                read_summary(month_folder, filename, entry), stat.st_mtime_ns, stat.st_size)
+
+    def _upsert(self, rows):
+        # an upsert (not INSERT OR REPLACE) so that the update trigger keeps the search index in sync
+        updates = ", ".join(f"{column} = excluded.{column}" for column in COLUMNS[3:])
+        with self.connection:
+            self.connection.executemany(
+                f"INSERT INTO summaries ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))}) "
+                f"ON CONFLICT (dev_name, year_month, filename) DO UPDATE SET {updates}",
+                rows)
+
+    def upsert_xml(self, xml_path, entry=None):
+        """Store the record of an XML that has just been (re)written, `entry` is its manifest entry if known."""
+        self._upsert([self._row(xml_path, entry)])
+
+    def sync(self, write_manifests=True):
+        """
+        Bring the store up to date with the XML tree: (re)read the files whose mtime/size changed and drop the rows
+        of removed files.
+        :param write_manifests: bool, save the month manifests brought up to date on the way
+        :return: tuple, (number of rows written, number of rows deleted)
+        """
+        known = {row[:3]: row[3:] for row in self.connection.execute(
+            "SELECT dev_name, year_month, filename, mtime_ns, size FROM summaries")}
+        rows = []
+        seen = set()
+        for dev_name in sorted(os.listdir(self.static_dir)):
+            dev_folder = os.path.join(self.static_dir, dev_name)
+            if not os.path.isdir(dev_folder):
+                continue
+            for month_folder in iter_month_folders(dev_folder):
+                year_month = os.path.basename(month_folder)
+                for filename in load_manifest(month_folder, write=write_manifests):
+                    key = (dev_name, year_month, filename)
+                    seen.add(key)
+                    stat = os.stat(resolve_xml_path(month_folder, filename))
+                    if known.get(key) != (stat.st_mtime_ns, stat.st_size):
+                        # read from the file, not from a manifest entry that may predate the change
+                        rows.append(self._row(os.path.join(month_folder, filename)))
+
+        removed = [key for key in known if key not in seen]
+        self._upsert(rows)
+        with self.connection:
+            self.connection.executemany(
+                "DELETE FROM summaries WHERE dev_name = ? AND year_month = ? AND filename = ?", removed)
+        return len(rows), len(removed)
+
+    def get(self, dev_name, year_month, filename):
+        row = self.connection.execute(
+            f"SELECT {', '.join(COLUMNS)} FROM summaries WHERE dev_name = ? AND year_month = ? AND filename = ?",
+            (dev_name, year_month, filename)).fetchone()
+        return to_record(row) if row else None
+
+    def find(self, dev_name=None, year_month=None, title=None, combined=None, since=None, until=None):
+        """
+        Records matching all the given filters, ordered by published date.
+        :param since: str, ISO date, inclusive lower bound of the published date
+        :param until: str, ISO date, exclusive upper bound of the published date
+        """
+        filters = {"dev_name = ?": dev_name, "year_month = ?": year_month, "title = ?": title,
+                   "combined = ?": None if combined is None else int(combined),
+                   "published >= ?": since, "published < ?": until}
+        filters = {clause: value for clause, value in filters.items() if value is not None}
+        where = f"WHERE {' AND '.join(filters)}" if filters else ""
+        for row in self.connection.execute(
+                f"SELECT {', '.join(COLUMNS)} FROM summaries {where} ORDER BY published", list(filters.values())):
+            yield to_record(row)
+
+    def search(self, query, dev_name=None, year_month=None, page=1, per_page=20):
+        """
+        Full-text search ranked by BM25, title and author matches weigh more than summary matches.
+        :param query: str, words to look for, all of them must match (a trailing `*` matches a prefix)
+        :return: tuple, (total number of matches, records of the page with an html `snippet` of the summary)
+        """
+        match = match_expression(query)
+        if not match:
+            return 0, []
+        # unary + keeps sqlite from driving the query by the summaries indexes instead of the search index
+        filters = {"+s.dev_name = ?": dev_name, "+s.year_month = ?": year_month}
+        filters = {clause: value for clause, value in filters.items() if value}
+        where = " ".join(f"AND {clause}" for clause in filters)
+        params = [match, *filters.values()]
+
+        total = self.connection.execute(
+            f"SELECT count(*) FROM summaries_fts JOIN summaries s ON s.rowid = summaries_fts.rowid "
+            f"WHERE summaries_fts MATCH ? {where}", params).fetchone()[0]
+        rows = self.connection.execute(
+            f"SELECT {', '.join('s.' + column for column in COLUMNS)}, "
+            f"snippet(summaries_fts, 2, '{SNIPPET_START}', '{SNIPPET_END}', '...', 32) "
+            f"FROM summaries_fts JOIN summaries s ON s.rowid = summaries_fts.rowid "
+            f"WHERE summaries_fts MATCH ? {where} "
+            f"ORDER BY bm25(summaries_fts, {', '.join(map(str, SEARCH_WEIGHTS))}) LIMIT ? OFFSET ?",
+            [*params, per_page, (max(page, 1) - 1) * per_page]).fetchall()
+
+        results = []
+        for row in rows:
+            record = to_record(row[:-1])
+            record["snippet"] = (html.escape(row[-1] or "")
+                                 .replace(SNIPPET_START, "<b>").replace(SNIPPET_END, "</b>"))
+            results.append(record)
+        return total, results
+
+    def months(self, dev_name):
+        return [row[0] for row in self.connection.execute(
+            "SELECT DISTINCT year_month FROM summaries WHERE dev_name = ?", (dev_name,))]
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_archive_store(db_path=config.ARCHIVE_DB_PATH):
+    """Return the (shared) store of `db_path`, synced with the XML tree on first use."""
+    with _stores_lock:
+        if db_path not in _stores:
+            store = ArchiveStore(db_path)
+            store.sync()
+            _stores[db_path] = store
+    return _stores[db_path]
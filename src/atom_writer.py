@@ -0,0 +1,192 @@
+"""
+Atom serializer and atomic file writer of the summary XMLs.
+
+`render_feed` produces the same document as the `feedgen.FeedGenerator` built by `GenerateXML.generate_xml`
+(same elements, order, escaping and pretty-printing, byte for byte apart from the `<updated>` timestamps),
+with plain string formatting instead of building an lxml tree of a full feed object for every file.
+
+Files are written atomically (temporary file in the same folder, then rename), so a reader never sees a
+partially written XML. `BatchedWriter` defers the fsyncs and issues them folder by folder on `flush()`, and
+leaves alone the files whose content on disk only differs by the `<updated>` timestamps: an unchanged summary
+keeps its bytes and mtime, so git, the mtime based caches and the downstream stages only see real changes.
+"""
+import os
+import re
+import tempfile
+from datetime import datetime, timezone
+
+import dateutil.parser
+
+GENERATOR = '<generator uri="https://lkiesow.github.io/python-feedgen" version="0.9.0">python-feedgen</generator>'
+# characters lxml refuses in a document: control characters (but tab/newline/carriage return) and non-characters
+INVALID_XML_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ud800-\udfff\ufffe\uffff]')
+# elements set to the time of writing, ignored when comparing a document with the file on disk
+VOLATILE_ELEMENTS = re.compile(rb'<updated>[^<]*</updated>')
+# mode of the new files, as `open()` would create them: the temporary files of mkstemp are only readable by us
+UMASK = os.umask(0)
+os.umask(UMASK)
+NEW_FILE_MODE = 0o666 & ~UMASK
+
+
+def check_xml_text(value):
+    if INVALID_XML_CHARS.search(value):
+        raise ValueError("All strings must be XML compatible: Unicode or ASCII, no NULL bytes or control characters")
+    return value
+
+
+def escape_text(value):
+    return (check_xml_text(value).replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+            .replace("\r", "&#13;"))
+
+
+def escape_attribute(value):
+    return (escape_text(value).replace('"', "&quot;").replace("\n", "&#10;").replace("\t", "&#9;"))
+
+
+def text_element(name, value, indent):
+    value = escape_text(value)
+    return f"{indent}<{name}>{value}</{name}>\n" if value else f"{indent}<{name}/>\n"
+
+
+def format_published(published):
+    if isinstance(published, str):
+        published = dateutil.parser.parse(published)
+    if not isinstance(published, datetime):
+        raise ValueError('Invalid datetime format')
+    if published.tzinfo is None:
+        raise ValueError('Datetime object has no timezone info')
+    return published.isoformat()
+
+
+def render_feed(feed_data, updated=None):
+    """
+    Atom document of a summary XML.
+    :param feed_data: dict, with the `id`, `title`, `authors`, `url`, `links`, `created_at` and `summary` of the XML
+    :param updated: datetime, time of the `<updated>` elements, defaults to now
+    :return: bytes, the UTF-8 encoded document
+    """
+    if not (feed_data['id'] and feed_data['title']):
+        raise ValueError('Required fields not set')
+    updated = (updated or datetime.now(timezone.utc)).isoformat()
+    published = format_published(feed_data['created_at'])
+    feed_id, title = escape_text(feed_data['id']), escape_text(feed_data['title'])
+
+    parts = ["<?xml version='1.0' encoding='UTF-8'?>\n",
+             '<feed xmlns="http://www.w3.org/2005/Atom">\n',
+             f"  <id>{feed_id}</id>\n",
+             f"  <title>{title}</title>\n",
+             f"  <updated>{updated}</updated>\n"]
+    for author in feed_data['authors']:
+        # as feedgen, an author without a name is skipped
+        if author:
+            parts.append(f"  <author>\n{text_element('name', author, '    ')}  </author>\n")
+    for link in feed_data['links']:
+        parts.append(f'  <link href="{escape_attribute(link)}" rel="alternate"/>\n')
+    parts.append(f"  {GENERATOR}\n")
+    parts += ["  <entry>\n",
+              f"    <id>{feed_id}</id>\n",
+              f"    <title>{title}</title>\n",
+              f"    <updated>{updated}</updated>\n",
+              f'    <link href="{escape_attribute(feed_data["url"])}" rel="alternate"/>\n']
+    if feed_data['summary'] is not None:
+        parts.append(text_element('summary', feed_data['summary'], '    '))
+    parts += [f"    <published>{published}</published>\n",
+              "  </entry>\n",
+              "</feed>\n"]
+    return "".join(parts).encode("utf-8")
+
+
+def same_content(data, other):
+    """Whether two documents are equal apart from their volatile elements."""
+    return data == other or VOLATILE_ELEMENTS.sub(b"", data) == VOLATILE_ELEMENTS.sub(b"", other)
+
+
+def fsync_folder(folder):
+    # makes the renames of the folder durable, not supported on Windows
+    if os.name == "nt":
+        return
+    fd = os.open(folder, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def write_atomic(path, data, fsync=True):
+    """
+    Replace `path` with `data` in one step: readers see the old or the new file, never a partial one.
+    :param fsync: bool, flush the file (before the rename) and the folder (after it) to disk
+    """
+    folder = os.path.dirname(path) or "."
+    try:
+        mode = os.stat(path).st_mode & 0o7777  # a rewritten file keeps its mode
+    except FileNotFoundError:
+        mode = NEW_FILE_MODE
+    fd, temp_path = tempfile.mkstemp(dir=folder, prefix=".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            os.fchmod(f.fileno(), mode)
+            f.write(data)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    if fsync:
+        fsync_folder(folder)
+
+
+class BatchedWriter:
+    """
+    Atomic writes whose fsyncs are grouped: the files are renamed in place right away (and visible to readers),
+    and `flush()` then syncs the written files and, once per folder, the folder holding them.
+
+    A file whose content on disk is the same apart from the volatile elements is not rewritten. `counts` keeps
+    the number of files `written` (new or changed), `changed` (existing files rewritten) and `skipped`.
+    """
+
+    def __init__(self):
+        self.pending = {}  # folder -> paths written since the last flush
+        self.counts = {"written": 0, "changed": 0, "skipped": 0}
+
+    def write(self, path, data):
+        """:return: bool, False if the file already had this content and was left untouched"""
+        exists = os.path.exists(path)
+        if exists:
+            with open(path, "rb") as f:
+                if same_content(data, f.read()):
+                    self.counts["skipped"] += 1
+                    return False
+        write_atomic(path, data, fsync=False)
+        self.pending.setdefault(os.path.dirname(path) or ".", []).append(path)
+        self.counts["written"] += 1
+        self.counts["changed"] += exists
+        return True
+
+    def copy(self, source_path, path):
+        with open(source_path, "rb") as f:
+            return self.write(path, f.read())
+
+    def flush(self):
+        """:return: int, number of files synced"""
+        synced = 0
+        for folder, paths in self.pending.items():
+            for path in dict.fromkeys(paths):
+                fd = os.open(path, os.O_RDONLY)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+                synced += 1
+            fsync_folder(folder)
+        self.pending = {}
+        return synced
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.flush()
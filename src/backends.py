@@ -0,0 +1,312 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+import openai
+import requests
+from loguru import logger
+
+from src import config
+from src.prompts import get_template
+
+
+@dataclass(frozen=True)
+class SummarizeRequest:
+    text: str
+
+
+@dataclass(frozen=True)
+class ConsolidateRequest:
+    text: str
+
+
+@dataclass(frozen=True)
+class TitleRequest:
+    text: str
+
+
+@dataclass(frozen=True)
+class BulletsRequest:
+    text: str
+    n: int = 3
+
+
+@dataclass(frozen=True)
+class HeaderSummaryRequest:
+    text: str
+
+
+def parse_batch_summaries(response, items):
+    """
+    Validate the JSON array returned for a batch; returns id -> summary for the well-formed items only.
+    """
+    response = response.strip()
+    if response.startswith("```"):
+        response = response.strip("`").split("\n", 1)[-1]
+    try:
+        records = json.loads(response[response.find("["):response.rfind("]") + 1])
+    except ValueError:
+        return {}
+    if not isinstance(records, list):
+        return {}
+
+    summaries = {}
+    expected = {str(item_id): item_id for item_id in items}
+    for record in records:
+        if not isinstance(record, dict):
+            continue
+        item_id, summary = str(record.get("id", "")), record.get("summary")
+        if item_id in expected and isinstance(summary, str) and summary.strip():
+            summaries[expected[item_id]] = summary.strip()
+    return summaries
+
+
+def format_bullets(text):
+    text = text.replace("\n", "").strip()
+    text = text.replace('.- ', '.\n- ')
+    text = text.replace('. - ', '.\n- ')
+    return text
+
+
+class RateLimiter:
+    """
+    Spaces the calls to at most `requests_per_minute`, across all the threads sharing the limiter (e.g. the
+    mailing lists processed at the same time). A rate of 0 disables the limit.
+    """
+
+    def __init__(self, requests_per_minute):
+        self.interval = 60.0 / requests_per_minute if requests_per_minute else 0.0
+        self._lock = threading.Lock()
+        self._next_call = 0.0
+
+    def acquire(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            wait = self._next_call - now
+            self._next_call = max(now, self._next_call) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+
+class ResponseCache:
+    """
+    Completions keyed by template version, model, parameters and content: a template change (new version) never
+    reuses a stale response. Responses are kept in memory, and on disk as well when `cache_dir` is set.
+    """
+
+    def __init__(self, cache_dir=config.RESPONSE_CACHE_DIR):
+        self.cache_dir = cache_dir
+        self._responses = {}
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, template, model, variables, params):
+        payload = json.dumps([template.key, model, variables, params], sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        if key in self._responses:
+            return self._responses[key]
+        if self.cache_dir:
+            path = os.path.join(self.cache_dir, f"{key}.txt")
+            if os.path.exists(path):
+                with open(path, "r", encoding="utf-8") as f:
+                    self._responses[key] = f.read()
+                return self._responses[key]
+        return None
+
+    def set(self, key, response):
+        self._responses[key] = response
+        if self.cache_dir:
+            with open(os.path.join(self.cache_dir, f"{key}.txt"), "w", encoding="utf-8") as f:
+                f.write(response)
+
+
+class ModelBackend:
+    """
+    Interface of a completion backend. `generate` takes a list of typed requests and returns one string per
+    request, in the same order; backends that can serve several requests at once override it.
+    """
+    name = None
+
+    def generate_one(self, request):
+        raise NotImplementedError
+
+    def generate(self, requests_list):
+        return [self.generate_one(request) for request in requests_list]
+
+    def summarize(self, text):
+        return self.generate([SummarizeRequest(text)])[0]
+
+    def consolidate(self, text):
+        return self.generate([ConsolidateRequest(text)])[0]
+
+    def title(self, text):
+        return self.generate([TitleRequest(text)])[0]
+
+    def bullets(self, text, n=3):
+        return self.generate([BulletsRequest(text, n)])[0]
+
+    def header_summary(self, text):
+        return self.generate([HeaderSummaryRequest(text)])[0]
+
+    def summarize_batch(self, items):
+        """
+        Summarize several independent texts.
+        :param items: dict, id -> text
+        :return: dict, id -> summary
+        """
+        summaries = self.generate([SummarizeRequest(text) for text in items.values()])
+        return dict(zip(items, summaries))
+
+
+class OpenAIBackend(ModelBackend):
+    name = "openai"
+
+    def __init__(self, chat=config.CHATGPT, max_workers=config.SUMMARY_MAX_WORKERS, rate_limiter=None):
+        self.chat = chat
+        self.model = config.CHAT_MODEL if chat else config.COMPLETION_MODEL
+        self.max_workers = max_workers
+
+        # a single session shared by every thread, so that connections are pooled and reused across calls
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        session.mount("https://", adapter)
+        openai.requestssession = session
+        openai.api_key = config.OPENAI_API_KEY
+
+        self.cache = ResponseCache()
+        self.rate_limiter = rate_limiter or RateLimiter(config.LLM_REQUESTS_PER_MINUTE)
+
+    def complete(self, template_name, variables, max_tokens, temperature=0.7, **params):
+        template = get_template(template_name)
+        params.update(max_tokens=max_tokens, temperature=temperature)
+
+        cache_key = self.cache.key(template, self.model, variables, params)
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        self.rate_limiter.acquire()
+        if self.chat:
+            response = openai.ChatCompletion.create(model=self.model, messages=template.messages(**variables), **params)
+            response_str = response['choices'][0]['message']['content'].strip()
+        else:
+            response = openai.Completion.create(model=self.model, prompt=template.prompt(**variables), **params)
+            response_str = response["choices"][0]["text"].strip()
+        self.cache.set(cache_key, response_str)
+        return response_str
+
+    def generate_one(self, request):
+        summary_params = dict(top_p=1.0, frequency_penalty=0.0, presence_penalty=1)
+        if isinstance(request, SummarizeRequest):
+            return self.complete("summarize", {"text": request.text}, config.SUMMARY_OUTPUT_TOKENS, **summary_params)
+        if isinstance(request, ConsolidateRequest):
+            return self.complete("consolidate", {"text": request.text}, config.SUMMARY_OUTPUT_TOKENS,
+                                 **summary_params)
+        if isinstance(request, TitleRequest):
+            title = self.complete("title", {"text": request.text}, 1000 if self.chat else 30, **summary_params)
+            return title.replace("\n", "").strip()
+        if isinstance(request, BulletsRequest):
+            return format_bullets(self.complete("bullets", {"text": request.text, "n": request.n}, 300, temperature=1))
+        if isinstance(request, HeaderSummaryRequest):
+            summary = self.complete("header_summary", {"text": request.text}, 500)
+            return summary[8:].strip() if summary.startswith("Summary:") else summary
+        raise TypeError(f"Unsupported request: {type(request).__name__}")
+
+    def summarize_batch(self, items):
+        if len(items) <= 1:
+            return super().summarize_batch(items)
+        max_tokens = min(len(items) * config.BATCH_OUTPUT_TOKENS_PER_MESSAGE, 4096)
+        emails = "\n\n".join(f"EMAIL id={item_id}:\n{text}" for item_id, text in items.items())
+        response = self.complete("batch_summarize", {"emails": emails}, max_tokens,
+                                 top_p=1.0, frequency_penalty=0.0, presence_penalty=1)
+        summaries = parse_batch_summaries(response, items)
+
+        # fall back to one request per message for the items missing or malformed in the response
+        missing = {item_id: text for item_id, text in items.items() if item_id not in summaries}
+        if missing:
+            logger.warning(f"Batch response is missing {len(missing)} of {len(items)} summaries, retrying them one by one")
+            summaries.update(super().summarize_batch(missing))
+        return {item_id: summaries[item_id] for item_id in items}
+
+    def generate(self, requests_list):
+        if len(requests_list) <= 1:
+            return [self.generate_one(request) for request in requests_list]
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(self.generate_one, requests_list))
+
+
+class ExtractiveBackend(ModelBackend):
+    """
+    Local backend without any network call: picks the most representative sentences of the text (by word
+    frequency) and keeps them in their original order. The output is deterministic, which makes it usable
+    for offline runs, tests and benchmarks of the full pipeline.
+    """
+    name = "extractive"
+    sentence_pattern = re.compile(r'(?<=[.!?])\s+')
+    word_pattern = re.compile(r"[A-Za-z0-9']+")
+
+    def __init__(self, summary_ratio=0.3, min_sentences=2):
+        self.summary_ratio = summary_ratio
+        self.min_sentences = min_sentences
+
+    def split_sentences(self, text):
+        return [s.strip() for s in self.sentence_pattern.split(re.sub(r'\s+', ' ', text).strip()) if s.strip()]
+
+    def top_sentences(self, text, n):
+        sentences = self.split_sentences(text)
+        if len(sentences) <= n:
+            return sentences
+        words = [[w.lower() for w in self.word_pattern.findall(s) if len(w) > 3] for s in sentences]
+        frequency = Counter(w for sentence_words in words for w in sentence_words)
+        scores = [sum(frequency[w] for w in sentence_words) / (len(sentence_words) or 1)
+                  for sentence_words in words]
+        ranked = sorted(range(len(sentences)), key=lambda i: (-scores[i], i))[:n]
+        return [sentences[i] for i in sorted(ranked)]
+
+    def extract(self, text):
+        n_sentences = len(self.split_sentences(text))
+        n = max(self.min_sentences, round(n_sentences * self.summary_ratio))
+        return " ".join(self.top_sentences(text, n))
+
+    def generate_one(self, request):
+        if isinstance(request, (SummarizeRequest, ConsolidateRequest)):
+            return self.extract(request.text)
+        if isinstance(request, HeaderSummaryRequest):
+            return " ".join(self.top_sentences(request.text, 4))
+        if isinstance(request, TitleRequest):
+            sentences = self.top_sentences(request.text, 1)
+            words = sentences[0].split()[:12] if sentences else []
+            return " ".join(words).rstrip(".!?,;:")
+        if isinstance(request, BulletsRequest):
+            sentences = self.top_sentences(request.text, request.n)
+            return "\n".join(f"- {' '.join(s.split()[:15])}" for s in sentences)
+        raise TypeError(f"Unsupported request: {type(request).__name__}")
+
+
+BACKENDS = {
+    OpenAIBackend.name: OpenAIBackend,
+    ExtractiveBackend.name: ExtractiveBackend,
+}
+_instances = {}
+_instances_lock = threading.Lock()
+
+
+def get_backend(name=None):
+    """Return the (shared) backend instance registered under `name`, defaults to `config.MODEL_BACKEND`."""
+    name = name or config.MODEL_BACKEND
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown model backend: {name}, expected one of {list(BACKENDS)}")
+    with _instances_lock:
+        if name not in _instances:
+            _instances[name] = BACKENDS[name]()
+    return _instances[name]
@@ -0,0 +1,55 @@
+"""
+Single copy of the combined summaries of the threads spanning several months.
+
+The combined XML of a thread is stored once, in the `_combined` folder of its mailing list
+(`static/bitcoin-dev/_combined/combined_<title>.xml`). Each month folder of the thread only holds a pointer file
+(`combined_<title>.xml.ref`) with the path of the stored XML relative to the month folder. The pointer is
+resolved wherever an XML of a month folder is listed or read (manifest, archive store, web app), so readers keep
+seeing `combined_<title>.xml` in every month of the thread.
+
+A real `combined_<title>.xml` file in a month folder (copy written before the pointers) takes precedence over a
+pointer, see `dedupe_combined_xmls.py` to replace the copies.
+"""
+import os
+
+COMBINED_FOLDER = "_combined"
+REF_SUFFIX = ".ref"
+
+
+def combined_path(dev_folder, filename):
+    """Path of the stored combined XML `filename` of a mailing list folder."""
+    return os.path.join(dev_folder, COMBINED_FOLDER, filename)
+
+
+def ref_data(month_folder, xml_path):
+    """Content of the pointer file of a month folder to `xml_path`."""
+    return (os.path.relpath(xml_path, month_folder).replace("\\", "/") + "\n").encode("utf-8")
+
+
+def read_ref(folder, filename):
+    """:return: str, path of the XML a pointer `filename` + `REF_SUFFIX` of `folder` points to, None if no pointer"""
+    try:
+        with open(os.path.join(folder, filename + REF_SUFFIX), "r", encoding="utf-8") as f:
+            return os.path.normpath(os.path.join(folder, f.read().strip()))
+    except FileNotFoundError:
+        return None
+
+
+def resolve_xml_path(folder, filename):
+    """Path of the file holding the XML `filename` of a month folder: the file itself or the one it points to."""
+    path = os.path.join(folder, filename)
+    if os.path.exists(path):
+        return path
+    return read_ref(folder, filename) or path
+
+
+def list_xml_files(folder, listing=None):
+    """
+    XML filenames of a folder in listing order, pointers included under the name of the XML they stand for.
+    :param listing: list, `os.listdir(folder)` if already known
+    """
+    listing = os.listdir(folder) if listing is None else listing
+    filenames = (filename[:-len(REF_SUFFIX)] if filename.endswith(REF_SUFFIX) else filename
+                 for filename in listing if filename.endswith((".xml", ".xml" + REF_SUFFIX)))
+    return list(dict.fromkeys(filenames))
+
@@ -1,16 +1,73 @@
-import tiktoken
 import os
 from dotenv import load_dotenv
 load_dotenv()
 
-TOKENIZER = tiktoken.get_encoding("cl100k_base")
+
+def __getattr__(name):
+    # the tokenizer (tiktoken and its encoding file) is loaded on first use, importing the config stays cheap
+    if name == "TOKENIZER":
+        import tiktoken
+        globals()["TOKENIZER"] = tiktoken.get_encoding("cl100k_base")
+        return globals()["TOKENIZER"]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# backend used for all the completions - "openai" or "extractive" (local, offline and deterministic)
+MODEL_BACKEND = os.getenv("MODEL_BACKEND", "openai")
 
 # if set to True, it will use chatgpt model ("gpt-4-1106-preview") for all the completions
 CHATGPT = True
+CHAT_MODEL = "gpt-4-1106-preview"
 
 # COMPLETION_MODEL - only applicable if CHATGPT is set to False
 COMPLETION_MODEL = "text-davinci-003"  # "text-ada-001",
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+RESPONSE_CACHE_DIR = os.getenv("RESPONSE_CACHE_DIR")  # optional on-disk cache of the completions
+
+# mailing lists processed by the generator entry points, all at the same time - see src/list_runner.py
+MAILING_LISTS = os.getenv("MAILING_LISTS", "https://lists.linuxfoundation.org/pipermail/bitcoin-dev/,"
+                                           "https://lists.linuxfoundation.org/pipermail/lightning-dev/").split(",")
+LIST_LOG_DIR = os.getenv("LIST_LOG_DIR", "logs")  # one log file per mailing list
+
+# SQLite store of all the summary records, rebuilt from static/ when missing - see src/archive_store.py
+ARCHIVE_DB_PATH = os.getenv("ARCHIVE_DB_PATH", "archive.db")
+
+# SQLite store of the scraped emails and of the validators of the index pages - see src/scrape_store.py
+SCRAPE_DB_PATH = os.getenv("SCRAPE_DB_PATH", "scrape.db")
+
+# change data capture of the ES documents: each job only fetches the documents indexed since its last run
+# (its watermark) minus an overlap for late arrivals - see src/watermarks.py
+WATERMARK_DIR = os.getenv("WATERMARK_DIR", "watermarks")  # committed by the cron workflows
+WATERMARK_FIELD = "indexed_at"  # documents without it are tracked by their "created_at" date
+WATERMARK_OVERLAP_HOURS = int(os.getenv("WATERMARK_OVERLAP_HOURS", 6))
+
+# NLTK data (punkt) is downloaded here once and then used offline - see src/sentences.py
+NLTK_DATA_DIR = os.getenv("NLTK_DATA_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                                        "nltk_data"))
+
+# summarization planning - see src/summary_planner.py
+MODEL_CONTEXT_LIMIT = 128000  # context window of "gpt-4-1106-preview" (in tokens)
+SUMMARY_OUTPUT_TOKENS = 1000  # max tokens generated by a single summarization call
+SUMMARY_PROMPT_OVERHEAD_TOKENS = 500  # tokens reserved for the instruction prompt of a call
+SUMMARY_MAX_CHUNK_TOKENS = 16000  # upper bound of input tokens sent in a single call
+SUMMARY_MAX_WORKERS = 4  # parallel calls while running one level of the summary plan
+LLM_REQUESTS_PER_MINUTE = int(os.getenv("LLM_REQUESTS_PER_MINUTE", 500))  # shared by all the lists, 0: no limit
+
+# emails up to these sizes get an extractive summary instead of an LLM call ("ACK", "+1", short questions)
+FAST_PATH_MAX_TOKENS = 60
+FAST_PATH_MAX_SENTENCES = 2
+
+# near-duplicate messages (forwards, cross-posts) share a single summary - see src/near_duplicates.py
+NEAR_DUPLICATE_THRESHOLD = 0.9  # minimum estimated Jaccard similarity of the word shingles
+SHINGLE_SIZE = 5  # words per shingle
+MINHASH_PERMUTATIONS = 128
+MINHASH_BANDS = 16
+
+# several small messages are summarized in a single request returning a JSON array of summaries
+BATCH_MESSAGE_MAX_TOKENS = 1500  # bigger messages are summarized on their own
+BATCH_MAX_INPUT_TOKENS = 6000  # budget of the message bodies packed in one request
+BATCH_MAX_MESSAGES = 8
+BATCH_OUTPUT_TOKENS_PER_MESSAGE = 400
 
 ES_CLOUD_ID= os.getenv("ES_CLOUD_ID")
 ES_USERNAME = os.getenv("ES_USERNAME")
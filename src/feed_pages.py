@@ -0,0 +1,120 @@
+"""
+Pre-rendered feed pages.
+
+A feed page only depends on the content of its XML and on the page parameters, so it is rendered once and kept,
+along with its gzip/brotli compressed variants, under the sha256 of the XML content. The (mtime, size) of a file
+maps its path to the content hash, so serving a hot page costs a stat and a couple of dictionary lookups.
+"""
+import gzip
+import hashlib
+import os
+import threading
+import xml.etree.ElementTree as ET
+from collections import OrderedDict
+
+try:
+    import brotli
+except ImportError:  # pages are then served gzip compressed only
+    brotli = None
+
+NAMESPACE = {'atom': 'http://www.w3.org/2005/Atom'}
+MAX_PAGES = 4096
+
+
+def read_feed(xml_bytes):
+    """
+    Read a summary XML into the structure `feed.html` renders: the subset of the feedparser result it uses
+    (`feed.title/updated/links/authors`, `entries[].link/published/summary`), without running feedparser.
+    """
+    root = ET.fromstring(xml_bytes)
+
+    def text(element, path):
+        child = element.find(path, NAMESPACE)
+        return child.text if child is not None and child.text is not None else ''
+
+    entries = []
+    for entry in root.findall('atom:entry', NAMESPACE):
+        link = entry.find('atom:link', NAMESPACE)
+        entries.append({
+            'link': link.get('href') if link is not None else None,
+            'published': text(entry, 'atom:published'),
+            'summary': text(entry, 'atom:summary'),
+        })
+    return {
+        'feed': {
+            'title': text(root, 'atom:title'),
+            'updated': text(root, 'atom:updated'),
+            'links': [{'href': link.get('href')} for link in root.findall('atom:link', NAMESPACE)],
+            'authors': [{'name': (author.text or '').strip()} for author in root.findall('atom:author/atom:name',
+                                                                                         NAMESPACE)],
+        },
+        'entries': entries,
+    }
+
+
+class RenderedPage:
+    """Body of a rendered page in every content encoding it can be served with."""
+
+    def __init__(self, body):
+        self.digest = hashlib.sha256(body).hexdigest()[:32]
+        self.variants = {'identity': body, 'gzip': gzip.compress(body, compresslevel=9)}
+        if brotli is not None:
+            self.variants['br'] = brotli.compress(body, quality=11)
+
+    @property
+    def encodings(self):
+        # preferred first, used to break ties between encodings the client accepts equally
+        return [encoding for encoding in ('br', 'gzip', 'identity') if encoding in self.variants]
+
+    def etag(self, encoding):
+        return self.digest if encoding == 'identity' else f"{self.digest}-{encoding}"
+
+
+class FeedPageCache:
+    """
+    Rendered pages keyed by (content hash of the XML, page parameters), least recently used pages are dropped
+    past `max_pages`. An XML rewritten with the same content keeps its page.
+    """
+
+    def __init__(self, max_pages=MAX_PAGES):
+        self.max_pages = max_pages
+        self._content_hashes = {}
+        self._pages = OrderedDict()
+        self._lock = threading.Lock()
+
+    def content_hash(self, xml_path):
+        stat = os.stat(xml_path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        cached = self._content_hashes.get(xml_path)
+        if cached is not None and cached[0] == signature:
+            return cached[1], None
+
+        with open(xml_path, 'rb') as f:
+            xml_bytes = f.read()
+        digest = hashlib.sha256(xml_bytes).hexdigest()
+        self._content_hashes[xml_path] = (signature, digest)
+        return digest, xml_bytes
+
+    def get(self, xml_path, params, render):
+        """
+        Return the page of `xml_path`, rendering it on first read.
+        :param params: tuple, the page parameters other than the XML content
+        :param render: callable(bytes) -> str, renders the page from the XML content
+        """
+        digest, xml_bytes = self.content_hash(xml_path)
+        key = (digest, params)
+        with self._lock:
+            page = self._pages.get(key)
+            if page is not None:
+                self._pages.move_to_end(key)
+                return page
+
+        if xml_bytes is None:
+            with open(xml_path, 'rb') as f:
+                xml_bytes = f.read()
+        page = RenderedPage(render(xml_bytes).encode('utf-8'))
+        with self._lock:
+            self._pages[key] = page
+            while len(self._pages) > self.max_pages:
+                self._pages.popitem(last=False)
+        return page
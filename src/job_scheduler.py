@@ -0,0 +1,143 @@
+"""
+In-process scheduler of the periodic jobs (e.g. the XML generation of each mailing list).
+
+The `schedule` library only decides when a job is due; due jobs are run on a pool of worker threads so a long
+job does not delay the others, nor the web app that hosts the scheduler. Each job is isolated:
+
+* a job is never run twice at the same time, a run that is due while the previous one is still running is
+  skipped (and counted)
+* an exception in a job (`SystemExit` included) is logged and counted, the job stays scheduled and the other
+  jobs are not affected
+* runtime metrics are kept per job (runs, failures, skipped runs, last/max/total duration)
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import schedule
+from loguru import logger
+
+
+class Job:
+    def __init__(self, name, func, kwargs):
+        self.name = name
+        self.func = func
+        self.kwargs = kwargs
+        self.lock = threading.Lock()
+        self.runs = 0
+        self.failures = 0
+        self.skipped = 0
+        self.last_started = None
+        self.last_duration = None
+        self.max_duration = 0.0
+        self.total_duration = 0.0
+        self.last_error = None
+
+    @property
+    def running(self):
+        return self.lock.locked()
+
+    def metrics(self):
+        return {
+            "running": self.running,
+            "runs": self.runs,
+            "failures": self.failures,
+            "skipped": self.skipped,
+            "last_started": self.last_started.isoformat() if self.last_started else None,
+            "last_duration": self.last_duration,
+            "max_duration": self.max_duration,
+            "avg_duration": self.total_duration / self.runs if self.runs else None,
+            "last_error": self.last_error,
+        }
+
+
+class JobScheduler:
+    def __init__(self, max_workers=2, poll_interval=1):
+        """
+        :param max_workers: int, number of jobs that can run at the same time
+        :param poll_interval: int, seconds between two checks for due jobs
+        """
+        self.poll_interval = poll_interval
+        self.jobs = {}
+        self._schedule = schedule.Scheduler()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add_job(self, name, func, at=None, every=None, **kwargs):
+        """
+        Schedule `func(**kwargs)` every day at `at` ("HH:MM", local time) or every `every` seconds.
+        :param name: str, unique name of the job, used in the logs and metrics
+        """
+        if name in self.jobs:
+            raise ValueError(f"Job already scheduled: {name}")
+        if (at is None) == (every is None):
+            raise ValueError("Exactly one of `at` and `every` is required")
+        self.jobs[name] = Job(name, func, kwargs)
+        schedule_job = self._schedule.every().day.at(at) if at else self._schedule.every(every).seconds
+        schedule_job.do(self.submit, name)
+        return self.jobs[name]
+
+    def submit(self, name):
+        """
+        Run a job now on a worker thread, unless it is already running.
+        :return: Future of the run, None if the run was skipped
+        """
+        job = self.jobs[name]
+        if not job.lock.acquire(blocking=False):
+            job.skipped += 1
+            logger.warning(f"Job {name} is still running, skipping this run")
+            return None
+        try:
+            return self._executor.submit(self._run, job)
+        except RuntimeError:
+            # the executor is shut down
+            job.lock.release()
+            raise
+
+    def _run(self, job):
+        job.last_started = datetime.now()
+        start_time = time.monotonic()
+        logger.info(f"Job {job.name} started")
+        try:
+            job.func(**job.kwargs)
+            job.last_error = None
+        except (Exception, SystemExit) as ex:
+            job.failures += 1
+            job.last_error = repr(ex)
+            logger.exception(f"Job {job.name} failed: {ex}")
+        finally:
+            duration = time.monotonic() - start_time
+            job.runs += 1
+            job.last_duration = duration
+            job.max_duration = max(job.max_duration, duration)
+            job.total_duration += duration
+            job.lock.release()
+            logger.info(f"Job {job.name} finished in {duration:.1f} seconds")
+
+    def run_pending(self):
+        self._schedule.run_pending()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            self.run_pending()
+            self._stop.wait(self.poll_interval)
+
+    def start(self):
+        """Check for due jobs on a background (daemon) thread, returns immediately."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="job-scheduler", daemon=True)
+            self._thread.start()
+            logger.info(f"Job scheduler started: {', '.join(self.jobs)}")
+        return self
+
+    def stop(self, wait=True):
+        """Stop scheduling new runs; with `wait`, also wait for the running jobs to finish."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._executor.shutdown(wait=wait)
+
+    def metrics(self):
+        return {name: job.metrics() for name, job in self.jobs.items()}
@@ -0,0 +1,53 @@
+"""
+Run the job of an entry point for every mailing list at the same time.
+
+The lists share no state except the output directory, and their jobs mostly wait on Elasticsearch and the LLM
+API, so they run on threads; the LLM calls of all the lists go through the rate limiter of the (shared) model
+backend. While a list runs, its log records are tagged with its `dev_name` (loguru `extra`) and also written to
+`<LIST_LOG_DIR>/<dev_name>.log`.
+
+The lists are set by `config.MAILING_LISTS`, adding a list there adds it to every entry point.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from loguru import logger
+
+from src import config
+
+
+def get_dev_name(dev_url):
+    return dev_url.split("/")[-2]
+
+
+def run_list(func, dev_url, log_dir=config.LIST_LOG_DIR):
+    dev_name = get_dev_name(dev_url)
+    sink_id = None
+    if log_dir:
+        os.makedirs(log_dir, exist_ok=True)
+        sink_id = logger.add(os.path.join(log_dir, f"{dev_name}.log"),
+                             filter=lambda record: record["extra"].get("dev_name") == dev_name)
+    try:
+        with logger.contextualize(dev_name=dev_name):
+            return func(dev_url)
+    finally:
+        if sink_id is not None:
+            logger.remove(sink_id)
+
+
+def run_per_list(func, dev_urls=None, max_workers=None, log_dir=config.LIST_LOG_DIR):
+    """
+    Call `func(dev_url)` for every mailing list, concurrently. A failing list does not stop the others: all the
+    lists run to the end, then the exception of the first failed list is raised.
+    :param dev_urls: list, urls of the mailing lists, defaults to `config.MAILING_LISTS`
+    :param max_workers: int, lists processed at the same time, defaults to all of them
+    :return: list, results of `func` in the order of `dev_urls`
+    """
+    dev_urls = dev_urls or config.MAILING_LISTS
+    with ThreadPoolExecutor(max_workers=max_workers or len(dev_urls), thread_name_prefix="list") as executor:
+        futures = [executor.submit(run_list, func, dev_url, log_dir) for dev_url in dev_urls]
+
+    for dev_url, future in zip(dev_urls, futures):
+        if future.exception() is not None:
+            logger.error(f"Failed to process {get_dev_name(dev_url)}: {future.exception()}")
+    return [future.result() for future in futures]
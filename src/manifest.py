@@ -0,0 +1,129 @@
+"""
+Per-month manifest of the summary XMLs.
+
+Every month folder (e.g. `static/bitcoin-dev/Dec_2022`) keeps a `_index.json` file with the metadata of its
+XMLs: title, authors, published date, link(s), combined flag and the byte offset/length of the summary text.
+Readers get everything from the manifest and only open an XML file, at the summary offset, when the summary
+itself is needed.
+
+The manifest is updated by the XML writer and synced with the folder on read: every entry keeps the mtime and
+size of its XML, so files added or rewritten by other means (e.g. a git pull) are read again without parsing the
+rest of the folder. The manifests are a local cache (not committed), rebuilt when missing.
+
+Combined summaries shared by several months are listed through their pointer file (see src/combined_store.py):
+their entry is read from (and checked against) the XML pointed to.
+"""
+import html
+import json
+import os
+
+from src.atom_writer import write_atomic
+from src.combined_store import list_xml_files, resolve_xml_path
+from src.xml_meta import read_xml_meta
+
+MANIFEST_NAME = "_index.json"
+MANIFEST_VERSION = 2
+
+
+def is_combined(filename):
+    return filename.startswith("combined_")
+
+
+def read_xml_entry(xml_path):
+    """Build the manifest entry of a single summary XML."""
+    meta = read_xml_meta(xml_path)
+    return {
+        "title": meta.title,
+        "authors": meta.authors,
+        "published": meta.published,
+        "url": meta.url,
+        "links": meta.links,
+        "combined": is_combined(os.path.basename(xml_path)),
+        "summary_offset": meta.summary_offset,
+        "summary_length": meta.summary_length,
+    }
+
+
+def read_folder_entry(folder, filename):
+    """Manifest entry of the XML `filename` of a month folder, which may be a pointer."""
+    xml_path = resolve_xml_path(folder, filename)
+    stat = os.stat(xml_path)
+    entry = read_xml_entry(xml_path)
+    entry["mtime_ns"], entry["size"] = stat.st_mtime_ns, stat.st_size
+    return entry
+
+
+def is_stale_entry(folder, filename, entry):
+    # the XML may have been rewritten in place (or from another month folder, for a pointer) since it was read
+    stat = os.stat(resolve_xml_path(folder, filename))
+    return (stat.st_mtime_ns, stat.st_size) != (entry.get("mtime_ns"), entry.get("size"))
+
+
+def write_manifest(folder, files):
+    """Write the manifest atomically: readers either see the previous or the new version, never a partial one."""
+    content = json.dumps({"version": MANIFEST_VERSION, "files": files}, indent=1, sort_keys=True)
+    write_atomic(os.path.join(folder, MANIFEST_NAME), content.encode('utf-8'), fsync=False)
+
+
+def read_manifest(folder):
+    path = os.path.join(folder, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except ValueError:
+        return {}
+    if manifest.get("version") != MANIFEST_VERSION:
+        return {}
+    return manifest["files"]
+
+
+def load_manifest(folder, write=True):
+    """
+    Return filename -> entry for all the XMLs of `folder`. Entries of new or changed files are parsed and entries
+    of removed files dropped when the manifest does not match the folder.
+    :param write: bool, save the updated manifest; the web app only reads, the manifests are written by the jobs
+    """
+    files = read_manifest(folder)
+    listing = list_xml_files(folder)
+
+    changed = len(files) != len(listing)
+    for filename in listing:
+        if filename not in files or is_stale_entry(folder, filename, files[filename]):
+            files[filename] = read_folder_entry(folder, filename)
+            changed = True
+
+    # keep the order of the folder listing, which is the order the readers used to see the files in
+    files = {filename: files[filename] for filename in listing}
+    if changed and write:
+        write_manifest(folder, files)
+    return files
+
+
+def update_manifest(folder, filename):
+    """Refresh the entry of `filename` after it has been (re)written."""
+    files = read_manifest(folder)
+    files[filename] = read_folder_entry(folder, filename)
+    write_manifest(folder, files)
+    return files[filename]
+
+
+def read_summary(folder, filename, entry=None):
+    """Read only the summary text of an XML, using the offsets stored in the manifest."""
+    if entry is None:
+        entry = load_manifest(folder)[filename]
+    if entry["summary_offset"] is None:
+        return None
+    with open(resolve_xml_path(folder, filename), 'rb') as f:
+        f.seek(entry["summary_offset"])
+        raw = f.read(entry["summary_length"])
+    return html.unescape(raw.decode('utf-8'))
+
+
+def iter_month_folders(dev_folder):
+    """Yield the month folders (e.g. `Dec_2022`) of a mailing list folder."""
+    for month_folder in sorted(os.listdir(dev_folder)):
+        path = os.path.join(dev_folder, month_folder)
+        if os.path.isdir(path) and not month_folder.startswith(("_", ".")):
+            yield path
@@ -0,0 +1,79 @@
+"""
+Near-duplicate detection of texts (forwarded, cross-posted or re-sent emails) with MinHash LSH.
+
+A text is turned into the set of its word shingles (k consecutive words); the MinHash signature of the set
+estimates the Jaccard similarity of two texts by the fraction of equal values of their signatures. Signatures
+are computed for all the shingles at once with NumPy. With locality-sensitive hashing, the signatures are cut
+in bands and only the texts sharing an identical band are compared, instead of all the pairs of texts.
+"""
+import re
+import zlib
+
+import numpy as np
+
+from src import config
+
+MERSENNE_PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 32) - 1
+WORD_PATTERN = re.compile(r"\w+")
+
+
+def shingles(text, k=config.SHINGLE_SIZE):
+    """:return: numpy array, sorted unique 32-bit hashes of the word k-shingles of the text"""
+    words = WORD_PATTERN.findall(text.lower())
+    grams = [" ".join(words[i:i + k]) for i in range(max(len(words) - k + 1, 1))] if words else []
+    return np.array(sorted({zlib.crc32(gram.encode("utf-8")) for gram in grams}), dtype=np.uint64)
+
+
+class MinHashLSH:
+    def __init__(self, num_perm=config.MINHASH_PERMUTATIONS, bands=config.MINHASH_BANDS, seed=1):
+        """
+        :param num_perm: int, size of the signatures
+        :param bands: int, number of LSH bands, more bands find candidates of a lower similarity
+        """
+        if num_perm % bands:
+            raise ValueError(f"num_perm ({num_perm}) must be a multiple of bands ({bands})")
+        rng = np.random.RandomState(seed)
+        # universal hash functions (a * x + b) % prime, one per permutation
+        self.a = rng.randint(1, MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+        self.b = rng.randint(0, MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+
+    def signature(self, hashes):
+        if not len(hashes):
+            return np.full(self.num_perm, MAX_HASH, dtype=np.uint64)
+        # (shingles x permutations) matrix of hashed values, the products wrap around in uint64 on purpose
+        values = (np.outer(hashes, self.a) + self.b) % np.uint64(MERSENNE_PRIME)
+        return (values & np.uint64(MAX_HASH)).min(axis=0)
+
+    def find_duplicates(self, texts, threshold=config.NEAR_DUPLICATE_THRESHOLD):
+        """
+        Group the near-duplicate texts under the first text of each group.
+        :param texts: list of str
+        :param threshold: float, minimum estimated Jaccard similarity of a text with the first text of its group
+        :return: dict, index of a text -> index of the earlier text it is a near-duplicate of
+        """
+        hashes = [shingles(text) for text in texts]
+        signatures = np.array([self.signature(text_hashes) for text_hashes in hashes]).reshape(len(texts), -1)
+
+        # candidates: the earlier texts sharing at least one band
+        candidates = [set() for _ in texts]
+        for band in range(self.bands):
+            buckets = {}
+            band_values = signatures[:, band * self.rows:(band + 1) * self.rows]
+            for i in range(len(texts)):
+                if len(hashes[i]):
+                    buckets.setdefault(band_values[i].tobytes(), []).append(i)
+            for members in buckets.values():
+                for position, i in enumerate(members):
+                    candidates[i].update(members[:position])
+
+        duplicate_of = {}
+        for i, earlier in enumerate(candidates):
+            for j in sorted(earlier):
+                if j not in duplicate_of and np.mean(signatures[i] == signatures[j]) >= threshold:
+                    duplicate_of[i] = j
+                    break
+        return duplicate_of
@@ -0,0 +1,247 @@
+"""
+Versioned prompt templates.
+
+Every template is split into a stable system message (role and rules, identical for every call) and a user
+message holding the variable content last, so that provider side prompt caching can reuse the prefix.
+Bump the version of a template whenever its text changes: the version is part of the response cache key.
+
+Run `python -m src.prompts` for a before/after report of the preamble tokens sent per call.
+"""
+from string import Formatter
+
+from src import config
+
+
+class PromptTemplate:
+    def __init__(self, name, version, system, user):
+        self.name = name
+        self.version = version
+        self.system = system
+        self.user = user
+
+    @property
+    def key(self):
+        return f"{self.name}@v{self.version}"
+
+    def messages(self, **variables):
+        return [
+            {"role": "system", "content": self.system},
+            {"role": "user", "content": self.user.format(**variables)},
+        ]
+
+    def prompt(self, **variables):
+        # single prompt for the completion (non chat) models, same prefix first
+        return f"{self.system}\n\n{self.user.format(**variables)}"
+
+
+SUMMARY_RULES = """The rules are below:
+    1. While extracting, avoid using phrases referring to the context. Instead, directly present the information or points covered.  Do not introduce sentences with phrases like: "The context discusses...", "In this context..." or "The context covers..." or "The context questions..." etc
+    2. The summary tone should be formal and full of information.
+    3. Add spaces after using punctuation and follow all the grammatical rules.
+    4. Try to retain all the links provided and use them in proper manner at proper place.
+    5. The farewell part of the email should be completely ignored.
+    6. Ensure that the summary is not simply a rephrase of the original content with minor word changes, but a restructured and simplified rendition of the main points.
+    7. Most importantly, this extracted information should be relative of the size of the email. If it is a bigger email, the extracted summary can be longer than a very short email.
+    8. Break down the summary into concise, meaningful paragraphs ensuring each paragraph captures a unique aspect or perspective from the original text."""
+
+PROGRAMMER_ROLE = "Suppose you are a programmer and you are enriched by programming knowledge."
+
+TEMPLATES = {}
+
+
+def register(template):
+    TEMPLATES[template.name] = template
+    return template
+
+
+def get_template(name):
+    return TEMPLATES[name]
+
+
+register(PromptTemplate(
+    name="summarize",
+    version=2,
+    system=f"""{PROGRAMMER_ROLE} You will be going through other programmers mail sent to you and you will be extracting all the important information out of the mail and composing a blog post. Even if the mail is divided into parts and parts, your extraction summary should not be in bullet points. It should be in multiple paragraphs. I repeat, never in bullet points. You have to follow some rules while giving a detailed summary.
+{SUMMARY_RULES}""",
+    user="CONTEXT:\n\n{text}",
+))
+
+register(PromptTemplate(
+    name="consolidate",
+    version=2,
+    system=f"""{PROGRAMMER_ROLE} You have to consolidate the text sent to you based on the rules.
+{SUMMARY_RULES}""",
+    user="CONTEXT:\n\n{text}",
+))
+
+register(PromptTemplate(
+    name="batch_summarize",
+    version=2,
+    system=f"""{PROGRAMMER_ROLE} You will be going through several independent mails sent to you by other programmers and, for each mail, you will be extracting all the important information out of it into a summary. Every summary should be in multiple paragraphs, never in bullet points, and must only use the content of its own mail. You have to follow some rules while giving a detailed summary.
+{SUMMARY_RULES}
+Return only a JSON array with one object per mail, in the form [{{"id": "<id of the mail>", "summary": "<summary>"}}], without any other text.""",
+    user="CONTEXT:\n\n{emails}",
+))
+
+register(PromptTemplate(
+    name="title",
+    version=2,
+    system="You are an intelligent assistant. Generate an appropriate title for the context sent to you.",
+    user="CONTEXT:\n\n{text}",
+))
+
+register(PromptTemplate(
+    name="bullets",
+    version=2,
+    system="""You are an intelligent assistant. Summarize the email sent to you into the requested number of distinct sentences based on the guidelines mentioned below.
+    1. Each sentence you write should not exceed fifteen words.
+    2. Each sentence should begin on a new line and should start with a hyphen (-) and you must add space after hyphen (-).
+        E.g., - This is a first sentence. - This is a second sentence. - This is a third sentence.
+        E.g., Incorrect: "-This is a sentence.-This is another sentence."
+            Correct: "- This is a sentence. - This is another sentence."
+    3. Please adhere to all English grammatical rules while writing the sentences, maintaining formal tone and employing proper spacing.
+    4. While summarizing, avoid using phrases referring to the context. Instead, directly present the information or points covered.
+        Do not introduce sentences with phrases like: "The context discusses...", "In this context..." or "The context covers..." """,
+    user="Number of sentences: {n}\n\nCONTEXT:\n\n{text}",
+))
+
+register(PromptTemplate(
+    name="header_summary",
+    version=2,
+    system="""You are an intelligent agent with an exceptional skills in writing. You are required to produce a concise header summary from a compilation of condensed recent discussions. Transform the extracted text from mailing lists sent to you into a brief summary composed of only three or four significant sentences, adhering to these important criteria:
+Guidelines:
+    1. While synthesizing, refrain from or reword phrases like "The context discusses...", "The email discusses...", "In this context...", "The context covers...", "The context questions...", "In this email...", "The email covers..." and similar phrases.
+    2. The summarization must have a formal tone and be high in informational content.
+    3. Ensure that punctuation is followed by a space and that all syntax rules are adhered to.
+    4. Any links given within the text should be retained and appropriately incorporated.
+    5. Rather than being a simple rewording of the original content, the summary should restructure and simplify the main points.
+    6. Mention full names (both the first name and last name) of the authors if applicable.
+    7. Break down the summary into concise, meaningful paragraphs ensuring each paragraph captures a unique aspect or perspective from the original text, provided it should be no longer than three or four sentences.
+    8. Please ensure that the summary does not start with labels like "Email 1:", "Email 2:" and so on.""",
+    user="CONTEXT:\n\n{text}",
+))
+
+
+# the prompts as they were written inline before the templates (system message + one user message holding the
+# rules and the content), kept verbatim for the before/after preamble report
+BASELINE_TEMPLATES = {template.name: template for template in (
+    PromptTemplate(
+        name="summarize",
+        version=1,
+        system="You are an intelligent assistant.",
+        user="""Suppose you are a programmer and you are enriched by programming knowledge. You will be going through other programmers mail sent to you and you will be extracting all the important information out of the mail and composing a blog post. Even if the mail is divided into parts and parts, your extraction summary should not be in bullet points. It should be in multiple paragraphs. I repeat, never in bullet points. You have to follow some rules while giving a detailed summary. 
+    The rules are below:
+        1. While extracting, avoid using phrases referring to the context. Instead, directly present the information or points covered.  Do not introduce sentences with phrases like: "The context discusses...", "In this context..." or "The context covers..." or "The context questions..." etc
+        2. The summary tone should be formal and full of information.
+        3. Add spaces after using punctuation and follow all the grammatical rules.
+        4. Try to retain all the links provided and use them in proper manner at proper place.
+        5. The farewell part of the email should be completely ignored.
+        6. Ensure that the summary is not simply a rephrase of the original content with minor word changes, but a restructured and simplified rendition of the main points.
+        7. Most importantly, this extracted information should be relative of the size of the email. If it is a bigger email, the extracted summary can be longer than a very short email.  
+        8. Break down the summary into concise, meaningful paragraphs ensuring each paragraph captures a unique aspect or perspective from the original text. 
+    \n\nCONTEXT:\n\n{text}""",
+    ),
+    PromptTemplate(
+        name="consolidate",
+        version=1,
+        system="You are an intelligent assistant.",
+        user="""Suppose you are a programmer and you are enriched by programming knowledge. You have to consolidate below text based on the rules.
+    The rules are below:
+        1. While extracting, avoid using phrases referring to the context. Instead, directly present the information or points covered.  Do not introduce sentences with phrases like: "The context discusses...", "In this context..." or "The context covers..." or "The context questions..." etc
+        2. The summary tone should be formal and full of information.
+        3. Add spaces after using punctuation and follow all the grammatical rules.
+        4. Try to retain all the links provided and use them in proper manner at proper place.
+        5. The farewell part of the email should be completely ignored.
+        6. Ensure that summary is not simply a rephrase of the original content with minor word changes, but a restructured and simplified rendition of the main points.
+        7. Most importantly, this extracted information should be relative of the size of the email. If it is a bigger email, the extracted summary can be longer than a very short email. 
+        8. Break down the summary into concise, meaningful paragraphs ensuring each paragraph captures a unique aspect or perspective from the original text.
+    \n\nCONTEXT:\n\n{text}""",
+    ),
+    PromptTemplate(
+        name="title",
+        version=1,
+        system="You are an intelligent assistant.",
+        user="Generate an appropriate title for below context.\n\n CONTEXT:\n\n{text}",
+    ),
+    PromptTemplate(
+        name="bullets",
+        version=1,
+        system="You are an intelligent assistant.",
+        user="""Summarize the following email into {n} distinct sentences based on the guidelines 
+        mentioned below. 
+            1. Each sentence you write should not exceed fifteen words. 
+            2. Each sentence should begin on a new line and should start with a hyphen (-) and you must add space after hyphen (-).
+                E.g., - This is a first sentence. - This is a second sentence. - This is a third sentence.
+                E.g., Incorrect: "-This is a sentence.-This is another sentence."
+                    Correct: "- This is a sentence. - This is another sentence."
+            3. Please adhere to all English grammatical rules while writing the sentences, 
+                maintaining formal tone and employing proper spacing. 
+            4. While summarizing, avoid using phrases referring to the context. Instead, directly present the information or points covered. 
+                Do not introduce sentences with phrases like: "The context discusses...", "In this context..." or "The context covers..."
+        CONTEXT:\n\n{text}""",
+    ),
+    PromptTemplate(
+        name="header_summary",
+        version=1,
+        system="You are an intelligent agent with an exceptional skills in writing.",
+        user="""You are required to produce a concise header summary from a compilation of condensed recent discussions. Transform the following extracted text from mailing lists into a brief summary composed of only three or four significant sentences, adhering to these important criteria:
+    Guidelines:
+        1. While synthesizing, refrain from or reword phrases like "The context discusses...", "The email discusses...", "In this context...", "The context covers...", "The context questions...", "In this email...", "The email covers..." and similar phrases.
+        2. The summarization must have a formal tone and be high in informational content.
+        3. Ensure that punctuation is followed by a space and that all syntax rules are adhered to.
+        4. Any links given within the text should be retained and appropriately incorporated.
+        5. Rather than being a simple rewording of the original content, the summary should restructure and simplify the main points.
+        6. Mention full names (both the first name and last name) of the authors if applicable. 
+        7. Break down the summary into concise, meaningful paragraphs ensuring each paragraph captures a unique aspect or perspective from the original text, provided it should be no longer than three or four sentences.
+        8. Please ensure that the summary does not start with labels like "Email 1:", "Email 2:" and so on.
+        \n CONTEXT:\n\n{text}""",
+    ),
+
+)}
+
+
+def preamble_tokens(template):
+    """
+    Tokens of instructions sent with every call of a template.
+
+    :param template: PromptTemplate, the template to measure
+    :return: tuple, (total preamble tokens, tokens of the cacheable prefix before the first variable)
+    """
+    count = lambda text: len(config.TOKENIZER.encode(text))
+    user = template.user.format_map(_EmptyVariables())
+    first_variable = next(text for text, field, _, _ in Formatter().parse(template.user) if field is not None)
+    prefix = count(template.system) + count(first_variable.replace("{{", "{").replace("}}", "}"))
+    return count(template.system) + count(user), prefix
+
+
+def preamble_report():
+    """
+    Measured before/after comparison of the preamble tokens per template: the baseline is the inline prompt used
+    before the templates, the cacheable prefix is everything sent before the first variable content.
+    """
+    rows = []
+    for template in TEMPLATES.values():
+        baseline = BASELINE_TEMPLATES.get(template.name)
+        before, before_prefix = preamble_tokens(baseline) if baseline else (None, None)
+        after, after_prefix = preamble_tokens(template)
+        rows.append({
+            "template": template.key,
+            "baseline_tokens": before,
+            "baseline_prefix_tokens": before_prefix,
+            "tokens": after,
+            "prefix_tokens": after_prefix,
+        })
+    return rows
+
+
+class _EmptyVariables(dict):
+    def __missing__(self, key):
+        return ""
+
+
+if __name__ == "__main__":
+    fmt = lambda value: "-" if value is None else value
+    print(f"{'template':<22} {'before':>7} {'after':>7}   {'prefix before':>13} {'prefix after':>12}")
+    for row in preamble_report():
+        print(f"{row['template']:<22} {fmt(row['baseline_tokens']):>7} {row['tokens']:>7}   "
+              f"{fmt(row['baseline_prefix_tokens']):>13} {row['prefix_tokens']:>12}")
@@ -0,0 +1,79 @@
+"""
+SQLite store of the scraped emails, so that a scraper run only downloads the messages it has not seen yet.
+
+* `emails`: one row per scraped message, keyed by its url; new messages are appended, never rewritten
+* `index_pages`: the `ETag`/`Last-Modified` validators of each `date.html` index page with the message urls it
+  listed, so an unchanged index (HTTP 304) is neither downloaded nor parsed again
+"""
+import json
+import sqlite3
+
+from src import config
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS emails (
+    email_url TEXT PRIMARY KEY,
+    timestamp TEXT,
+    author TEXT,
+    subject TEXT,
+    email TEXT,
+    scraped_at TEXT DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS emails_timestamp ON emails (timestamp);
+CREATE TABLE IF NOT EXISTS index_pages (
+    url TEXT PRIMARY KEY,
+    etag TEXT,
+    last_modified TEXT,
+    email_urls TEXT NOT NULL
+);
+"""
+COLUMNS = ("timestamp", "author", "subject", "email", "email_url")
+
+
+class ScrapeStore:
+    def __init__(self, db_path=config.SCRAPE_DB_PATH):
+        self.db_path = db_path
+        self.connection = sqlite3.connect(db_path)
+        self.connection.executescript(SCHEMA)
+
+    def seen(self, email_urls):
+        """Subset of `email_urls` already scraped."""
+        seen = set()
+        email_urls = list(email_urls)
+        # in chunks, sqlite limits the number of parameters of a query
+        for i in range(0, len(email_urls), 500):
+            chunk = email_urls[i:i + 500]
+            seen.update(row[0] for row in self.connection.execute(
+                f"SELECT email_url FROM emails WHERE email_url IN ({', '.join('?' * len(chunk))})", chunk))
+        return seen
+
+    def add_emails(self, records):
+        """Append scraped records (dicts with the `COLUMNS` keys), the already stored urls are left untouched."""
+        with self.connection:
+            self.connection.executemany(
+                f"INSERT OR IGNORE INTO emails ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})",
+                [tuple(record[column] for column in COLUMNS) for record in records])
+
+    def emails_between(self, start, end):
+        """
+        Records with a timestamp in [start, end].
+        :param start: str, "%Y-%m-%d %H:%M:%S" UTC timestamp
+        :param end: str, "%Y-%m-%d %H:%M:%S" UTC timestamp
+        """
+        return [dict(zip(COLUMNS, row)) for row in self.connection.execute(
+            f"SELECT {', '.join(COLUMNS)} FROM emails WHERE timestamp >= ? AND timestamp <= ? ORDER BY timestamp",
+            (start, end))]
+
+    def get_index_page(self, url):
+        """
+        :return: tuple, (etag, last modified, message urls) of the last download of the page, None if never downloaded
+        """
+        row = self.connection.execute(
+            "SELECT etag, last_modified, email_urls FROM index_pages WHERE url = ?", (url,)).fetchone()
+        return (row[0], row[1], json.loads(row[2])) if row else None
+
+    def set_index_page(self, url, etag, last_modified, email_urls):
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO index_pages (url, etag, last_modified, email_urls) VALUES (?, ?, ?, ?)",
+                (url, etag, last_modified, json.dumps(email_urls)))
@@ -8,9 +8,18 @@ from dateutil.parser import parse
 from dateutil.relativedelta import relativedelta
 import pytz
 import datetime
+import contextlib
+import email
+import email.errors
+import email.header
+import email.utils
+import gzip
+import io
+from collections import defaultdict, deque
 
-from src.utils import is_date, normalize_text, CURRENT_TIME, CURRENT_TIMESTAMP, get_past_week_data
+from src.utils import is_date, normalize_text, get_current_time, get_current_timestamp, get_past_week_data
 from src import config
+from src.scrape_store import ScrapeStore
 
 
 def preprocess_email(email_body):
@@ -53,38 +62,111 @@ def scrape_email_data(url_):
     return author, timestamp, normalize_text(subject), normalized_email_body
 
 
-def collect_email_urls(base_url):
-    urls_list = []
+def get_month_routes(now=None):
     # add current month
-    month_route = f"{CURRENT_TIME.strftime('%Y-%B')}"
-    email_thread_url = f"{base_url}/{month_route}/"
-    urls_list.append(email_thread_url)
+    current_time = now or get_current_time()
+    month_routes = [current_time.strftime('%Y-%B')]
 
     # if current month is not past 7 days, add previous month as well
-    if CURRENT_TIME.day < 7:
-        prev_month = (CURRENT_TIME - relativedelta(months=1)).strftime('%Y-%B')
-        email_thread_url = f"{base_url}/{prev_month}/"
-        urls_list.append(email_thread_url)
+    if current_time.day < 7:
+        month_routes.append((current_time - relativedelta(months=1)).strftime('%Y-%B'))
+    return month_routes
+
+
+def collect_email_urls(base_url, now=None):
+    urls_list = [f"{base_url}/{month_route}/" for month_route in get_month_routes(now)]
 
     all_email_urls = []
     for base_url in urls_list:
         print(f"working on: {base_url}")
         scrape_url = "date.html"
         r = requests.get(base_url + scrape_url)
-        soup = BeautifulSoup(r.content, 'html.parser')
-        if soup.body:
-            ul_soup = soup.body.findAll('ul')[1]
-            li_rows = ul_soup.findAll('li')
-
-            # get all emails urls
-            email_urls = [base_url + str(i.a['href']).strip() for i in li_rows]
-            all_email_urls.extend(email_urls)
+        all_email_urls.extend(parse_index_page(r.content, base_url))
 
     print(f"Fetched Urls: {len(all_email_urls)}")
     return all_email_urls
 
 
-def scrape_email_urls(email_urls_list):
+def parse_index_rows(content, month_url):
+    """:return: list, (url, author, subject) of the messages listed by an index page of a month, in page order"""
+    soup = BeautifulSoup(content, 'html.parser')
+    if not soup.body:
+        return []
+    ul_soup = soup.body.findAll('ul')[1]
+    li_rows = ul_soup.findAll('li')
+
+    return [(month_url + str(li.a['href']).strip(), li.find('i').text.strip() if li.find('i') else "",
+             normalize_text(li.a.text)) for li in li_rows]
+
+
+def parse_index_page(content, month_url):
+    # get all emails urls
+    return [row[0] for row in parse_index_rows(content, month_url)]
+
+
+def fetch_index_urls(month_url, store):
+    """
+    Message urls of the `date.html` index of a month, with a conditional request: when the page did not change
+    since the last run (HTTP 304), the urls stored at that time are returned.
+    :param store: ScrapeStore, holds the validators and urls of the last download of the page
+    """
+    index_url = month_url + "date.html"
+    cached = store.get_index_page(index_url)
+    headers = {}
+    if cached:
+        etag, last_modified, _ = cached
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+
+    r = requests.get(index_url, headers=headers)
+    if r.status_code == 304 and cached:
+        return cached[2]
+    r.raise_for_status()
+    email_urls = parse_index_page(r.content, month_url)
+    store.set_index_page(index_url, r.headers.get("ETag"), r.headers.get("Last-Modified"), email_urls)
+    return email_urls
+
+
+def scrape_new_emails(base_url, store=None, now=None):
+    """
+    Incremental version of `scrape_email_urls(collect_email_urls(base_url))`: only the messages not seen by a
+    previous run are downloaded, and appended to the scrape store. The week data is then read from the store.
+    :param store: ScrapeStore, defaults to the store at `config.SCRAPE_DB_PATH`
+    :param now: datetime, time of the run, defaults to the current time
+    """
+    store = store or ScrapeStore()
+    now = now or get_current_time()
+    email_urls = []
+    for month_route in get_month_routes(now):
+        month_url = f"{base_url}/{month_route}/"
+        print(f"working on: {month_url}")
+        email_urls.extend(fetch_index_urls(month_url, store))
+
+    seen = store.seen(email_urls)
+    new_email_urls = [url for url in email_urls if url not in seen]
+    print(f"Fetched Urls: {len(email_urls)}, new: {len(new_email_urls)}")
+
+    for url in tqdm(new_email_urls):
+        auth_, timestamp_, sub_, email_ = scrape_email_data(url)
+        # stored one by one, an interrupted run does not download the same messages again
+        store.add_emails([{"timestamp": timestamp_, "author": auth_, "subject": sub_, "email": email_,
+                           "email_url": url}])
+
+    dt_now = now
+    dt_min = dt_now - datetime.timedelta(days=7)
+    df_week = pd.DataFrame(store.emails_between(dt_min.strftime('%Y-%m-%d %H:%M:%S'),
+                                                dt_now.strftime('%Y-%m-%d %H:%M:%S')),
+                           columns=["timestamp", "author", "subject", "email", "email_url"])
+    df_week['timestamp'] = pd.to_datetime(df_week['timestamp'], utc=True)
+    df_week.dropna(inplace=True)
+    df_week.reset_index(drop=True, inplace=True)
+    df_week['tokens'] = df_week['email'].apply(lambda x: len(config.TOKENIZER.encode(x)))
+    return df_week
+
+
+def scrape_email_urls(email_urls_list, now=None):
     df_list = []
     for i in tqdm(email_urls_list):
         auth_, timestamp_, sub_, email_ = scrape_email_data(i)
@@ -96,13 +178,200 @@ def scrape_email_urls(email_urls_list):
             "email_url": i,
         }
         df_list.append(df_dict)
+    return save_week_data(df_list, now)
+
+
+def save_week_data(df_list, now=None):
+    now = now or get_current_time()
     # data frame of all emails
     emails_df = pd.DataFrame(df_list)
 
     # filter dataframe to get last week's data only
-    df_week = get_past_week_data(emails_df)
+    df_week = get_past_week_data(emails_df, now)
     df_week['tokens'] = df_week['email'].apply(lambda x: len(config.TOKENIZER.encode(x)))
 
     os.makedirs("output", exist_ok=True)
-    df_week.to_csv(f"output/df_week_{CURRENT_TIMESTAMP}.csv", index=False)
+    df_week.to_csv(f"output/df_week_{get_current_timestamp(now)}.csv", index=False)
     return df_week
+
+
+# a pipermail archive separates the messages with "From <sender>  Thu Dec  1 10:00:00 2022" lines
+MBOX_SEPARATOR = re.compile(rb'^From .* \w{3} \w{3} +\d{1,2} \d{2}:\d{2}:\d{2} \d{4}\s*$')
+GZIP_MAGIC = b'\x1f\x8b'
+
+
+@contextlib.contextmanager
+def open_month_archive(source):
+    """
+    Binary stream of the mbox of a pipermail monthly archive, downloaded and decompressed as it is read.
+    :param source: str, url or local path of the archive (`.txt.gz`, or an already decompressed `.txt`)
+    """
+    if source.startswith(("http://", "https://")):
+        r = requests.get(source, stream=True)
+        r.raise_for_status()
+        # the server may also send the archive with a gzip Content-Encoding, it is then decoded by urllib3
+        r.raw.decode_content = True
+        raw = io.BufferedReader(r.raw)
+    else:
+        raw = open(source, "rb")
+    try:
+        yield gzip.GzipFile(fileobj=raw) if raw.peek(2)[:2] == GZIP_MAGIC else raw
+    finally:
+        raw.close()
+
+
+def iter_mbox_messages(stream):
+    """
+    Split an mbox stream into its messages (raw bytes), one at a time, without reading the whole stream.
+    """
+    lines = None
+    previous_blank = True
+    for line in stream:
+        if previous_blank and MBOX_SEPARATOR.match(line):
+            if lines:
+                yield b"".join(lines)
+            lines = []
+        elif lines is not None:
+            lines.append(line)
+        previous_blank = not line.strip()
+    if lines:
+        yield b"".join(lines)
+
+
+def decode_header_value(value):
+    try:
+        value = str(email.header.make_header(email.header.decode_header(value or "")))
+    except (LookupError, UnicodeError, email.errors.HeaderParseError):
+        value = value or ""
+    return re.sub(r'\s+', ' ', value).strip()
+
+
+def get_message_text(message):
+    part = next((part for part in message.walk() if part.get_content_type() == "text/plain"), None)
+    if part is None:
+        return ""
+    payload = part.get_payload(decode=True) or b""
+    try:
+        return payload.decode(part.get_content_charset() or "utf-8", errors="replace")
+    except LookupError:
+        return payload.decode("utf-8", errors="replace")
+
+
+def parse_mbox_message(raw_message):
+    """
+    Record of a message of a monthly archive, with the fields `scrape_email_data` reads from its web page.
+    """
+    message = email.message_from_bytes(raw_message)
+
+    # pipermail obfuscates the sender as "aj at erisian.com.au (Anthony Towns)", the page shows the name
+    sender = decode_header_value(message["From"])
+    name = re.search(r'\((.*)\)\s*$', sender)
+    author = name.group(1).strip() if name else (email.utils.parseaddr(sender)[0] or sender)
+
+    try:
+        timestamp = email.utils.parsedate_to_datetime(message["Date"])
+    except (TypeError, ValueError):
+        timestamp = parse(str(message["Date"]), fuzzy=True)
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=pytz.utc)
+    timestamp = timestamp.astimezone(pytz.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+    return {
+        "timestamp": timestamp,
+        "author": author,
+        "subject": normalize_text(decode_header_value(message["Subject"])),
+        "email": preprocess_email(get_message_text(message)),
+        "email_url": None,
+    }
+
+
+def fetch_month_index(month_url):
+    """
+    Urls of the messages of a month with their author and subject, in archive order (by message number).
+    """
+    r = requests.get(month_url + "date.html")
+    rows = parse_index_rows(r.content, month_url)
+    return sorted(rows, key=lambda row: int(re.sub(r'\D', '', row[0][len(month_url):]) or 0))
+
+
+def assign_email_urls(records, index, month_url):
+    """
+    Set the `email_url` of the records of a month from its index: by author and subject, in archive order, then by
+    position when the archive and the index have the same number of messages.
+    """
+    positions_by_key = defaultdict(deque)
+    for position, (url, author, subject) in enumerate(index):
+        positions_by_key[(author, subject)].append(position)
+    matched = {}
+    for record_position, record in enumerate(records):
+        positions = positions_by_key.get((record["author"], record["subject"]))
+        if positions:
+            matched[record_position] = positions.popleft()
+    # a url taken by an author and subject match is not given again by position
+    consumed = set(matched.values())
+    for record_position, record in enumerate(records):
+        position = matched.get(record_position)
+        if position is None and len(records) == len(index) and record_position not in consumed:
+            position = record_position
+            consumed.add(position)
+        if position is not None:
+            record["email_url"] = index[position][0]
+        else:
+            record["email_url"] = month_url
+            print(f"No url found for: {record['subject']} - {record['author']}")
+    return records
+
+
+def read_month_archive(source, month_url=None):
+    """
+    Records (`timestamp`, `author`, `subject`, `email`, `email_url`) of the messages of a pipermail monthly archive.
+    :param source: str, url or local path of the archive
+    :param month_url: str, url of the month in the web archive, the urls of the messages are looked up in its
+        index page (a single request); without it, `email_url` is the archive itself
+    """
+    with open_month_archive(source) as stream:
+        records = [parse_mbox_message(raw_message) for raw_message in iter_mbox_messages(stream)]
+    if month_url:
+        return assign_email_urls(records, fetch_month_index(month_url), month_url)
+    for record in records:
+        record["email_url"] = source
+    return records
+
+
+def collect_email_records(base_url, archive_dir=None, now=None):
+    """
+    Records of the messages of the months `collect_email_urls` scrapes, read from the monthly archives: one download
+    and one index page per month instead of one request per message.
+    :param archive_dir: str, folder of downloaded archives (`<YYYY-Month>.txt.gz`), used instead of downloading them
+    """
+    records = []
+    for month_route in get_month_routes(now):
+        source = f"{base_url}/{month_route}.txt.gz"
+        if archive_dir and os.path.exists(os.path.join(archive_dir, f"{month_route}.txt.gz")):
+            source = os.path.join(archive_dir, f"{month_route}.txt.gz")
+        print(f"working on: {source}")
+        records.extend(read_month_archive(source, f"{base_url}/{month_route}/"))
+
+    print(f"Fetched emails: {len(records)}")
+    return records
+
+
+def ingest_email_archives(base_url, archive_dir=None):
+    """Same output as `scrape_email_urls(collect_email_urls(base_url))`, from the monthly archives."""
+    now = get_current_time()
+    return save_week_data(collect_email_records(base_url, archive_dir, now), now)
+
+
+def read_archive_folder(archive_dir, base_url=None):
+    """
+    Records of all the monthly archives (`<YYYY-Month>.txt.gz`) of a folder, e.g. for a historical backfill.
+    :param base_url: str, url of the mailing list archive, to look up the urls of the messages
+    """
+    records = []
+    for filename in sorted(os.listdir(archive_dir)):
+        if not filename.endswith((".txt.gz", ".txt")):
+            continue
+        month_route = filename.split(".txt")[0]
+        month_url = f"{base_url}/{month_route}/" if base_url else None
+        records.extend(read_month_archive(os.path.join(archive_dir, filename), month_url))
+    return records
@@ -0,0 +1,40 @@
+"""
+Sentence tokenization with NLTK's punkt, imported and loaded on first use.
+
+punkt is looked up in the NLTK data paths and in `config.NLTK_DATA_DIR`. When it is missing, it is downloaded
+once into `NLTK_DATA_DIR` and every later run is offline. If it can not be downloaded either (no network), a
+regular expression splitter is used instead of failing.
+"""
+import re
+
+from loguru import logger
+
+from src import config
+
+SENTENCE_PATTERN = re.compile(r'(?<=[.!?])\s+')
+_tokenizer = {}
+
+
+def split_sentences(text):
+    return [sentence for sentence in SENTENCE_PATTERN.split(text.strip()) if sentence]
+
+
+def load_tokenizer():
+    import nltk
+
+    if config.NLTK_DATA_DIR not in nltk.data.path:
+        nltk.data.path.insert(0, config.NLTK_DATA_DIR)
+    try:
+        nltk.data.find('tokenizers/punkt')
+    except LookupError:
+        logger.info(f"Downloading NLTK punkt to {config.NLTK_DATA_DIR}")
+        if not nltk.download('punkt', download_dir=config.NLTK_DATA_DIR, quiet=True, raise_on_error=False):
+            logger.warning("NLTK punkt is not available, sentences are split with a regular expression")
+            return split_sentences
+    return nltk.sent_tokenize
+
+
+def sent_tokenize(text):
+    if "tokenize" not in _tokenizer:
+        _tokenizer["tokenize"] = load_tokenizer()
+    return _tokenizer["tokenize"](text)
@@ -0,0 +1,125 @@
+import math
+from concurrent.futures import ThreadPoolExecutor
+
+from loguru import logger
+
+from src import config
+
+
+class SummaryPlan:
+    """
+    Map-reduce tree for summarizing a text of `input_tokens` tokens.
+
+    `levels` holds the number of calls on every level of the tree: the first level summarizes the raw
+    chunks, every following level consolidates the summaries of the previous one. The last level always
+    has a single call, so `len(levels)` is the depth of the tree and `sum(levels)` its number of calls.
+    """
+
+    def __init__(self, input_tokens, chunk_tokens, output_tokens, levels):
+        self.input_tokens = input_tokens
+        self.chunk_tokens = chunk_tokens
+        self.output_tokens = output_tokens
+        self.levels = levels
+
+    @property
+    def total_calls(self):
+        return sum(self.levels)
+
+    @property
+    def fan_in(self):
+        return max(self.chunk_tokens // self.output_tokens, 1)
+
+    @property
+    def estimated_input_tokens(self):
+        # raw input on the first level, (at most) the generated summaries on the following levels
+        return self.input_tokens + sum(self.levels[:-1]) * self.output_tokens
+
+    @property
+    def estimated_output_tokens(self):
+        return self.total_calls * self.output_tokens
+
+    def __repr__(self):
+        return (f"SummaryPlan(input_tokens={self.input_tokens}, chunk_tokens={self.chunk_tokens}, "
+                f"levels={self.levels}, total_calls={self.total_calls}, "
+                f"estimated_input_tokens={self.estimated_input_tokens})")
+
+
+def plan_summary(input_tokens, context_limit=config.MODEL_CONTEXT_LIMIT,
+                 target_output_tokens=config.SUMMARY_OUTPUT_TOKENS,
+                 prompt_overhead_tokens=config.SUMMARY_PROMPT_OVERHEAD_TOKENS,
+                 max_chunk_tokens=config.SUMMARY_MAX_CHUNK_TOKENS):
+    """
+    Compute the smallest map-reduce tree that summarizes `input_tokens` tokens.
+    :param input_tokens: int, number of tokens of the text to summarize
+    :param context_limit: int, context window of the model
+    :param target_output_tokens: int, max tokens generated by every call
+    :param prompt_overhead_tokens: int, tokens reserved for the instruction prompt
+    :param max_chunk_tokens: int or None, optional cap for the input of a single call
+    """
+    chunk_tokens = context_limit - prompt_overhead_tokens - target_output_tokens
+    if max_chunk_tokens:
+        chunk_tokens = min(chunk_tokens, max_chunk_tokens)
+    if chunk_tokens < 2 * target_output_tokens:
+        raise ValueError(f"Chunk budget of {chunk_tokens} tokens can not consolidate two summaries of "
+                         f"{target_output_tokens} tokens, increase the context limit or reduce the output size")
+
+    fan_in = chunk_tokens // target_output_tokens
+    levels = [max(math.ceil(input_tokens / chunk_tokens), 1)]
+    while levels[-1] > 1:
+        levels.append(math.ceil(levels[-1] / fan_in))
+
+    return SummaryPlan(input_tokens=input_tokens, chunk_tokens=chunk_tokens,
+                       output_tokens=target_output_tokens, levels=levels)
+
+
+def split_evenly(items, n_parts):
+    """Split `items` into `n_parts` consecutive parts whose sizes differ by at most one."""
+    size, remainder = divmod(len(items), n_parts)
+    parts = []
+    start = 0
+    for i in range(n_parts):
+        end = start + size + (1 if i < remainder else 0)
+        parts.append(items[start:end])
+        start = end
+    return parts
+
+
+def pack_batches(items, max_tokens=config.BATCH_MAX_INPUT_TOKENS, max_items=config.BATCH_MAX_MESSAGES):
+    """
+    Pack independent texts into batches of at most `max_tokens` tokens and `max_items` texts, keeping their order.
+    :param items: dict, id -> text
+    :return: list of dicts, id -> text
+    """
+    batches = []
+    batch, batch_tokens = {}, 0
+    for item_id, text in items.items():
+        n_tokens = len(config.TOKENIZER.encode(text))
+        if batch and (batch_tokens + n_tokens > max_tokens or len(batch) >= max_items):
+            batches.append(batch)
+            batch, batch_tokens = {}, 0
+        batch[item_id] = text
+        batch_tokens += n_tokens
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def execute_plan(plan, text, summarize_fn, consolidate_fn, max_workers=config.SUMMARY_MAX_WORKERS):
+    """
+    Run `plan` over `text`; the calls of a level are independent and are executed in parallel.
+    :param summarize_fn: callable(str) -> str, used on the chunks of the raw text
+    :param consolidate_fn: callable(str) -> str, used to merge the summaries of the previous level
+    """
+    tokens = config.TOKENIZER.encode(text)
+    chunks = [config.TOKENIZER.decode(part).strip() for part in split_evenly(tokens, plan.levels[0])]
+    chunks = [chunk for chunk in chunks if chunk]
+    logger.info(f"Executing {plan}")
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        summaries = list(executor.map(summarize_fn, chunks))
+        for level, n_calls in enumerate(plan.levels[1:], start=1):
+            groups = split_evenly(summaries, n_calls)
+            logger.info(f"Consolidating {len(summaries)} summaries in {n_calls} call(s) at level {level}")
+            summaries = list(executor.map(consolidate_fn, ["\n".join(group) for group in groups if group]))
+
+    return "\n".join(summaries)
@@ -0,0 +1,125 @@
+"""
+Canonical thread identity of the messages.
+
+Replies and forwards of a message carry variants of its subject ("Re: X", "Fwd: X", "[bitcoin-dev] X",
+"RE: [Lightning-dev] -X", ...). The thread key of a subject ignores these prefixes, list tags, punctuation and
+case, so all the variants resolve to the same thread. When the reply headers of the messages are known
+(`message_id`, `in_reply_to`, `references`), replies are also attached to the thread of the message they
+answer, even if the subject was changed.
+"""
+import re
+
+from src import config
+from src.list_runner import get_dev_name
+
+# tags the mailing lists put in front of the subjects, other bracketed tokens ("[BIP-119]") are part of the subject
+LIST_TAGS = sorted({get_dev_name(url) for url in config.MAILING_LISTS} | {"bitcoin-development"})
+# "Re:", "Fwd:", "AW:", "Re[2]:" or a list tag such as "[bitcoin-dev]"
+SUBJECT_PREFIX = re.compile(r'^\s*(?:(?:re|fwd?|aw|sv)\s*(?:\[\d+\])?\s*:|\[(?:%s)\])\s*' % "|".join(map(re.escape, LIST_TAGS)),
+                            re.IGNORECASE)
+# quotes and brackets are only removed in pairs enclosing the whole subject, see `strip_enclosing`
+ENCLOSING_PAIRS = {'"': '"', "'": "'", '\u201c': '\u201d', '\u2018': '\u2019', '(': ')', '[': ']', '<': '>'}
+LEADING_PUNCTUATION = re.compile(r'^[^\w%s]+' % re.escape("".join(ENCLOSING_PAIRS)))
+
+
+def strip_enclosing(subject):
+    """'"X"' -> 'X', but '"Bitcoin Core" release' and '"A" or "B"' are left alone."""
+    opening = subject[:1]
+    closing = ENCLOSING_PAIRS.get(opening)
+    if not closing or len(subject) < 2:
+        return subject
+    depth = 0
+    for i, char in enumerate(subject):
+        # the character closing the opening one: enclosing only if it is the last one
+        if i > 0 and char == closing and (depth == 1 or opening == closing):
+            return subject[1:-1] if i == len(subject) - 1 else subject
+        if char == opening:
+            depth += 1
+        elif char == closing:
+            depth -= 1
+    return subject
+
+
+def canonical_subject(title):
+    """Subject without reply/forward prefixes, list tags and leading punctuation: "Re: [bitcoin-dev] X" -> "X"."""
+    subject = title or ""
+    previous = None
+    while subject != previous:
+        previous = subject
+        subject = strip_enclosing(LEADING_PUNCTUATION.sub("", SUBJECT_PREFIX.sub("", subject)).strip())
+    return re.sub(r'\s+', ' ', subject).strip() or (title or "").strip()
+
+
+def thread_key(title):
+    """Key of the thread of a subject: its canonical subject, lower case, punctuation ignored."""
+    subject = canonical_subject(title).lower()
+    return re.sub(r'[^a-z0-9]+', ' ', subject).strip() or subject
+
+
+def combined_filename(thread_title):
+    """Filename of the combined summary of a thread, its title cleaned like the filenames of the message XMLs."""
+    return f"combined_{re.sub(r'[^A-Za-z0-9]+', '-', thread_title)}.xml"
+
+
+def combined_filenames(thread_title, titles=()):
+    """
+    Filenames the combined summary of a thread may have, the current one first. Summaries written before the
+    subjects were made canonical are named after the raw subject of one of the messages, like the message XMLs
+    ("`OP_FOLD`: A Looping..." -> `combined_-OP-FOLD-A-Looping...xml`).
+    :param titles: iterable, raw subjects of the messages of the thread
+    """
+    names = [combined_filename(thread_title)] + [combined_filename(title) for title in titles if title]
+    return list(dict.fromkeys(names))
+
+
+def reply_ids(record):
+    ids = []
+    for field in ("in_reply_to", "references"):
+        value = record.get(field)
+        if isinstance(value, str):
+            value = value.split()
+        ids.extend(message_id.strip() for message_id in value or [] if message_id and message_id.strip())
+    return ids
+
+
+def resolve_threads(records):
+    """
+    Group the messages into threads: by thread key of their subject, and by reply headers when present.
+    :param records: list of dict with a `title`, and optionally `created_at`, `message_id`, `in_reply_to` and
+        `references`
+    :return: list, title of the thread of every record: the canonical subject of the earliest message of the thread
+    """
+    parent = list(range(len(records)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def union(i, j):
+        root_i, root_j = find(i), find(j)
+        if root_i != root_j:
+            parent[max(root_i, root_j)] = min(root_i, root_j)
+
+    first_by_key = {}
+    first_by_message_id = {}
+    for i, record in enumerate(records):
+        union(i, first_by_key.setdefault(thread_key(record.get("title")), i))
+        if record.get("message_id"):
+            first_by_message_id.setdefault(record["message_id"].strip(), i)
+    for i, record in enumerate(records):
+        for message_id in reply_ids(record):
+            if message_id in first_by_message_id:
+                union(i, first_by_message_id[message_id])
+
+    def age(i):
+        created_at = records[i].get("created_at")
+        return created_at is None, created_at if created_at is not None else 0, i
+
+    earliest = {}
+    for i in range(len(records)):
+        root = find(i)
+        if root not in earliest or age(i) < age(earliest[root]):
+            earliest[root] = i
+    return [canonical_subject(records[earliest[find(i)]].get("title")) for i in range(len(records))]
@@ -9,12 +9,17 @@ from dateutil.relativedelta import relativedelta
 import pytz
 import datetime
 from src.gpt_utils import *
+from src.backends import get_backend
 from src import config
 
 
-CURRENT_TIME = datetime.datetime.now(datetime.timezone.utc)
-CURRENT_TIMESTAMP = str(CURRENT_TIME.timestamp()).replace(".", "_")
-print(f"Current time: {CURRENT_TIMESTAMP}")
+def get_current_time():
+    # a run takes "now" once and passes it along, long-running processes (web app, scheduler) run many times
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def get_current_timestamp(now=None):
+    return str((now or get_current_time()).timestamp()).replace(".", "_")
 
 
 def normalize_text(s, sep_token=" \n "):
@@ -68,6 +73,18 @@ def preprocess_email(email_body):
     return normalized_email_string
 
 
+def is_short_email(email_body, max_tokens=config.FAST_PATH_MAX_TOKENS, max_sentences=config.FAST_PATH_MAX_SENTENCES):
+    """
+    Return whether the (preprocessed) email is small enough to be summarized without calling the LLM.
+    :param email_body: str, preprocessed email body
+    :param max_tokens: int, max number of tokens of a short email
+    :param max_sentences: int, max number of sentences of a short email
+    """
+    if len(config.TOKENIZER.encode(email_body)) > max_tokens:
+        return False
+    return len(get_backend("extractive").split_sentences(email_body)) <= max_sentences
+
+
 def scrape_email_data(url_):
     r = requests.get(url_)
     body_soup = BeautifulSoup(r.content, 'html.parser').body
@@ -81,8 +98,8 @@ def scrape_email_data(url_):
     return author, timestamp, normalize_text(subject), normalized_email_body
 
 
-def get_past_week_data(dataframe):
-    dt_now = CURRENT_TIME
+def get_past_week_data(dataframe, now=None):
+    dt_now = now or get_current_time()
     dt_min = dt_now - datetime.timedelta(days=7)
     dataframe['timestamp'] = pd.to_datetime(dataframe['timestamp'], utc=True)
     sliced_df = dataframe[(dataframe['timestamp'] >= dt_min) & (dataframe['timestamp'] <= dt_now)]
@@ -107,13 +124,14 @@ def get_datetime_format(dataframe):
 def collect_email_urls(base_url):
     urls_list = []
     # add current month
-    month_route = f"{CURRENT_TIME.strftime('%Y-%B')}"
+    current_time = get_current_time()
+    month_route = f"{current_time.strftime('%Y-%B')}"
     email_thread_url = f"{base_url}/{month_route}/"
     urls_list.append(email_thread_url)
 
     # if current month is not past 7 days, add previous month as well
-    if CURRENT_TIME.day < 7:
-        prev_month = (CURRENT_TIME - relativedelta(months=1)).strftime('%Y-%B')
+    if current_time.day < 7:
+        prev_month = (current_time - relativedelta(months=1)).strftime('%Y-%B')
         email_thread_url = f"{base_url}/{prev_month}/"
         urls_list.append(email_thread_url)
 
@@ -136,6 +154,7 @@ def collect_email_urls(base_url):
 
 
 def scrape_email_urls(email_urls_list):
+    now = get_current_time()
     df_list = []
     for i in tqdm(email_urls_list):
         auth_, timestamp_, sub_, email_ = scrape_email_data(i)
@@ -151,11 +170,11 @@ def scrape_email_urls(email_urls_list):
     emails_df = pd.DataFrame(df_list)
 
     # filter dataframe to get last week's data only
-    df_week = get_past_week_data(emails_df)
+    df_week = get_past_week_data(emails_df, now)
     df_week['tokens'] = df_week['email'].apply(lambda x: len(config.TOKENIZER.encode(x)))
 
     os.makedirs("output", exist_ok=True)
-    df_week.to_csv(f"output/df_week_{CURRENT_TIMESTAMP}.csv", index=False)
+    df_week.to_csv(f"output/df_week_{get_current_timestamp(now)}.csv", index=False)
     return df_week
 
 
@@ -227,7 +246,7 @@ def generate_newsletter_completion(df):
 
     df_week_generated = pd.DataFrame(data_records)
     os.makedirs("output", exist_ok=True)
-    df_week_generated.to_csv(f"output/df_week_generated_{CURRENT_TIMESTAMP}.csv", index=False)
+    df_week_generated.to_csv(f"output/df_week_generated_{get_current_timestamp()}.csv", index=False)
     return df_week_generated
 
 
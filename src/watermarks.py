@@ -0,0 +1,119 @@
+"""
+Change data capture of the Elasticsearch documents with a persisted high-water mark per job and mailing list.
+
+Instead of re-reading a fixed window (e.g. the last 30 days) on every run, a job asks for the documents indexed
+since its watermark, minus an overlap (`WATERMARK_OVERLAP_HOURS`) so that documents indexed late or with a
+skewed clock are not missed, the jobs skipping what they already processed anyway. Once a run has succeeded,
+the watermark moves to the latest indexed date of the documents it fetched (the clock of the documents, not the
+one of the job). The first run of a job, without a watermark, keeps its usual window of created dates.
+
+The indexed date is `WATERMARK_FIELD` ("indexed_at"); documents without it are tracked by their "created_at".
+A job can keep documents it could not process yet (`pending`) in the window of its next runs.
+
+The cron workflows run on a fresh checkout, so the watermarks are kept in the repository: one small JSON file
+per job in `WATERMARK_DIR`, committed by the workflow along with the files the job generates.
+"""
+import json
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+
+import dateutil.parser
+
+from src import config
+from src.atom_writer import write_atomic
+
+
+def doc_time(doc, field=config.WATERMARK_FIELD):
+    """:return: datetime, UTC indexed date of an ES document (its created date without one), None if unknown"""
+    source = doc["_source"]
+    value = source.get(field) or source.get("created_at")
+    if not value:
+        return None
+    value = dateutil.parser.isoparse(value)
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value.astimezone(timezone.utc)
+
+
+def changed_since_query(since, field=config.WATERMARK_FIELD):
+    """ES clause of the documents indexed (or created, for documents without an indexed date) at or after `since`."""
+    since_str = since.astimezone(timezone.utc).isoformat(timespec="milliseconds").replace("+00:00", "Z")
+    return {
+        "bool": {
+            "should": [
+                {"range": {field: {"gte": since_str}}},
+                {"bool": {"must_not": {"exists": {"field": field}},
+                          "must": {"range": {"created_at": {"gte": since_str}}}}},
+            ],
+            "minimum_should_match": 1,
+        }
+    }
+
+
+# the jobs of the mailing lists run in parallel, each possibly with its own store, and share the file of their job:
+# the read-modify-write of a file is serialized by a lock per file, not per store
+_file_locks = {}
+_file_locks_guard = threading.Lock()
+
+
+def _file_lock(path):
+    with _file_locks_guard:
+        return _file_locks.setdefault(os.path.abspath(path), threading.Lock())
+
+
+class WatermarkStore:
+    """Watermarks of the jobs, `<folder>/<job>.json` maps a key (e.g. a mailing list) to its watermark."""
+
+    def __init__(self, folder=config.WATERMARK_DIR):
+        self.folder = folder
+
+    def _path(self, job):
+        return os.path.join(self.folder, f"{job}.json")
+
+    def _read(self, job):
+        try:
+            with open(self._path(job), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def get(self, job, key):
+        """:return: datetime, the watermark of `job` for `key` (e.g. a mailing list), None before the first run"""
+        value = self._read(job).get(key)
+        return datetime.fromisoformat(value) if value else None
+
+    def set(self, job, key, value):
+        with _file_lock(self._path(job)):
+            watermarks = self._read(job)
+            watermarks[key] = value.isoformat()
+            os.makedirs(self.folder, exist_ok=True)
+            content = json.dumps(watermarks, indent=1, sort_keys=True) + "\n"
+            write_atomic(self._path(job), content.encode("utf-8"), fsync=False)
+
+    def since(self, job, key, overlap_hours=config.WATERMARK_OVERLAP_HOURS):
+        """
+        Start of the window of the next run: the watermark minus the overlap.
+        :return: datetime, None on the first run (no watermark yet): the job then uses its usual window
+        """
+        watermark = self.get(job, key)
+        return None if watermark is None else watermark - timedelta(hours=overlap_hours)
+
+    def advance(self, job, key, docs, pending=(), max_lag_days=30):
+        """
+        Move the watermark after a successful run, to the latest indexed date of the fetched documents.
+        :param docs: list, the ES documents fetched by the run
+        :param pending: list, fetched documents not processed yet: the watermark stays before the earliest one, so
+            that the next runs fetch them again, unless it is older than `max_lag_days`
+        :return: datetime, the new watermark
+        """
+        watermark = self.get(job, key)
+        times = [t for t in map(doc_time, docs) if t is not None]
+        if times:
+            latest = max(times)
+            watermark = latest if watermark is None else max(watermark, latest)
+        oldest_pending = datetime.now(timezone.utc) - timedelta(days=max_lag_days)
+        pending_times = [t for t in map(doc_time, pending) if t is not None and t >= oldest_pending]
+        if watermark is not None and pending_times:
+            watermark = min(watermark, min(pending_times))
+        if watermark is not None:
+            self.set(job, key, watermark)
+        return watermark
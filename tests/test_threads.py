@@ -0,0 +1,35 @@
+import app
+from src.threads import canonical_subject, combined_filename, combined_filenames
+
+# real names of the archive: March_2022 of bitcoin-dev, written before the subjects were made canonical
+LEGACY_TITLE = "`OP_FOLD`: A Looping Construct For Bitcoin SCRIPT"
+LEGACY_COMBINED = "combined_-OP-FOLD-A-Looping-Construct-For-Bitcoin-SCRIPT.xml"
+LEGACY_MESSAGE = "020054_-OP-FOLD-A-Looping-Construct-For-Bitcoin-SCRIPT.xml"
+
+
+def post(filename, title, date):
+    return {"filename": filename, "title": title, "author": "ZmnSCPxj", "date": date}
+
+
+def test_combined_filenames_include_the_legacy_name():
+    assert combined_filename(canonical_subject(LEGACY_TITLE)) != LEGACY_COMBINED
+    assert combined_filenames(canonical_subject(LEGACY_TITLE), [LEGACY_TITLE])[-1] == LEGACY_COMBINED
+
+
+def test_month_threads_link_messages_to_legacy_combined():
+    month = app.MonthThreads([
+        post(LEGACY_COMBINED, "Combined summary - " + LEGACY_TITLE, "2022-03-15T10:00:00+00:00"),
+        post(LEGACY_MESSAGE, LEGACY_TITLE, "2022-03-01T10:00:00+00:00"),
+        post("020058_-OP-FOLD-A-Looping-Construct-For-Bitcoin-SCRIPT.xml", LEGACY_TITLE, "2022-03-02T10:00:00+00:00"),
+    ])
+    assert month.combined_filename(LEGACY_MESSAGE) == LEGACY_COMBINED
+    assert [p["filename"] for p in month.views["thread"]] == [LEGACY_COMBINED]
+    assert len(month.threads) == 1
+
+
+def test_month_threads_prefer_the_canonical_combined():
+    month = app.MonthThreads([
+        post("combined_BIP-21.xml", "Combined summary - BIP-21", "2022-03-15T10:00:00+00:00"),
+        post("000001_Re-BIP-21.xml", "Re: BIP-21", "2022-03-01T10:00:00+00:00"),
+    ])
+    assert month.combined_filename("000001_Re-BIP-21.xml") == "combined_BIP-21.xml"
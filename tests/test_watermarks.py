@@ -0,0 +1,35 @@
+import sys
+import threading
+from datetime import datetime, timezone
+
+from src.watermarks import WatermarkStore
+
+
+def test_concurrent_set_keeps_every_key(tmp_path):
+    # one store per list, like the lists run in parallel by the scheduler, all writing the file of the same job;
+    # every set adds a new key, so a lost read-modify-write leaves a key missing
+    lists = [f"list-{i}" for i in range(8)]
+    keys = [f"{dev_name}-{n}" for dev_name in lists for n in range(25)]
+    value = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    barrier = threading.Barrier(len(lists))
+
+    def run(dev_name):
+        store = WatermarkStore(str(tmp_path))
+        barrier.wait()
+        for n in range(25):
+            store.set("generate_xmls", f"{dev_name}-{n}", value)
+
+    # switch threads as often as possible, between the read and the write of the file
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        threads = [threading.Thread(target=run, args=(dev_name,)) for dev_name in lists]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(switch_interval)
+
+    store = WatermarkStore(str(tmp_path))
+    assert {key: store.get("generate_xmls", key) for key in keys} == dict.fromkeys(keys, value)
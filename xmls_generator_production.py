@@ -1,18 +1,12 @@
 import re
 import pandas as pd
-from feedgen.feed import FeedGenerator
 from tqdm import tqdm
 from elasticsearch import Elasticsearch
 import time
 import traceback
-import platform
 import openai
-import shutil
 from datetime import datetime, timedelta
 import pytz
-import glob
-import xml.etree.ElementTree as ET
-import tiktoken
 import os
 from dotenv import load_dotenv
 import sys
@@ -20,20 +14,26 @@ import ast
 from loguru import logger
 import warnings
 from openai.error import APIError, PermissionError, AuthenticationError, InvalidAPIType, ServiceUnavailableError
-from src.utils import preprocess_email
-from src.gpt_utils import generate_chatgpt_summary, consolidate_chatgpt_summary
-from src.config import TOKENIZER, ES_CLOUD_ID, ES_USERNAME, ES_PASSWORD, ES_INDEX, ES_DATA_FETCH_SIZE
+from src.utils import preprocess_email, is_short_email
+from src.manifest import iter_month_folders, load_manifest, update_manifest, read_summary
+from src.archive_store import ArchiveStore
+from src.atom_writer import render_feed, BatchedWriter
+from src.combined_store import REF_SUFFIX, combined_path, ref_data, list_xml_files, resolve_xml_path
+from src.list_runner import run_per_list
+from src.backends import get_backend
+from src.near_duplicates import MinHashLSH
+from src.watermarks import WatermarkStore, changed_since_query
+from src.threads import canonical_subject, combined_filename, combined_filenames, thread_key, resolve_threads
+from src.gpt_utils import generate_chatgpt_summary, consolidate_chatgpt_summary, generate_batch_summaries
+from src.summary_planner import plan_summary, execute_plan, pack_batches
+from src import config
+from src.config import ES_CLOUD_ID, ES_USERNAME, ES_PASSWORD, ES_INDEX, ES_DATA_FETCH_SIZE, \
+    BATCH_MESSAGE_MAX_TOKENS
 
 warnings.filterwarnings("ignore")
 load_dotenv()
 
 
-TOKENIZER = tiktoken.get_encoding("cl100k_base")
-
-# if set to True, it will use chatgpt model ("gpt-4-1106-preview") for all the completions
-CHATGPT = True
-
-# COMPLETION_MODEL - only applicable if CHATGPT is set to False
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
 
@@ -51,7 +51,11 @@ class ElasticSearchClient:
             http_auth=(self._es_username, self._es_password),
         )
 
-    def extract_data_from_es(self, es_index, url, start_date_str, current_date_str):
+    def extract_data_from_es(self, es_index, url, start_date_str=None, current_date_str=None, since=None):
+        """
+        Documents of a mailing list created between two dates, and/or indexed since a watermark.
+        :param since: datetime, only the documents indexed at or after it - see src/watermarks.py
+        """
         output_list = []
         start_time = time.time()
 
@@ -65,19 +69,22 @@ class ElasticSearchClient:
                                 "prefix": {  # Using prefix query for domain matching
                                     "domain.keyword": str(url)
                                 }
-                            },
-                            {
-                                "range": {
-                                    "created_at": {
-                                        "gte": f"{start_date_str}T00:00:00.000Z",
-                                        "lte": f"{current_date_str}T23:59:59.999Z"
-                                    }
-                                }
                             }
                         ]
                     }
                 }
             }
+            if start_date_str and current_date_str:
+                query["query"]["bool"]["must"].append({
+                    "range": {
+                        "created_at": {
+                            "gte": f"{start_date_str}T00:00:00.000Z",
+                            "lte": f"{current_date_str}T23:59:59.999Z"
+                        }
+                    }
+                })
+            if since:
+                query["query"]["bool"]["must"].append(changed_since_query(since))
 
             # Initialize the scroll
             scroll_response = self._es_client.search(index=es_index, body=query, size=self._es_data_fetch_size,
@@ -112,115 +119,165 @@ class GenerateXML:
             1: "Jan", 2: "Feb", 3: "March", 4: "April", 5: "May", 6: "June",
             7: "July", 8: "Aug", 9: "Sept", 10: "Oct", 11: "Nov", 12: "Dec"
         }
-
-    def split_prompt_into_chunks(self, prompt, chunk_size):
-        tokens = TOKENIZER.encode(prompt)
-        chunks = []
-
-        while len(tokens) > 0:
-            current_chunk = TOKENIZER.decode(tokens[:chunk_size]).strip()
-
-            if current_chunk:
-                chunks.append(current_chunk)
-
-            tokens = tokens[chunk_size:]
-
-        return chunks
-
-    def get_summary_chunks(self, body, tokens_per_sub_body):
-        chunks = self.split_prompt_into_chunks(body, tokens_per_sub_body)
-        summaries = []
-
-        logger.info(f"Total chunks: {len(chunks)}")
-
-        for chunk in chunks:
-            count_gen_sum = 0
-            while True:
-                try:
-                    time.sleep(2)
-                    summary = generate_chatgpt_summary(chunk)
-                    summaries.append(summary)
-                    break
-                except (APIError, PermissionError, AuthenticationError, InvalidAPIType, ServiceUnavailableError) as ex:
-                    logger.error(str(ex))
-                    count_gen_sum += 1
-                    time.sleep(0.2)
-                    if count_gen_sum > 5:
-                        sys.exit(f"Chunk summary ran into error: {traceback.format_exc()}")
-
-        return summaries
-
-    def recursive_summary(self, body, tokens_per_sub_body, max_length):
-        summaries = self.get_summary_chunks(body, tokens_per_sub_body)
-
-        summary_length = sum([len(TOKENIZER.encode(s)) for s in summaries])
-
-        logger.info(f"Summary length: {summary_length}")
-        logger.info(f"Max length: {max_length}")
-
-        if summary_length > max_length:
-            logger.info("entering in recursion")
-            return self.recursive_summary("".join(summaries), tokens_per_sub_body, max_length)
-        else:
-            return summaries
+        self.llm_calls_avoided = 0
+        self.batched_summaries = {}
+        self.near_duplicate_of = {}  # message number -> number of the message it is a near-duplicate of
+        self.summaries_by_number = {}
+        self.combined_names = {}  # thread title -> filename of its combined XML
+        self.llm_calls_deduplicated = 0
+        self.archive_store = ArchiveStore()
+        self.writer = BatchedWriter()
+
+    def call_with_retry(self, gpt_function, prompt):
+        count_api = 0
+        while True:
+            try:
+                time.sleep(2)
+                return gpt_function(prompt)
+            except (APIError, PermissionError, AuthenticationError, InvalidAPIType, ServiceUnavailableError) as ex:
+                logger.error(str(ex))
+                count_api += 1
+                time.sleep(0.2)
+                if count_api > 5:
+                    # raised (not sys.exit) so that the caller - the retry of the run, the job scheduler - handles it
+                    logger.error(f"Chunk summary ran into error: {traceback.format_exc()}")
+                    raise
 
     def gpt_api(self, body):
-        body_length_limit = 2800
-        tokens_per_sub_body = 2700
-        summaries = self.recursive_summary(body, tokens_per_sub_body, body_length_limit)
-
-        if len(summaries) > 1:
+        plan = plan_summary(len(config.TOKENIZER.encode(body)))
+        if plan.total_calls > 1:
             logger.info("Consolidate summary generating")
-            summary_str = "\n".join(summaries)
-            count_api = 0
-            while True:
-                try:
-                    time.sleep(2)
-                    consolidated_summaries = consolidate_chatgpt_summary(summary_str)
-                    break
-                except (APIError, PermissionError, AuthenticationError, InvalidAPIType, ServiceUnavailableError) as ex:
-                    logger.error(str(ex))
-                    count_api += 1
-                    time.sleep(0.2)
-                    if count_api > 5:
-                        sys.exit(f"Chunk summary ran into error: {traceback.format_exc()}")
-
-            return consolidated_summaries
-
         else:
             logger.info("Individual summary generating")
-            return "\n".join(summaries)
+        return execute_plan(
+            plan, body,
+            summarize_fn=lambda chunk: self.call_with_retry(generate_chatgpt_summary, chunk),
+            consolidate_fn=lambda summaries: self.call_with_retry(consolidate_chatgpt_summary, summaries)
+        )
+
+    def consolidate_summaries(self, summaries):
+        """
+        Combined summary of a thread from the summaries of its messages, which are much shorter than the raw
+        bodies: a single consolidation call, unless the summaries do not fit in one call - they are then
+        consolidated in groups, level by level, following the summary plan.
+        """
+        text = "\n".join(summaries)
+        plan = plan_summary(len(config.TOKENIZER.encode(text)))
+        if plan.total_calls == 1:
+            logger.info("Combined summary generating from the message summaries")
+            return self.call_with_retry(consolidate_chatgpt_summary, text)
+        logger.info("Combined summary generating from the message summaries, in groups")
+        return execute_plan(
+            plan, text,
+            summarize_fn=lambda chunk: self.call_with_retry(consolidate_chatgpt_summary, chunk),
+            consolidate_fn=lambda summaries: self.call_with_retry(consolidate_chatgpt_summary, summaries)
+        )
+
+    def message_summary(self, link):
+        """Summary of the message XML at `link` (as returned by `generate_local_xml`), read from the archive store."""
+        dev_name, year_month, filename = link.split("/")
+        record = self.archive_store.get(dev_name, year_month, filename)
+        if record is None:
+            # written before the store existed
+            self.index_xml(os.path.join("static", link))
+            record = self.archive_store.get(dev_name, year_month, filename)
+        return record["summary"]
 
     def create_summary(self, body):
+        if is_short_email(body):
+            # one or two line replies, the extractive summary is the (cleaned) email itself
+            self.llm_calls_avoided += 1
+            return get_backend("extractive").summarize(body)
         summ = self.gpt_api(body)
         return summ
 
+    def local_xml_path(self, cols, url):
+        dev_name = "bitcoin-dev" if "bitcoin-dev" in url else "lightning-dev"
+        month_name = self.month_dict[int(cols['created_at'].month)]
+        str_month_year = f"{month_name}_{int(cols['created_at'].year)}"
+        return f"static/{dev_name}/{str_month_year}/{self.get_id(cols['id'])}_{self.clean_title(cols['title'])}.xml"
+
+    def batch_summaries(self, emails_df, url):
+        """
+        Summarize the small messages that have no xml yet with a few batched requests, instead of one request
+        (and one instruction preamble) per message. The summaries are picked up by `generate_local_xml`.
+        """
+        pending = {}
+        for _, cols in emails_df.iterrows():
+            body = str(cols['body'])
+            if os.path.exists(self.local_xml_path(cols, url)) or is_short_email(body):
+                continue
+            if self.get_id(cols['id']) in self.near_duplicate_of:
+                continue
+            if len(config.TOKENIZER.encode(body)) <= BATCH_MESSAGE_MAX_TOKENS:
+                pending[self.get_id(cols['id'])] = body
+
+        batches = [batch for batch in pack_batches(pending) if len(batch) > 1]
+        for batch in batches:
+            self.batched_summaries.update(self.call_with_retry(generate_batch_summaries, batch))
+        logger.info(f"Batched {sum(len(batch) for batch in batches)} message(s) into {len(batches)} request(s)")
+
+    def find_near_duplicates(self, emails_df, url):
+        """
+        Find the new messages whose body is a near-copy of another one (forwards, cross-posts), they reuse the
+        summary of that message instead of being summarized again.
+        """
+        numbers, bodies = [], []
+        for _, cols in emails_df.iterrows():
+            body = str(cols['body'])
+            if os.path.exists(self.local_xml_path(cols, url)) or is_short_email(body):
+                continue
+            numbers.append(self.get_id(cols['id']))
+            bodies.append(body)
+        duplicate_of = MinHashLSH().find_duplicates(bodies)
+        self.near_duplicate_of = {numbers[i]: numbers[j] for i, j in duplicate_of.items() if numbers[i] != numbers[j]}
+        logger.info(f"Near-duplicate messages found: {len(self.near_duplicate_of)}")
+
     def create_folder(self, month_year):
         os.makedirs(month_year, exist_ok=True)
 
     def generate_xml(self, feed_data, xml_file):
-        # create feed generator
-        fg = FeedGenerator()
-        fg.id(feed_data['id'])
-        fg.title(feed_data['title'])
-        for author in feed_data['authors']:
-            fg.author({'name': author})
-        for link in feed_data['links']:
-            fg.link(href=link, rel='alternate')
-        # add entries to the feed
-        fe = fg.add_entry()
-        fe.id(feed_data['id'])
-        fe.title(feed_data['title'])
-        fe.link(href=feed_data['url'], rel='alternate')
-        fe.published(feed_data['created_at'])
-        fe.summary(feed_data['summary'])
-
-        # generate the feed XML
-        feed_xml = fg.atom_str(pretty=True)
-        # convert the feed to an XML string
-        # write the XML string to a file
-        with open(xml_file, 'wb') as f:
-            f.write(feed_xml)
+        # same Atom document as feedgen, written atomically (the fsyncs are batched, see `self.writer.flush`);
+        # a file with the same content apart from its <updated> timestamps is left untouched
+        if self.writer.write(xml_file, render_feed(feed_data)):
+            self.index_xml(xml_file)
+
+    def link_combined(self, combined_file, month_folder, changed=False):
+        """
+        Make the combined XML stored once at `combined_file` appear in a month folder, through a pointer file.
+        A copy of the XML left in the folder by a previous run is replaced by the pointer.
+        :param changed: bool, whether `combined_file` has just been rewritten
+        """
+        xml_file = os.path.join(month_folder, os.path.basename(combined_file))
+        copy_removed = os.path.isfile(xml_file)
+        if copy_removed:
+            os.remove(xml_file)
+        if self.writer.write(xml_file + REF_SUFFIX, ref_data(month_folder, combined_file)) or copy_removed or changed:
+            self.index_xml(xml_file)
+
+    def write_combined_xml(self, feed_data, dev_folder, filename, month_folders):
+        """
+        Write the combined XML of a thread once, under the `_combined` folder of the mailing list, and point the
+        month folders of the thread to it.
+        """
+        combined_file = combined_path(dev_folder, filename)
+        self.create_folder(os.path.dirname(combined_file))
+        changed = self.writer.write(combined_file, render_feed(feed_data))
+        for month_folder in month_folders:
+            self.create_folder(month_folder)
+            self.link_combined(combined_file, month_folder, changed)
+        if changed:
+            # month folders of the thread outside of this run point to it too, their manifest entry is refreshed
+            linked = {os.path.normpath(month_folder) for month_folder in month_folders}
+            for month_folder in iter_month_folders(dev_folder):
+                if os.path.normpath(month_folder) not in linked and \
+                        os.path.exists(os.path.join(month_folder, filename + REF_SUFFIX)):
+                    self.index_xml(os.path.join(month_folder, filename))
+
+    def index_xml(self, xml_file):
+        # keep the month manifest and the archive store in sync with a (re)written XML
+        entry = update_manifest(os.path.dirname(xml_file), os.path.basename(xml_file))
+        self.archive_store.upsert_xml(xml_file, entry)
 
     def clean_title(self, xml_name):
         special_characters = ['/', ':', '@', '#', '$', '*', '&', '<', '>', '\\', '?']
@@ -235,7 +292,28 @@ class GenerateXML:
     def get_id(self, id):
         return str(id).split("-")[-1]
 
-    def append_columns(self, df_dict, file, title, namespace):
+    def load_xml_index(self, dev_folder):
+        """
+        Metadata of all the XMLs of a mailing list, read from the month manifests instead of parsing every file.
+        :return: dict, path -> manifest entry
+        """
+        self.xml_index = {}
+        self.xml_paths_by_thread = {}
+        self.xml_paths_by_name = {}
+        for month_folder in iter_month_folders(dev_folder):
+            for filename, entry in load_manifest(month_folder).items():
+                path = os.path.join(month_folder, filename).replace("\\", "/")
+                self.xml_index[path] = entry
+                if not entry["combined"]:
+                    self.xml_paths_by_thread.setdefault(thread_key(entry["title"]), []).append(path)
+                self.xml_paths_by_name.setdefault(filename, []).append(path)
+        return self.xml_index
+
+    def read_xml_summary(self, file):
+        month_folder, filename = os.path.split(file)
+        return read_summary(month_folder, filename, self.xml_index[file])
+
+    def append_columns(self, df_dict, file):
         df_dict["body_type"].append(0)
         df_dict["id"].append(file.split("/")[-1].split("_")[0])
         df_dict["type"].append(0)
@@ -243,31 +321,26 @@ class GenerateXML:
         df_dict["_id"].append(0)
         df_dict["_score"].append(0)
 
-        df_dict["title"].append(title)
+        df_dict["title"].append(self.xml_index[file]["title"])
         formatted_file_name = file.split("/static")[1]
         logger.info(formatted_file_name)
 
-        tree = ET.parse(file)
-        root = tree.getroot()
+        entry = self.xml_index[file]
 
-        date = root.find('atom:entry/atom:published', namespace).text
-        datetime_obj = datetime.strptime(date, "%Y-%m-%dT%H:%M:%S+00:00")
+        datetime_obj = datetime.strptime(entry["published"], "%Y-%m-%dT%H:%M:%S+00:00")
         timezone = pytz.UTC
         datetime_obj = datetime_obj.replace(tzinfo=timezone)
         df_dict["created_at"].append(datetime_obj)
 
-        link_element = root.find('atom:entry/atom:link', namespace)
-        link_href = link_element.get('href')
-        df_dict["url"].append(link_href)
+        df_dict["url"].append(entry["url"])
 
-        author = root.find('atom:author/atom:name', namespace).text
+        author = entry["authors"][0]
         author_result = re.sub(r"\d", "", author)
         author_result = author_result.replace(":", "")
         author_result = author_result.replace("-", "")
         df_dict["authors"].append([author_result.strip()])
 
-    def file_not_present_df(self, columns, source_cols, df_dict, files_list, dict_data, data,
-                            title, combined_filename, namespace):
+    def file_not_present_df(self, columns, source_cols, df_dict, files_list, dict_data, data):
         for col in columns:
             df_dict[col].append(dict_data[data][col])
 
@@ -279,56 +352,40 @@ class GenerateXML:
                 df_dict[col].append(datetime_obj)
             else:
                 df_dict[col].append(dict_data[data]['_source'][col])
+        # files_list only holds the XMLs of this thread
         for file in files_list:
-            file = file.replace("\\", "/")
             if os.path.exists(file):
-                tree = ET.parse(file)
-                root = tree.getroot()
-                file_title = root.find('atom:entry/atom:title', namespace).text
-
-                if title == file_title:
-                    self.append_columns(df_dict, file, title, namespace)
-
-                    if combined_filename in file:
-                        tree = ET.parse(file)
-                        root = tree.getroot()
-                        summary = root.find('atom:entry/atom:summary', namespace).text
-                        df_dict["body"].append(summary)
-                    else:
-                        summary = root.find('atom:entry/atom:summary', namespace).text
-                        df_dict["body"].append(summary)
+                self.append_columns(df_dict, file)
+                df_dict["body"].append(self.read_xml_summary(file))
             else:
                 logger.info(f"File not present:- {file}")
 
-    def file_present_df(self, files_list, namespace, combined_filename, title, xmls_list, df_dict):
-        combined_file_fullpath = None
+    def file_present_df(self, files_list, combined_xml, xmls_list, df_dict):
+        combined_files = self.xml_paths_by_name.get(combined_xml, [])
+        combined_file_fullpath = combined_files[-1] if combined_files else None
         month_folders = []
         for file in files_list:
-            file = file.replace("\\", "/")
-            if combined_filename in file:
-                combined_file_fullpath = file
-            tree = ET.parse(file)
-            root = tree.getroot()
-            file_title = root.find('atom:entry/atom:title', namespace).text
-            if title == file_title:
-                xmls_list.append(file)
-                month_folder_path = "/".join(file.split("/")[:-1])
-                if month_folder_path not in month_folders:
-                    month_folders.append(month_folder_path)
-
-        for month_folder in month_folders:
-            if combined_file_fullpath and combined_filename not in os.listdir(month_folder):
-                if combined_filename not in os.listdir(month_folder):
-                    shutil.copy(combined_file_fullpath, month_folder)
-
-        if len(xmls_list) > 0 and not any(combined_filename in item for item in files_list):
+            xmls_list.append(file)
+            month_folder_path = "/".join(file.split("/")[:-1])
+            if month_folder_path not in month_folders:
+                month_folders.append(month_folder_path)
+
+        if combined_file_fullpath:
+            dev_folder = os.path.dirname(os.path.dirname(combined_file_fullpath))
+            combined_file = combined_path(dev_folder, combined_xml)
+            if not os.path.exists(combined_file):
+                # the combined XML only exists as copies in month folders, one of them becomes the stored XML
+                self.create_folder(os.path.dirname(combined_file))
+                self.writer.copy(resolve_xml_path(*os.path.split(combined_file_fullpath)), combined_file)
+            for month_folder in month_folders:
+                if combined_xml not in list_xml_files(month_folder):
+                    self.link_combined(combined_file, month_folder)
+
+        if len(xmls_list) > 0 and not combined_files:
             logger.info("individual summaries are present but not combined")
             for file in xmls_list:
-                self.append_columns(df_dict, file, title, namespace)
-                tree = ET.parse(file)
-                root = tree.getroot()
-                summary = root.find('atom:entry/atom:summary', namespace).text
-                df_dict["body"].append(summary)
+                self.append_columns(df_dict, file)
+                df_dict["body"].append(self.read_xml_summary(file))
 
     def convert_to_tuple(self, x):
         try:
@@ -356,14 +413,12 @@ class GenerateXML:
         columns = ['_index', '_id', '_score']
         source_cols = ['body_type', 'created_at', 'id', 'title', 'body', 'type',
                        'url', 'authors']
-        namespace = {'atom': 'http://www.w3.org/2005/Atom'}
-
         current_directory = os.getcwd()
 
         if "lightning-dev" in dev_url:
-            files_list = glob.glob(os.path.join(current_directory, "static", "lightning-dev", "**/*.xml"), recursive=True)
+            self.load_xml_index(os.path.join(current_directory, "static", "lightning-dev"))
         else:
-            files_list = glob.glob(os.path.join(current_directory, "static", "bitcoin-dev", "**/*.xml"), recursive=True)
+            self.load_xml_index(os.path.join(current_directory, "static", "bitcoin-dev"))
 
         df_dict = {}
         for col in columns:
@@ -371,22 +426,41 @@ class GenerateXML:
         for col in source_cols:
             df_dict[col] = []
 
+        # subject variants ("Re: X", "Fwd: X", "[bitcoin-dev] X") and replies are resolved to a single thread
+        thread_titles = resolve_threads([dict_data[data]["_source"] for data in range(len(dict_data))])
+        thread_by_key = {}
+        keys_by_thread = {}
+        titles_by_thread = {}
+        for data, thread_title in enumerate(thread_titles):
+            title = dict_data[data]["_source"]["title"]
+            key = thread_key(title)
+            thread_by_key.setdefault(key, thread_title)
+            keys_by_thread.setdefault(thread_title, set()).add(key)
+            titles_by_thread.setdefault(thread_title, []).append(title)
+        # an existing combined XML keeps its (legacy) name, the thread is not summarized again under a new one
+        for thread_title, titles in titles_by_thread.items():
+            names = combined_filenames(thread_title, titles)
+            self.combined_names[thread_title] = next((name for name in names if name in self.xml_paths_by_name),
+                                                     names[0])
+
         for data in range(len(dict_data)):
             xmls_list = []
             number = self.get_id(dict_data[data]["_source"]["id"])
             title = dict_data[data]["_source"]["title"]
             xml_name = self.clean_title(title)
             file_name = f"{number}_{xml_name}.xml"
-            combined_filename = f"combined_{xml_name}.xml"
+            combined_xml = self.combined_names[thread_titles[data]]
+
+            files_list = [file for key in sorted(keys_by_thread[thread_titles[data]])
+                          for file in self.xml_paths_by_thread.get(key, [])]
 
-            if not any(file_name in item for item in files_list):
+            if file_name not in self.xml_paths_by_name:
                 logger.info(f"{file_name} is not present")
-                self.file_not_present_df(columns, source_cols, df_dict, files_list, dict_data, data,
-                                         title, combined_filename, namespace)
+                self.file_not_present_df(columns, source_cols, df_dict, files_list, dict_data, data)
 
             else:
                 logger.info(f"{file_name} already exist")
-                self.file_present_df(files_list, namespace, combined_filename, title, xmls_list, df_dict)
+                self.file_present_df(files_list, combined_xml, xmls_list, df_dict)
 
         emails_df = pd.DataFrame(df_dict)
 
@@ -395,6 +469,9 @@ class GenerateXML:
         emails_df['authors'] = emails_df['authors'].apply(self.preprocess_authors_name)
         emails_df['body'] = emails_df['body'].apply(preprocess_email)
         emails_df['title'] = emails_df['title'].apply(self.remove_multiple_whitespaces)
+        emails_df['thread_title'] = emails_df['title'].apply(
+            lambda title: thread_by_key.get(thread_key(title), canonical_subject(title)))
+        self.find_near_duplicates(emails_df, dev_url)
         logger.info(f"Shape of emails_df: {emails_df.shape}")
         return emails_df
 
@@ -427,7 +504,14 @@ class GenerateXML:
                         else:
                             link = f'lightning-dev/{str_month_year}/{number}_{xml_name}.xml'
                         return link
-                    summary = self.create_summary(cols['body'])
+                    # near-duplicates share the summary of the first message of their group
+                    summary_key = self.near_duplicate_of.get(number, number)
+                    if summary_key in self.summaries_by_number:
+                        summary = self.summaries_by_number[summary_key]
+                        self.llm_calls_deduplicated += 1
+                    else:
+                        summary = self.batched_summaries.pop(summary_key, None) or self.create_summary(cols['body'])
+                        self.summaries_by_number[summary_key] = summary
                     feed_data = {
                         'id': combine_flag,
                         'title': cols['title'],
@@ -444,13 +528,13 @@ class GenerateXML:
                         link = f'lightning-dev/{str_month_year}/{number}_{xml_name}.xml'
                     return link
 
+                self.batch_summaries(emails_df, url)
+
                 # combine_summary_xml
-                os_name = platform.system()
-                logger.info(f"Operating System: {os_name}")
-                titles = emails_df.sort_values('created_at')['title'].unique()
+                titles = emails_df.sort_values('created_at')['thread_title'].unique()
                 logger.info(f"Total titles in data: {len(titles)}")
                 for title_idx, title in tqdm(enumerate(titles)):
-                    title_df = emails_df[emails_df['title'] == title]
+                    title_df = emails_df[emails_df['thread_title'] == title]
                     title_df['authors'] = title_df['authors'].apply(self.convert_to_tuple)
                     title_df = title_df.drop_duplicates()
                     title_df['authors'] = title_df['authors'].apply(self.preprocess_authors_name)
@@ -461,86 +545,91 @@ class GenerateXML:
                     if len(title_df) == 1:
                         generate_local_xml(title_df.iloc[0], "0", url)
                         continue
-                    # body = title_df['body'].apply(str).tolist() + old_files_data_dict["summary_list"]
-                    combined_body = '\n\n'.join(title_df['body'].apply(str))
-                    # combined_body = '\n\n'.join(body)
-                    xml_name = self.clean_title(title)
                     combined_links = list(title_df.apply(generate_local_xml, args=("1", url), axis=1))
                     combined_authors = list(
                         title_df.apply(lambda x: f"{x['authors'][0]} {x['created_at']}", axis=1))
+                    # consolidate the summaries of the messages (new and existing ones) instead of their bodies
+                    combined_summary = self.consolidate_summaries(
+                        [self.message_summary(link) for link in combined_links])
 
                     month_year_group = \
                         title_df.groupby([title_df['created_at'].dt.month, title_df['created_at'].dt.year])
 
-                    flag = False
-                    std_file_path = ''
-                    for idx, (month_year, _) in enumerate(month_year_group):
+                    dev_folder = "static/bitcoin-dev" if "bitcoin-dev" in url else "static/lightning-dev"
+                    month_folders = []
+                    for month_year, _ in month_year_group:
                         logger.info(f"###### {month_year}")
                         month_name = self.month_dict[int(month_year[0])]
-                        str_month_year = f"{month_name}_{month_year[1]}"
-                        if "bitcoin-dev" in url:
-                            file_path = f"static/bitcoin-dev/{str_month_year}/combined_{xml_name}.xml"
-                        else:
-                            file_path = f"static/lightning-dev/{str_month_year}/combined_{xml_name}.xml"
-                        combined_summary = self.create_summary(combined_body)
-                        feed_data = {
-                            'id': "2",
-                            'title': 'Combined summary - ' + title,
-                            'authors': combined_authors,
-                            'url': title_df.iloc[0]['url'],
-                            'links': combined_links,
-                            'created_at': self.add_utc_if_not_present(title_df.iloc[0]['created_at_org']),
-                            'summary': combined_summary
-                        }
-                        if not flag:
-                            self.generate_xml(feed_data, file_path)
-                            std_file_path = file_path
-                            flag = True
-                        else:
-                            if os_name == "Windows":
-                                shutil.copy(std_file_path, file_path)
-                            elif os_name == "Linux":
-                                os.system(f"cp {std_file_path} {file_path}")
+                        month_folders.append(f"{dev_folder}/{month_name}_{month_year[1]}")
+                    feed_data = {
+                        'id': "2",
+                        'title': 'Combined summary - ' + title,
+                        'authors': combined_authors,
+                        'url': title_df.iloc[0]['url'],
+                        'links': combined_links,
+                        'created_at': self.add_utc_if_not_present(title_df.iloc[0]['created_at_org']),
+                        'summary': combined_summary
+                    }
+                    # stored once, the month folders of the thread point to it
+                    combined_xml = self.combined_names.get(title) or combined_filename(title)
+                    self.write_combined_xml(feed_data, dev_folder, combined_xml, month_folders)
+                self.writer.flush()
+                counts = self.writer.counts
+                logger.info(f"XML files: {counts['written']} written ({counts['changed']} changed), "
+                            f"{counts['skipped']} unchanged skipped")
+                logger.info(f"Fast path summaries: {self.llm_calls_avoided} LLM call(s) avoided")
+                logger.info(f"Near-duplicate messages: {self.llm_calls_deduplicated} summary call(s) deduplicated")
             else:
                 logger.info("No new files are found")
         else:
             logger.info("No input data found")
 
 
-if __name__ == "__main__":
+def generate_dev_xmls(dev_url, days=30, max_retries=5, delay=5, watermarks=None):
+    """
+    Generate the XMLs of the messages of a mailing list indexed since the last run (its watermark, minus an
+    overlap), or of the messages created in the last `days` days on the first run.
+    :param dev_url: str, url of the mailing list archive
+    :param max_retries: int, retries of the whole generation on OpenAI errors before giving up (re-raising)
+    :param watermarks: WatermarkStore, shared by the lists run together (a new store by default)
+    :return: dict, number of XML files `written` (new or changed), `changed` (existing files rewritten) and
+        `skipped` (unchanged)
+    """
     gen = GenerateXML()
     elastic_search = ElasticSearchClient(es_cloud_id=ES_CLOUD_ID, es_username=ES_USERNAME,
                                          es_password=ES_PASSWORD)
-    dev_urls = [
-        "https://lists.linuxfoundation.org/pipermail/bitcoin-dev/",
-        "https://lists.linuxfoundation.org/pipermail/lightning-dev/"
-    ]
-
-    current_date_str = None
-    if not current_date_str:
+    dev_name = dev_url.split("/")[-2]
+    watermarks = watermarks or WatermarkStore()
+    since = watermarks.since("generate_xmls", dev_name)
+    if since is None:
         current_date_str = datetime.now().strftime("%Y-%m-%d")
-
-    start_date = datetime.now() - timedelta(days=30)
-    start_date_str = start_date.strftime("%Y-%m-%d")
-    logger.info(f"start_data: {start_date_str}")
-    logger.info(f"current_date_str: {current_date_str}")
-
-    for dev_url in dev_urls:
+        start_date_str = (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d")
+        logger.info(f"No watermark yet, messages created from {start_date_str} to {current_date_str}")
         data_list = elastic_search.extract_data_from_es(ES_INDEX, dev_url, start_date_str, current_date_str)
-        dev_name = dev_url.split("/")[-2]
-        logger.info(f"Total threads received for {dev_name}: {len(data_list)}")
+    else:
+        logger.info(f"Messages indexed since: {since.isoformat()}")
+        data_list = elastic_search.extract_data_from_es(ES_INDEX, dev_url, since=since)
+    logger.info(f"Total threads received for {dev_name}: {len(data_list)}")
 
-        delay = 5
-        count_main = 0
+    count_main = 0
+    while True:
+        try:
+            gen.start(data_list, dev_url)
+            watermark = watermarks.advance("generate_xmls", dev_name, data_list)
+            logger.info(f"Watermark of {dev_name}: {watermark.isoformat() if watermark else None}")
+            return gen.writer.counts
+        except (APIError, PermissionError, AuthenticationError, InvalidAPIType, ServiceUnavailableError) as ex:
+            logger.error(str(ex))
+            logger.error(ex)
+            time.sleep(delay)
+            count_main += 1
+            if count_main > max_retries:
+                raise
 
-        while True:
-            try:
-                gen.start(data_list, dev_url)
-                break
-            except (APIError, PermissionError, AuthenticationError, InvalidAPIType, ServiceUnavailableError) as ex:
-                logger.error(str(ex))
-                logger.error(ex)
-                time.sleep(delay)
-                count_main += 1
-                if count_main > 5:
-                    sys.exit(ex)
+
+if __name__ == "__main__":
+    try:
+        watermarks = WatermarkStore()
+        run_per_list(lambda dev_url: generate_dev_xmls(dev_url, watermarks=watermarks))
+    except (APIError, PermissionError, AuthenticationError, InvalidAPIType, ServiceUnavailableError) as ex:
+        sys.exit(ex)